@@ -0,0 +1,180 @@
+"""
+colocation.py
+
+All-pairs time-together engine: for every pair of tracked people, the seconds per local day
+they were together and the seconds both their locations were known.
+
+Each person's timeline is loaded once as a LocationArray and shared with a pool of worker
+processes, which run the exact overlap sweep of analysis.overlap for their share of the
+pairs. A pair is only swept over the time both timelines cover, so people tracked in
+different years cost next to nothing.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from itertools import combinations
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from analysis.overlap import APART, TOGETHER, local_day_edges, seconds_in_windows, together_spans
+from analysis.percent_time_together import METER_THRESHOLD
+from db.db import LocationArray, LocationDB
+from profiling import profiling
+
+DB = LocationDB()
+# Pair chunks handed to each worker, to even out pairs of very different sizes
+CHUNKS_PER_JOB = 4
+
+
+class PairDay(NamedTuple):
+    person_a: str
+    person_b: str
+    day: str
+    seconds_together: int
+    # Seconds both locations were known (together or apart)
+    seconds_known: int
+
+
+class PairMonth(NamedTuple):
+    person_a: str
+    person_b: str
+    month: str
+    seconds_together: int
+    seconds_known: int
+
+
+# Set in each worker process by _init_worker
+_timelines: Dict[str, LocationArray] = {}
+_edges: np.ndarray = np.zeros(0, dtype=np.int64)
+_meter_threshold = METER_THRESHOLD
+
+
+def _init_worker(timelines: Dict[str, LocationArray], edges: np.ndarray, meter_threshold: float):
+    global _timelines, _edges, _meter_threshold
+    _timelines = timelines
+    _edges = edges
+    _meter_threshold = meter_threshold
+
+
+def _pair_seconds(person_a: str, person_b: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Returns (seconds together, seconds known) per day window for one pair, or None if the
+    two timelines never overlap in time.
+    """
+    a, b = _timelines[person_a], _timelines[person_b]
+    if len(a) == 0 or len(b) == 0:
+        return None
+    start_ts = max(int(_edges[0]), int(a.timestamp_from[0]), int(b.timestamp_from[0]))
+    end_ts = min(int(_edges[-1]), int(a.timestamp_to.max()), int(b.timestamp_to.max()))
+    if start_ts >= end_ts:
+        return None
+    spans = together_spans(a, b, start_ts, end_ts, _meter_threshold)
+    together = seconds_in_windows(spans, TOGETHER, _edges)
+    apart = seconds_in_windows(spans, APART, _edges)
+    return together, together + apart
+
+
+def _pair_chunk(pairs: List[Tuple[str, str]]) -> List[Tuple[str, str, np.ndarray, np.ndarray]]:
+    results = []
+    for person_a, person_b in pairs:
+        seconds = _pair_seconds(person_a, person_b)
+        if seconds is not None:
+            results.append((person_a, person_b, *seconds))
+    return results
+
+
+def _chunks(pairs: List[Tuple[str, str]], n: int) -> List[List[Tuple[str, str]]]:
+    # Round-robin, so each chunk gets a mix of early and late (large and small) pairs
+    return [chunk for chunk in (pairs[i::n] for i in range(n)) if chunk]
+
+
+def seconds_together_all_pairs(
+    start_date: str,
+    end_date: str,
+    people: Optional[Sequence[str]] = None,
+    meter_threshold: float = METER_THRESHOLD,
+    jobs: Optional[int] = None,
+) -> List[PairDay]:
+    """
+    Returns the tidy per-day table for every pair of people (everyone in the database by
+    default) over the local days start_date..end_date (YYYY-MM-DD, inclusive).
+
+    Pairs are ordered by name (person_a < person_b). Only days on which both locations were
+    known at some point get a row; missing rows mean zero seconds known. jobs is the number
+    of worker processes (all CPUs by default; 1 computes in this process).
+    """
+    people = sorted(set(people if people is not None else DB.get_persons()))
+    days, edges = local_day_edges(
+        datetime.strptime(start_date, "%Y-%m-%d").date(),
+        datetime.strptime(end_date, "%Y-%m-%d").date(),
+    )
+    start_ts, end_ts = int(edges[0]), int(edges[-1])
+    with profiling.stage("colocation.load") as stage:
+        timelines = {p: DB.get_location_array_in_range(p, start_ts, end_ts) for p in people}
+        stage.rows = sum(len(t) for t in timelines.values())
+    pairs = list(combinations(people, 2))
+    jobs = jobs or os.cpu_count() or 1
+
+    with profiling.stage("colocation.pairs") as stage:
+        if jobs == 1 or len(pairs) <= 1:
+            _init_worker(timelines, edges, meter_threshold)
+            try:
+                results = _pair_chunk(pairs)
+            finally:
+                _init_worker({}, np.zeros(0, dtype=np.int64), METER_THRESHOLD)
+        else:
+            with ProcessPoolExecutor(
+                max_workers=min(jobs, len(pairs)),
+                initializer=_init_worker,
+                initargs=(timelines, edges, meter_threshold),
+            ) as pool:
+                chunks = _chunks(pairs, min(jobs, len(pairs)) * CHUNKS_PER_JOB)
+                results = [r for chunk in pool.map(_pair_chunk, chunks) for r in chunk]
+        stage.rows = len(pairs)
+
+    rows = []
+    for person_a, person_b, together, known in sorted(results, key=lambda r: (r[0], r[1])):
+        for i in np.nonzero(known)[0]:
+            rows.append(PairDay(person_a, person_b, days[i], int(together[i]), int(known[i])))
+    return rows
+
+
+def by_month(rows: Iterable[PairDay]) -> List[PairMonth]:
+    """
+    Sums a per-day table into calendar months (YYYY-MM).
+    """
+    totals: Dict[Tuple[str, str, str], List[int]] = {}
+    for row in rows:
+        total = totals.setdefault((row.person_a, row.person_b, row.day[:7]), [0, 0])
+        total[0] += row.seconds_together
+        total[1] += row.seconds_known
+    return [PairMonth(a, b, month, together, known) for (a, b, month), (together, known) in sorted(totals.items())]
+
+
+def together_matrix(
+    rows: Iterable[PairDay], people: Sequence[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns symmetric N x N matrices of seconds together and seconds known over all rows,
+    indexed like people (the diagonal is zero).
+    """
+    index = {p: i for i, p in enumerate(people)}
+    together = np.zeros((len(people), len(people)), dtype=np.int64)
+    known = np.zeros((len(people), len(people)), dtype=np.int64)
+    for row in rows:
+        i, j = index.get(row.person_a), index.get(row.person_b)
+        if i is None or j is None:
+            continue
+        together[i, j] += row.seconds_together
+        known[i, j] += row.seconds_known
+    return together + together.T, known + known.T
+
+
+def default_range() -> Tuple[str, str]:
+    """
+    Returns the year to date, like seconds_together_per_day uses by default.
+    """
+    today = date.today()
+    return date(today.year, 1, 1).strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")
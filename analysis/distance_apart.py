@@ -5,16 +5,24 @@ Helper functions for calculating the distance between two people over time using
 """
 
 import math
-from typing import Generator, List, Optional
+from functools import partial
+from typing import Generator, Iterable, List, Optional, Tuple
+
+import numpy as np
+
 from analysis.places import Point
-from db.db import Location, LocationDB
+from analysis.result_cache import RESULTS, Dependency
+from analysis.sharding import SHARD_MONTHS, Shard, map_shards, month_shards
+from db.db import Location, LocationArray, LocationDB
+from profiling import profiling
 
 DB = LocationDB()
+EARTH_RADIUS_M = 6371000
 
 
 # Haversine formula for distance in meters
 def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000
+    R = EARTH_RADIUS_M
     phi1 = math.radians(lat1)
     phi2 = math.radians(lat2)
     dphi = math.radians(lat2 - lat1)
@@ -26,6 +34,55 @@ def haversine(lat1, lon1, lat2, lon2):
     return R * 2 * math.asin(math.sqrt(a))
 
 
+def haversine_np(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Vectorized haversine distance in meters over NumPy arrays (NaN in, NaN out).
+    """
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return EARTH_RADIUS_M * 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def sample_locations(
+    intervals: LocationArray, timestamps: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (lat, lon) arrays with the location at each timestamp, NaN where unknown.
+
+    Like LocationDB.get_location_at, each timestamp gets the latest-starting interval that
+    contains it (timestamp_from <= ts < timestamp_to). A device's stitched intervals do not
+    overlap, so per device a binary search for the latest interval starting at or before
+    ts finds the only candidate; with several devices (a watch's short intervals inside a
+    phone's long one) the latest-starting candidate across devices wins.
+    """
+    lat = np.full(len(timestamps), np.nan)
+    lon = np.full(len(timestamps), np.nan)
+    if len(intervals) == 0:
+        return lat, lon
+    timestamp_from = intervals.timestamp_from
+    timestamp_to = intervals.timestamp_to
+    if np.all(timestamp_to[1:] >= timestamp_to[:-1]):
+        # No interval ends after a later-starting one, so the latest start is the only candidate
+        rows = [np.arange(len(intervals))]
+    else:
+        rows = [np.flatnonzero(intervals.device_codes == code) for code in np.unique(intervals.device_codes)]
+    best = np.full(len(timestamps), -1)
+    best_from = np.full(len(timestamps), np.iinfo(np.int64).min)
+    for device_rows in rows:
+        idx = np.searchsorted(timestamp_from[device_rows], timestamps, side="right") - 1
+        row = device_rows[np.maximum(idx, 0)]
+        known = (idx >= 0) & (timestamps < timestamp_to[row]) & (timestamp_from[row] >= best_from)
+        best[known] = row[known]
+        best_from[known] = timestamp_from[row[known]]
+    known = best >= 0
+    lat[known] = intervals.lat[best[known]]
+    lon[known] = intervals.lon[best[known]]
+    return lat, lon
+
+
 def find_loc(intervals: List[Location], ts: int) -> Optional[Point]:
     """
     Find the location (latitude, longitude) for a given timestamp within a list of intervals.
@@ -37,11 +94,15 @@ def find_loc(intervals: List[Location], ts: int) -> Optional[Point]:
 
 
 def location_generator(
-    intervals: List[Location], timestamps: List[int]
+    intervals: Iterable[Location], timestamps: Iterable[int]
 ) -> Generator[Optional[Point], None, None]:
     """
     Yields the location for each timestamp, advancing the interval generator as needed.
-    Assumes intervals are sorted by timestamp_from.
+    Assumes intervals are sorted by timestamp_from, and timestamps ascending.
+
+    Only the current interval is held, so with intervals streamed from
+    LocationDB.iter_locations_in_range and timestamps from a range() it runs over any
+    length of time in constant memory.
     """
     interval_iter = iter(intervals)
     current = next(interval_iter, None)
@@ -60,28 +121,83 @@ def location_generator(
             yield None
 
 
-def distance_apart_per_minute(
-    person_a: str, person_b: str, start_ts: int, end_ts: int
-) -> List[float]:
+def _distance_shard(
+    person_a: str, person_b: str, start_ts: int, period: int, shard: Shard
+) -> np.ndarray:
+    # Shard edges are on the sampling grid, so the shards' samples concatenate to the full run
+    intervals_a = DB.get_location_array_for_sampling(person_a, shard.from_ts, shard.to_ts, start_ts)
+    intervals_b = DB.get_location_array_for_sampling(person_b, shard.from_ts, shard.to_ts, start_ts)
+    timestamps = shard.from_ts + period * np.arange((shard.to_ts - shard.from_ts) // period, dtype=np.int64)
+    lat_a, lon_a = sample_locations(intervals_a, timestamps)
+    lat_b, lon_b = sample_locations(intervals_b, timestamps)
+    return haversine_np(lat_a, lon_a, lat_b, lon_b)
+
+
+def _sampling_shards(start_ts: int, end_ts: int, period: int, months: int) -> List[Shard]:
     """
-    Returns an array of the distance between person_a and person_b in each minute between start_ts and end_ts.
+    Returns month shards of the samples start_ts + period * k below end_ts, with every edge
+    moved up to the next sample.
+    """
+    grid_end = start_ts + period * ((end_ts - start_ts) // period)
+    edges = {grid_end}
+    for shard in month_shards(start_ts, grid_end, months):
+        edges.add(start_ts + period * -(-(shard.from_ts - start_ts) // period))
+    edges = sorted(edges)
+    return [Shard(i, edges[i], edges[i + 1]) for i in range(len(edges) - 1)]
+
+
+def distance_apart(
+    person_a: str,
+    person_b: str,
+    start_ts: int,
+    end_ts: int,
+    period: int = 60,
+    jobs: int = 1,
+    shard_months: int = SHARD_MONTHS,
+) -> np.ndarray:
+    """
+    Returns the distance in meters between person_a and person_b sampled every period
+    seconds from start_ts (inclusive) to end_ts (exclusive), as an ndarray with NaN
+    wherever either location is unknown.
     start_ts and end_ts are epoch seconds.
+
+    With jobs > 1 (None for every CPU) the range is split into shard_months shards, each
+    loading and sampling only its own part in a worker process.
     """
-    intervals_a = DB.get_locations_in_range(person_a, start_ts, end_ts)
+    if jobs != 1:
+        with profiling.stage("distance.sample") as stage:
+            shards = _sampling_shards(start_ts, end_ts, period, shard_months)
+            parts = map_shards(partial(_distance_shard, person_a, person_b, start_ts, period), shards, jobs)
+            distances = np.concatenate(parts) if parts else np.zeros(0)
+            stage.rows = len(distances)
+            return distances
+
+    intervals_a = DB.get_location_array_in_range(person_a, start_ts, end_ts)
     print(f"Got {len(intervals_a)} intervals for {person_a}")
-    intervals_b = DB.get_locations_in_range(person_b, start_ts, end_ts)
+    intervals_b = DB.get_location_array_in_range(person_b, start_ts, end_ts)
     print(f"Got {len(intervals_b)} intervals for {person_b}")
 
-    minutes_in_range = [start_ts + 60 * i for i in range((end_ts - start_ts) // 60)]
-    distances = []
+    with profiling.stage("distance.sample") as stage:
+        timestamps = start_ts + period * np.arange((end_ts - start_ts) // period, dtype=np.int64)
+        lat_a, lon_a = sample_locations(intervals_a, timestamps)
+        lat_b, lon_b = sample_locations(intervals_b, timestamps)
+        stage.rows = len(timestamps)
+        return haversine_np(lat_a, lon_a, lat_b, lon_b)
 
-    a_intervals = location_generator(intervals_a, minutes_in_range)
-    b_intervals = location_generator(intervals_b, minutes_in_range)
 
-    for ts, a_point, b_point in zip(minutes_in_range, a_intervals, b_intervals):
-        if a_point and b_point:
-            dist = haversine(a_point.lat, a_point.lon, b_point.lat, b_point.lon)
-            distances.append(dist)
-        else:
-            distances.append(0.0)
-    return distances
+def distance_apart_per_minute(
+    person_a: str, person_b: str, start_ts: int, end_ts: int, jobs: int = 1
+) -> np.ndarray:
+    """
+    Returns an array of the distance between person_a and person_b in each minute between start_ts and end_ts.
+    start_ts and end_ts are epoch seconds. Minutes where either location is unknown are NaN.
+    Results are cached (see analysis.result_cache) until either person's data in the range changes.
+    """
+    return RESULTS.get_or_compute(
+        DB,
+        "distance_apart.distance_apart_per_minute",
+        (person_a, person_b, start_ts, end_ts),
+        (EARTH_RADIUS_M,),
+        [Dependency(person_a, start_ts, end_ts), Dependency(person_b, start_ts, end_ts)],
+        lambda: distance_apart(person_a, person_b, start_ts, end_ts, period=60, jobs=jobs),
+    )
@@ -0,0 +1,111 @@
+"""
+overlap.py
+
+Exact interval-overlap engine for time-together analysis.
+
+Two people's interval streams are merged on every interval boundary, giving elementary
+segments during which neither location changes. Each segment is classified as together,
+apart or unknown, and consecutive segments with the same state are merged into maximal
+spans at full timestamp precision. Spans can then be summed over arbitrary windows, such
+as local days (which are 23 or 25 hours long on DST transitions).
+"""
+
+import time
+from datetime import date, timedelta
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+from analysis.distance_apart import haversine_np, sample_locations
+from db.db import LocationArray
+
+TOGETHER = 1
+APART = 0
+UNKNOWN = -1
+
+
+class Spans(NamedTuple):
+    """
+    Contiguous spans [start[i], end[i]) covering a range, each with one state.
+    """
+
+    start: np.ndarray
+    end: np.ndarray
+    state: np.ndarray
+
+
+def together_spans(
+    intervals_a: LocationArray,
+    intervals_b: LocationArray,
+    start_ts: int,
+    end_ts: int,
+    meter_threshold: float,
+) -> Spans:
+    """
+    Returns the maximal together/apart/unknown spans covering [start_ts, end_ts).
+
+    Together means both locations are known and at most meter_threshold apart; unknown
+    means at least one location is unknown.
+    """
+    edges = np.concatenate(
+        [
+            np.array([start_ts, end_ts], dtype=np.int64),
+            intervals_a.timestamp_from,
+            intervals_a.timestamp_to,
+            intervals_b.timestamp_from,
+            intervals_b.timestamp_to,
+        ]
+    )
+    edges = np.unique(edges[(edges >= start_ts) & (edges <= end_ts)])
+    seg_start = edges[:-1]
+    seg_end = edges[1:]
+
+    # Locations are constant within a segment, so sampling its start is exact
+    lat_a, lon_a = sample_locations(intervals_a, seg_start)
+    lat_b, lon_b = sample_locations(intervals_b, seg_start)
+    distance = haversine_np(lat_a, lon_a, lat_b, lon_b)
+    state = np.where(
+        np.isnan(distance),
+        UNKNOWN,
+        np.where(distance <= meter_threshold, TOGETHER, APART),
+    ).astype(np.int8)
+
+    if len(state) == 0:
+        return Spans(seg_start, seg_end, state)
+    # Merge runs of equal state into maximal spans
+    run_starts = np.concatenate([[0], np.nonzero(state[1:] != state[:-1])[0] + 1])
+    run_ends = np.concatenate([run_starts[1:], [len(state)]])
+    return Spans(seg_start[run_starts], seg_end[run_ends - 1], state[run_starts])
+
+
+def seconds_in_windows(spans: Spans, state: int, edges: np.ndarray) -> np.ndarray:
+    """
+    Returns the seconds spent in state within each window [edges[i], edges[i + 1]).
+    """
+    if len(spans.start) == 0:
+        return np.zeros(max(len(edges) - 1, 0), dtype=np.int64)
+    in_state = spans.state == state
+    durations = np.where(in_state, spans.end - spans.start, 0)
+    cumulative = np.concatenate([[0], np.cumsum(durations)])
+
+    # Seconds in state from the first span's start up to each edge
+    t = np.clip(edges, spans.start[0], spans.end[-1])
+    k = np.clip(np.searchsorted(spans.start, t, side="right") - 1, 0, len(spans.start) - 1)
+    upto = cumulative[k] + np.where(in_state[k], t - spans.start[k], 0)
+    return np.diff(upto)
+
+
+def local_day_edges(start_date: date, end_date: date) -> Tuple[List[str], np.ndarray]:
+    """
+    Returns the days from start_date through end_date as YYYY-MM-DD strings, and the
+    local-midnight timestamps bounding them (one more edge than days).
+    """
+    days = []
+    edges = []
+    d = start_date
+    while d <= end_date + timedelta(days=1):
+        edges.append(int(time.mktime(d.timetuple())))
+        if d <= end_date:
+            days.append(d.strftime("%Y-%m-%d"))
+        d += timedelta(days=1)
+    return days, np.array(edges, dtype=np.int64)
@@ -1,9 +1,19 @@
 import logging
 import sys
-from typing import Dict
+from typing import Dict, NamedTuple
+
+from analysis.result_cache import RESULTS, Dependency
 from db.db import LocationDB
-from datetime import datetime, timedelta, date
-from analysis.distance_apart import distance_apart_per_minute
+from profiling import profiling
+from datetime import datetime, date
+from analysis.overlap import (
+    APART,
+    TOGETHER,
+    UNKNOWN,
+    local_day_edges,
+    seconds_in_windows,
+    together_spans,
+)
 
 PERSON_A = "jackie"
 PERSON_B = "zach"
@@ -14,52 +24,77 @@ DB = LocationDB()
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 
-def get_minutes_in_day(date):
-    from datetime import datetime, timedelta
-
-    dt = datetime.strptime(date, "%Y-%m-%d")
-    start = int(dt.timestamp())
-    end = int((dt + timedelta(days=1)).timestamp())
-    return [start + 60 * i for i in range((end - start) // 60)]
+class DayTogether(NamedTuple):
+    seconds_together: int
+    seconds_apart: int
+    seconds_unknown: int
+    # Length of the local day: 86400, or 82800/90000 on DST transitions
+    day_seconds: int
 
 
-def get_days_in_range(start_date, end_date):
-    days = []
-    d = datetime.strptime(start_date, "%Y-%m-%d").date()
-    end_d = datetime.strptime(end_date, "%Y-%m-%d").date()
-    while d <= end_d:
-        days.append(d.strftime("%Y-%m-%d"))
-        d += timedelta(days=1)
-    return days
+def seconds_together_per_day(
+    start_date=None, end_date=None, person_a=PERSON_A, person_b=PERSON_B
+) -> Dict[str, DayTogether]:
+    """
+    Returns exact seconds together, apart and unknown for each local day in the range.
 
-
-def percent_minutes_spent_together(start_date=None, end_date=None) -> Dict[str, int]:
+    The two timelines are merged with a sweep over interval boundaries (see
+    analysis.overlap), and the resulting spans are split at local midnights. Results are
+    cached (see analysis.result_cache) until either person's data in the range changes.
+    """
     today = date.today()
     year_start = date(today.year, 1, 1)
     if not start_date:
         start_date = year_start.strftime("%Y-%m-%d")
     if not end_date:
         end_date = today.strftime("%Y-%m-%d")
-    days = get_days_in_range(start_date, end_date)
+    days, edges = local_day_edges(
+        datetime.strptime(start_date, "%Y-%m-%d").date(),
+        datetime.strptime(end_date, "%Y-%m-%d").date(),
+    )
+    start_ts = int(edges[0])
+    end_ts = int(edges[-1])
+    return RESULTS.get_or_compute(
+        DB,
+        "percent_time_together.seconds_together_per_day",
+        (start_date, end_date, person_a, person_b),
+        (METER_THRESHOLD,),
+        [Dependency(person_a, start_ts, end_ts), Dependency(person_b, start_ts, end_ts)],
+        lambda: _seconds_together_per_day(days, edges, person_a, person_b),
+    )
 
-    # Pull all distances in one query
-    dt_start = datetime.strptime(start_date, "%Y-%m-%d")
-    dt_end = datetime.strptime(end_date, "%Y-%m-%d")
-    start_ts = int(dt_start.timestamp())
-    end_ts = int((dt_end + timedelta(days=1)).timestamp())
-    all_distances = distance_apart_per_minute(PERSON_A, PERSON_B, start_ts, end_ts)
 
-    minutes_per_day = {}
-    minutes_per_day_list = [
-        all_distances[i : i + 1440] for i in range(0, len(all_distances), 1440)
-    ]
-    for idx, day in enumerate(days):
-        distances_apart = (
-            minutes_per_day_list[idx] if idx < len(minutes_per_day_list) else []
-        )
-        minutes = sum(1 for d in distances_apart if d <= METER_THRESHOLD)
-        minutes_per_day[day] = minutes
-    return minutes_per_day
+def _seconds_together_per_day(days, edges, person_a: str, person_b: str) -> Dict[str, DayTogether]:
+    start_ts = int(edges[0])
+    end_ts = int(edges[-1])
+    intervals_a = DB.get_location_array_in_range(person_a, start_ts, end_ts)
+    logging.info(f"Got {len(intervals_a)} intervals for {person_a}")
+    intervals_b = DB.get_location_array_in_range(person_b, start_ts, end_ts)
+    logging.info(f"Got {len(intervals_b)} intervals for {person_b}")
+
+    with profiling.stage("together.spans") as stage:
+        spans = together_spans(intervals_a, intervals_b, start_ts, end_ts, METER_THRESHOLD)
+        stage.rows = len(spans.start)
+    with profiling.stage("together.windows") as stage:
+        together = seconds_in_windows(spans, TOGETHER, edges)
+        apart = seconds_in_windows(spans, APART, edges)
+        unknown = seconds_in_windows(spans, UNKNOWN, edges)
+        stage.rows = len(days)
+    day_seconds = edges[1:] - edges[:-1]
+    return {
+        day: DayTogether(int(together[i]), int(apart[i]), int(unknown[i]), int(day_seconds[i]))
+        for i, day in enumerate(days)
+    }
+
+
+def percent_minutes_spent_together(start_date=None, end_date=None) -> Dict[str, int]:
+    """
+    Returns whole minutes spent together per local day (see seconds_together_per_day).
+    """
+    return {
+        day: summary.seconds_together // 60
+        for day, summary in seconds_together_per_day(start_date, end_date).items()
+    }
 
 
 if __name__ == "__main__":
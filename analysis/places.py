@@ -1,7 +1,14 @@
+from functools import partial
 from time import mktime, strptime
 from geocode.geocode import Geocoder, PlaceInfo
-from typing import List, Tuple, Dict
-from db.db import LocationDB
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from analysis.result_cache import RESULTS, Dependency
+from analysis.sharding import SHARD_MONTHS, Shard, map_shards, month_shards
+from db.db import DwellCell, LocationDB
+from profiling import profiling
+
+if TYPE_CHECKING:
+    from analysis.staypoints import StayCells, StayCluster
 
 
 class Point:
@@ -15,48 +22,182 @@ class Point:
 
 # Granularity: ~0.001 deg lat/lon ≈ 100m, good for distinguishing places ~1 mile apart
 ROUND_DIGITS = 2
+# Clusters are geocoded at lat/lon rounded to this many digits (~100 m), so that places
+# the clustering tells apart get their own names
+GEOCODE_ROUND_DIGITS = 3
 DB = LocationDB()
 GEOCODER = Geocoder()
 
 
-def cluster_locations_by_time(person: str, year: str) -> List[Tuple[Point, float]]:
+def _year_range(year: str) -> Tuple[int, int]:
     year_start_ts = int(mktime(strptime(f"{year}-01-01", "%Y-%m-%d")))
     year_end_ts = int(mktime(strptime(f"{year}-12-31", "%Y-%m-%d")))
-    locations = DB.get_locations_in_range(
+    return year_start_ts, year_end_ts
+
+
+def _dwell_shard(person: str, from_ts: int, shard: Shard) -> List[DwellCell]:
+    # Every cell, even at zero seconds, so first_seen/last_seen merge like one query
+    return DB.get_dwell_by_cell_in_range(
         person=person,
-        from_ts=year_start_ts,
-        to_ts=year_end_ts,
+        from_ts=from_ts,
+        to_ts=shard.to_ts,
+        digits=ROUND_DIGITS,
+        min_seconds=-1,
+        starts_from=None if shard.first else shard.from_ts,
+    )
+
+
+def _merge_dwell_cells(parts: List[List[DwellCell]], min_seconds: float) -> List[DwellCell]:
+    """
+    Sums per-shard cells and orders them like get_dwell_by_cell_in_range (most time first,
+    ties by cell, i.e. by lat then lon).
+    """
+    merged: Dict[Tuple[float, float], DwellCell] = {}
+    for part in parts:
+        for cell in part:
+            key = (cell.lat, cell.lon)
+            seen = merged.get(key)
+            if seen is not None:
+                cell = DwellCell(
+                    cell.lat,
+                    cell.lon,
+                    seen.seconds + cell.seconds,
+                    min(seen.first_seen, cell.first_seen),
+                    max(seen.last_seen, cell.last_seen),
+                )
+            merged[key] = cell
+    cells = [cell for cell in merged.values() if cell.seconds > min_seconds]
+    cells.sort(key=lambda cell: (-cell.seconds, cell.lat, cell.lon))
+    return cells
+
+
+def cluster_locations_by_time(
+    person: str,
+    year: str,
+    hour_threshold: Optional[float] = None,
+    jobs: int = 1,
+    shard_months: int = SHARD_MONTHS,
+) -> List[Tuple[Point, float]]:
+    """
+    Returns (point, hours) per ROUND_DIGITS grid cell for the person's intervals in the
+    year, most time first, optionally only cells with more than hour_threshold hours.
+
+    The grouping, sum and threshold are done by SQLite over the indexed cell column. With
+    jobs > 1 (None for every CPU) the year is split into shard_months shards summed by
+    worker processes.
+    """
+    year_start_ts, year_end_ts = _year_range(year)
+    min_seconds = hour_threshold * 3600 if hour_threshold is not None else 0
+    if jobs == 1:
+        cells = DB.get_dwell_by_cell_in_range(
+            person=person,
+            from_ts=year_start_ts,
+            to_ts=year_end_ts,
+            digits=ROUND_DIGITS,
+            min_seconds=min_seconds,
+        )
+    else:
+        shards = month_shards(year_start_ts, year_end_ts, shard_months)
+        parts = map_shards(partial(_dwell_shard, person, year_start_ts), shards, jobs)
+        cells = _merge_dwell_cells(parts, min_seconds)
+    return [(Point(cell.lat, cell.lon), cell.seconds / 3600.0) for cell in cells]
+
+
+def _stay_shard(person: str, from_ts: int, shard: Shard) -> "StayCells":
+    from analysis.staypoints import stay_cells
+
+    steps = DB.get_steps_in_range(
+        person, from_ts, shard.to_ts, starts_from=None if shard.first else shard.from_ts
     )
-    clusters: Dict[Tuple[float, float], float] = {}
-    for loc in locations:
-        # Round lat/lon to desired granularity
-        lat_r = round(loc["lat"], ROUND_DIGITS)
-        lon_r = round(loc["lon"], ROUND_DIGITS)
-        key = (lat_r, lon_r)
-        # Time spent at this location (seconds)
-        timestamp_to = loc["timestamp_to"]
-        if timestamp_to >= 2147483647:  # int max indicates "end" point
-            continue
-
-        duration = max(0, timestamp_to - loc["timestamp_from"])
-        clusters[key] = clusters.get(key, 0) + duration
-    # Convert to Point objects and hours spent
-    result = [(Point(lat, lon), t / 3600.0) for (lat, lon), t in clusters.items()]
-    # Sort by time spent descending
-    result.sort(key=lambda x: -x[1])
-    return result
+    return stay_cells(steps)
+
+
+def cluster_stays_by_time(
+    person: str,
+    year: str,
+    hour_threshold: Optional[float] = None,
+    jobs: int = 1,
+    shard_months: int = SHARD_MONTHS,
+) -> List["StayCluster"]:
+    """
+    Returns the places the person stayed at in the year (see analysis.staypoints), most
+    time first, optionally only those with more than hour_threshold hours.
+
+    Reads the same intervals as cluster_locations_by_time. With jobs > 1 (None for every
+    CPU) the year is split into shard_months shards whose micro-cells are summed by worker
+    processes; the clustering runs once on the merged micro-cells.
+    """
+    # Keeps NumPy out of the CLI's startup and the rollup path
+    from analysis.staypoints import cluster_stay_cells, merge_stay_cells
+
+    year_start_ts, year_end_ts = _year_range(year)
+    if jobs == 1:
+        shards = [Shard(0, year_start_ts, year_end_ts)]
+    else:
+        shards = month_shards(year_start_ts, year_end_ts, shard_months)
+    with profiling.stage("places.stay_cells") as stage:
+        cells = merge_stay_cells(map_shards(partial(_stay_shard, person, year_start_ts), shards, jobs))
+        stage.rows = len(cells.keys)
+    with profiling.stage("places.cluster") as stage:
+        clusters = cluster_stay_cells(cells)
+        stage.rows = len(clusters)
+    if hour_threshold is not None:
+        clusters = [cluster for cluster in clusters if cluster.hours > hour_threshold]
+    return clusters
 
 
 def top_locations(
-    person: str, year: int, hour_threshold=24
-) -> List[Tuple[PlaceInfo, float]]:
+    person: str, year: int, hour_threshold=24, jobs: int = 1
+) -> List[Tuple[PlaceInfo, "StayCluster"]]:
     """
-    Returns a list of all places the person spent more than hour_threshold hours at in the given year.
+    Returns all places the person spent more than hour_threshold hours at in the given
+    year, clustered by cluster_stays_by_time, with each place's most visited spot geocoded.
 
-    Geocodes the places, returning a list of tuples containing the point, place name, and time spent.
+    The clusters are cached (see analysis.result_cache) until the person's data for the
+    year changes. They are geocoded on every call (mostly from the geocode cache), so a
+    failed lookup is retried as the geocode cache's negative_ttl allows.
+    """
+    from analysis import staypoints
+
+    year = str(year)
+    clusters = RESULTS.get_or_compute(
+        DB,
+        "places.top_clusters",
+        (person, year, hour_threshold),
+        (
+            staypoints.MAX_STAY_SPEED_MPS,
+            staypoints.MICRO_CELL_DIGITS,
+            staypoints.CLUSTER_RADIUS_M,
+            staypoints.MIN_CORE_SECONDS,
+        ),
+        [Dependency(person, *_year_range(year))],
+        lambda: cluster_stays_by_time(person, year, hour_threshold, jobs=jobs),
+    )
+    with profiling.stage("places.geocode") as stage:
+        place_infos = dict(
+            GEOCODER.get_place_info_many(
+                ((cluster.rep_lat, cluster.rep_lon) for cluster in clusters),
+                round_digits=GEOCODE_ROUND_DIGITS,
+            )
+        )
+        stage.rows = len(place_infos)
+    return [(place_infos[i], cluster) for i, cluster in enumerate(clusters)]
+
+
+def top_locations_in_range(
+    person: str, start_date: str, end_date: str, hour_threshold=24
+) -> List[Tuple[PlaceInfo, float]]:
+    """
+    Like top_locations, but for any range of local days (YYYY-MM-DD, inclusive), answered
+    from the dwell_daily rollup with one indexed SUM instead of scanning every interval.
+    Each interval counts towards the day it starts on.
     """
-    places = cluster_locations_by_time(person, year)
-    return [
-        (GEOCODER.get_place_info(point.lat, point.lon), hours)
-        for point, hours in filter(lambda x: x[1] > hour_threshold, places)
+    cells = [
+        cell
+        for cell in DB.get_dwell_by_cell(person, start_date, end_date)
+        if cell.seconds / 3600.0 > hour_threshold
     ]
+    with profiling.stage("places.geocode") as stage:
+        place_infos = dict(GEOCODER.get_place_info_many((cell.lat, cell.lon) for cell in cells))
+        stage.rows = len(place_infos)
+    return [(place_infos[i], cell.seconds / 3600.0) for i, cell in enumerate(cells)]
@@ -0,0 +1,160 @@
+"""
+result_cache.py
+
+Disk-backed memo of analysis results, in an SQLite file like the geocode cache.
+
+An entry is keyed on the function, its arguments and the algorithm constants it depends
+on, and remembers the data versions (LocationDB.get_data_versions) of every person and
+local month it was computed from. It is only reused while those are unchanged, so
+importing new March data leaves last year's cached reports valid. Values are pickled; the
+least recently used entries are evicted once the results take more than max_bytes.
+"""
+
+import argparse
+import atexit
+import hashlib
+import pickle
+import sqlite3
+import time
+from typing import Callable, Iterable, NamedTuple, Optional, TypeVar
+
+from db.db import LocationDB
+from profiling import profiling
+
+RESULT_CACHE_DB = "analysis_cache.db"
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+# Bump when a cached function's result changes shape, so older entries are ignored
+CACHE_FORMAT = 1
+
+T = TypeVar("T")
+
+
+class Dependency(NamedTuple):
+    """
+    The intervals of a person overlapping [from_ts, to_ts) that a result was computed from.
+    """
+
+    person: str
+    from_ts: int
+    to_ts: int
+
+
+class ResultCache:
+    """
+    Pickled analysis results in an SQLite table, opened on first use.
+
+    With enabled False, get_or_compute always computes and never touches the file.
+    """
+
+    def __init__(self, db_path: str = RESULT_CACHE_DB, max_bytes: int = MAX_CACHE_BYTES, enabled: bool = True):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    function TEXT NOT NULL,
+                    versions TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_used ON results(last_used)")
+            conn.commit()
+            self._conn = conn
+            atexit.register(self.close)
+        return self._conn
+
+    def get_or_compute(
+        self,
+        db: LocationDB,
+        function: str,
+        args: tuple,
+        constants: tuple,
+        depends: Iterable[Dependency],
+        compute: Callable[[], T],
+    ) -> T:
+        """
+        Returns the cached result of function(*args) if the data it was computed from is
+        unchanged, otherwise compute() (which is then cached).
+
+        args must identify the result (defaults resolved, no worker counts), and constants
+        hold every module setting the result depends on.
+        """
+        if not self.enabled:
+            return compute()
+        versions = [db.get_data_versions(*dependency) for dependency in depends]
+        if any(v is None for v in versions):
+            # The database has no data versions yet; nothing can be reused safely
+            return compute()
+        key = hashlib.sha256(repr((CACHE_FORMAT, function, args, constants)).encode()).hexdigest()
+        stamp = repr(versions)
+        conn = self._connect()
+        row = conn.execute("SELECT versions, value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[0] == stamp:
+            conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            profiling.count("results.hits")
+            return pickle.loads(row[1])
+        profiling.count("results.misses")
+        result = compute()
+        value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO results (key, function, versions, value, size, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (key, function, stamp, value, len(value), time.time()),
+        )
+        self._evict(conn)
+        conn.commit()
+        return result
+
+    def _evict(self, conn: sqlite3.Connection):
+        """
+        Deletes the least recently used entries until the rest fit in max_bytes.
+        """
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+        profiling.count("results.evicted", len(evicted))
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM results")
+        conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            atexit.unregister(self.close)
+
+
+RESULTS = ResultCache()
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"recompute instead of reusing results cached in {RESULT_CACHE_DB}",
+    )
+
+
+def configure_cache(args: argparse.Namespace):
+    RESULTS.enabled = not args.no_cache
@@ -0,0 +1,69 @@
+"""
+sharding.py
+
+Splits a long time range into shards (local calendar months by default) and runs a
+function over them in a pool of worker processes.
+
+The analyses own their shard functions and merges: each shard only counts what starts
+inside it and reads whatever margin past its end it needs (a day for travel detection),
+so merging the partial results gives exactly the single-process answer.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Callable, List, NamedTuple, Optional, TypeVar
+
+# Calendar months per shard
+SHARD_MONTHS = 1
+
+T = TypeVar("T")
+
+
+class Shard(NamedTuple):
+    """
+    The half-open range [from_ts, to_ts) of a shard; index 0 is the first shard of a range.
+    """
+
+    index: int
+    from_ts: int
+    to_ts: int
+
+    @property
+    def first(self) -> bool:
+        return self.index == 0
+
+
+def month_shards(start_ts: int, end_ts: int, months: int = SHARD_MONTHS) -> List[Shard]:
+    """
+    Returns consecutive shards covering [start_ts, end_ts) whose inner edges are the local
+    midnights starting every months-th calendar month.
+    """
+    if months < 1:
+        raise ValueError("months must be at least 1")
+    edges = [start_ts]
+    d = date.fromtimestamp(start_ts).replace(day=1)
+    while True:
+        month = d.month - 1 + months
+        d = date(d.year + month // 12, month % 12 + 1, 1)
+        edge = int(time.mktime(d.timetuple()))
+        if edge >= end_ts:
+            break
+        edges.append(edge)
+    edges.append(end_ts)
+    return [Shard(i, edges[i], edges[i + 1]) for i in range(len(edges) - 1) if edges[i] < edges[i + 1]]
+
+
+def map_shards(func: Callable[[Shard], T], shards: List[Shard], jobs: Optional[int] = 1) -> List[T]:
+    """
+    Returns [func(shard) for shard in shards], computed by up to jobs worker processes.
+
+    func must be picklable (a module-level function or a functools.partial of one). jobs
+    None uses every CPU; with jobs == 1, or a single shard, everything runs in this process.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(shards) <= 1:
+        return [func(shard) for shard in shards]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(shards))) as pool:
+        return list(pool.map(func, shards))
@@ -0,0 +1,270 @@
+"""
+staypoints.py
+
+Time-weighted density clustering (DBSCAN with dwell time as the weight) of the places a
+person stays at.
+
+1. Intervals the device left at MAX_STAY_SPEED_MPS or slower are stays; driving through a
+   place is not.
+2. Their dwell time is summed per micro-cell (lat/lon rounded to MICRO_CELL_DIGITS, ~10 m)
+   at the dwell-weighted mean location. However many fixes a place has, it becomes a
+   bounded number of micro-cells, and shards of a range merge by adding their sums.
+3. A micro-cell is a core if the micro-cells within radius_m of it hold at least
+   min_core_seconds. Cores within radius_m of each other form a cluster, and every other
+   micro-cell joins the cluster of its nearest core within radius_m (or is dropped).
+
+Neighbours are found through a spatial hash grid of radius_m cells, so the work grows with
+the micro-cells times their neighbours instead of with the square of the micro-cells.
+"""
+
+import math
+from typing import Iterable, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+
+from db.db import EARTH_RADIUS_M
+
+# Leaving a fix at this speed or slower (m/s, a slow walk) still counts as staying
+MAX_STAY_SPEED_MPS = 1.0
+# Digits lat/lon are rounded to for the micro-cells (~10 m)
+MICRO_CELL_DIGITS = 4
+# Micro-cells within this distance (m) are neighbours
+CLUSTER_RADIUS_M = 100.0
+# Dwell within CLUSTER_RADIUS_M that makes a micro-cell a core
+MIN_CORE_SECONDS = 3600
+# Grid cells are sized for at most this latitude; nobody stays closer to a pole
+MAX_GRID_LAT = 85.0
+# Points whose candidate neighbours are generated at once, bounding peak memory
+PAIR_CHUNK_POINTS = 50_000
+
+
+class StayCells(NamedTuple):
+    """
+    Dwell per micro-cell: the cell ids, and per cell the seconds and the sums of lat and
+    lon weighted by seconds.
+    """
+
+    keys: np.ndarray
+    seconds: np.ndarray
+    lat_seconds: np.ndarray
+    lon_seconds: np.ndarray
+
+
+class StayCluster(NamedTuple):
+    """
+    A place: the dwell-weighted centroid, the distance from it to the farthest micro-cell,
+    the dwell, and the micro-cell with the most dwell (to geocode).
+    """
+
+    lat: float
+    lon: float
+    radius_m: float
+    seconds: float
+    rep_lat: float
+    rep_lon: float
+
+    @property
+    def hours(self) -> float:
+        return self.seconds / 3600.0
+
+
+def _haversine_m(lat1, lon1, lat2, lon2):
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    h = (
+        np.sin((phi2 - phi1) / 2) ** 2
+        + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def stay_cells(steps: np.ndarray, max_speed_mps: float = MAX_STAY_SPEED_MPS) -> StayCells:
+    """
+    Sums the stays among steps (a STEP_DTYPE array from LocationDB.get_steps_in_range)
+    per micro-cell.
+    """
+    distance = _haversine_m(steps["lat"], steps["lon"], steps["next_lat"], steps["next_lon"])
+    seconds = steps["seconds"]
+    stays = steps[(seconds > 0) & (distance <= max_speed_mps * seconds)]
+    scale = 10**MICRO_CELL_DIGITS
+    keys = (np.round(stays["lat"] * scale).astype(np.int64) + 90 * scale) * (360 * scale + 1) + (
+        np.round(stays["lon"] * scale).astype(np.int64) + 180 * scale
+    )
+    weights = stays["seconds"].astype(np.float64)
+    return _sum_by_key(keys, weights, stays["lat"] * weights, stays["lon"] * weights)
+
+
+def _sum_by_key(keys, seconds, lat_seconds, lon_seconds) -> StayCells:
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return StayCells(
+        unique,
+        np.bincount(inverse, seconds, len(unique)),
+        np.bincount(inverse, lat_seconds, len(unique)),
+        np.bincount(inverse, lon_seconds, len(unique)),
+    )
+
+
+def merge_stay_cells(parts: Iterable[StayCells]) -> StayCells:
+    """
+    Adds up the micro-cells of several shards.
+    """
+    parts = list(parts)
+    return _sum_by_key(*(np.concatenate([getattr(p, field) for p in parts]) for field in StayCells._fields))
+
+
+class _Grid(NamedTuple):
+    rows: np.ndarray
+    # Occupied cells: sorted keys, and where their points start in order and how many
+    keys: np.ndarray
+    starts: np.ndarray
+    counts: np.ndarray
+    order: np.ndarray
+
+
+def _cell_keys(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    return ((rows + (1 << 20)) << 22) | (cols + (1 << 21))
+
+
+def _lat_step(radius_m: float) -> float:
+    # A 1% margin covers the difference between haversine and the local flat distance
+    return 1.01 * math.degrees(radius_m / EARTH_RADIUS_M)
+
+
+def _row_width(rows: np.ndarray, lat_step: float) -> np.ndarray:
+    """
+    Degrees of longitude a grid cell in each row spans: radius_m at the highest latitude
+    of the row and its neighbours, so every point within radius_m of a point lies in its
+    row or a neighbouring one, at most its row's width away in longitude.
+    """
+    edge = np.minimum(np.maximum(np.abs(rows - 1), np.abs(rows + 2)) * lat_step, MAX_GRID_LAT)
+    return lat_step / np.cos(np.radians(edge))
+
+
+def _grid(lat: np.ndarray, lon: np.ndarray, radius_m: float) -> _Grid:
+    lat_step = _lat_step(radius_m)
+    rows = np.floor(lat / lat_step).astype(np.int64)
+    cols = np.floor(lon / _row_width(rows, lat_step)).astype(np.int64)
+    cell_keys = _cell_keys(rows, cols)
+    order = np.argsort(cell_keys, kind="stable")
+    keys, starts, counts = np.unique(cell_keys[order], return_index=True, return_counts=True)
+    return _Grid(rows, keys, starts, counts, order)
+
+
+def _neighbour_pairs(
+    lat: np.ndarray, lon: np.ndarray, radius_m: float, chunk: int = PAIR_CHUNK_POINTS
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Yields (a, b, distance) for every ordered pair of points at most radius_m apart (each
+    point is its own neighbour), a chunk of points a at a time.
+    """
+    grid = _grid(lat, lon, radius_m)
+    lat_step = _lat_step(radius_m)
+    for chunk_start in range(0, len(lat), chunk):
+        points = np.arange(chunk_start, min(chunk_start + chunk, len(lat)))
+        reach = _row_width(grid.rows[points], lat_step)
+        found_points, found_cells = [], []
+        for dr in (-1, 0, 1):
+            rows = grid.rows[points] + dr
+            width = _row_width(rows, lat_step)
+            low = np.floor((lon[points] - reach) / width).astype(np.int64)
+            high = np.floor((lon[points] + reach) / width).astype(np.int64)
+            for dc in range(int((high - low).max()) + 1):
+                keys = _cell_keys(rows, low + dc)
+                cell = np.minimum(np.searchsorted(grid.keys, keys), len(grid.keys) - 1)
+                hit = (grid.keys[cell] == keys) & (low + dc <= high)
+                found_points.append(points[hit])
+                found_cells.append(cell[hit])
+        a_points = np.concatenate(found_points)
+        cells = np.concatenate(found_cells)
+        counts = grid.counts[cells]
+        a = np.repeat(a_points, counts)
+        offsets = np.arange(len(a)) - np.repeat(np.cumsum(counts) - counts, counts)
+        b = grid.order[np.repeat(grid.starts[cells], counts) + offsets]
+        distance = _haversine_m(lat[a], lon[a], lat[b], lon[b])
+        near = distance <= radius_m
+        yield a[near], b[near], distance[near]
+
+
+def _components(n: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Labels the connected components of the graph with edges a[i]-b[i]: every edge across
+    two trees hooks the higher root under the lower one, then paths are compressed until
+    each point points at its root. Takes a few rounds even for long chains of points.
+    """
+    labels = np.arange(n)
+    while True:
+        root_a, root_b = labels[a], labels[b]
+        across = root_a != root_b
+        if not across.any():
+            return labels
+        a, b = a[across], b[across]
+        root_a, root_b = root_a[across], root_b[across]
+        np.minimum.at(labels, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+
+def cluster_stay_cells(
+    cells: StayCells,
+    radius_m: float = CLUSTER_RADIUS_M,
+    min_core_seconds: float = MIN_CORE_SECONDS,
+) -> List[StayCluster]:
+    """
+    Clusters micro-cells (see the module docstring). Returns the clusters, most time first.
+    """
+    n = len(cells.keys)
+    if n == 0:
+        return []
+    lat = cells.lat_seconds / cells.seconds
+    lon = cells.lon_seconds / cells.seconds
+
+    density = np.zeros(n)
+    for a, b, _ in _neighbour_pairs(lat, lon, radius_m):
+        density += np.bincount(a, cells.seconds[b], n)
+    core = density >= min_core_seconds
+
+    edges_a, edges_b = [], []
+    nearest_core = np.full(n, -1)
+    for a, b, distance in _neighbour_pairs(lat, lon, radius_m):
+        to_core = core[b]
+        edges = to_core & core[a] & (a < b)
+        edges_a.append(a[edges])
+        edges_b.append(b[edges])
+        border = to_core & ~core[a]
+        a, b, distance = a[border], b[border], distance[border]
+        # Nearest core first per border point; ties to the lower index
+        first = np.lexsort((b, distance, a))
+        a, b = a[first], b[first]
+        keep = np.ones(len(a), dtype=bool)
+        keep[1:] = a[1:] != a[:-1]
+        nearest_core[a[keep]] = b[keep]
+    labels = _components(n, np.concatenate(edges_a), np.concatenate(edges_b))
+    member = np.flatnonzero(core | (nearest_core >= 0))
+    if len(member) == 0:
+        return []
+    labels = np.where(core, labels, labels[np.maximum(nearest_core, 0)])[member]
+
+    clusters = []
+    order = np.argsort(labels, kind="stable")
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    for group in np.split(member[order], boundaries):
+        seconds = cells.seconds[group].sum()
+        c_lat = cells.lat_seconds[group].sum() / seconds
+        c_lon = cells.lon_seconds[group].sum() / seconds
+        heaviest = group[cells.seconds[group].argmax()]
+        radius = _haversine_m(c_lat, c_lon, lat[group], lon[group]).max()
+        clusters.append(
+            StayCluster(
+                float(c_lat),
+                float(c_lon),
+                float(radius),
+                float(seconds),
+                float(lat[heaviest]),
+                float(lon[heaviest]),
+            )
+        )
+    clusters.sort(key=lambda cluster: (-cluster.seconds, cluster.lat, cluster.lon))
+    return clusters
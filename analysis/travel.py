@@ -8,14 +8,21 @@ MOVEMENT_MIN_DIST_MILES = 0.05
 MINIMUM_SPEED_MPH = 5.0
 
 
-from typing import List, NamedTuple, Optional, Tuple
-from analysis.distance_apart import haversine
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from analysis.distance_apart import haversine, haversine_np
 from analysis.places import Point
+from analysis.result_cache import RESULTS, Dependency
+from analysis.sharding import SHARD_MONTHS, Shard, map_shards, month_shards
 from db.db import Location, LocationDB
 import time
 from datetime import datetime, date
 
 from geocode.geocode import Geocoder, PlaceInfo
+from profiling import profiling
 
 DB = LocationDB()
 GEOCODER = Geocoder()
@@ -76,54 +83,241 @@ def _is_travel(start: Location, end: Location) -> bool:
     return distance >= MILES_THRESHOLD and speed >= MINIMUM_SPEED_MPH
 
 
-def _find_travel_locations(start_location: int, locations: List[Location]) -> Optional[Tuple[Location, Location]]:
+# Points buffered before the detector processes the candidates whose window is complete
+DETECTOR_BLOCK_POINTS = 65536
+# Slack for vectorized comparisons; candidates are always confirmed with the scalar checks
+_FLOAT_SLACK = 1e-6
+
+
+def _moving_steps(ts: np.ndarray, lat: np.ndarray, lon: np.ndarray, locations: List[Location]) -> np.ndarray:
+    """
+    Vectorized _is_moving(locations[k], locations[k + 1]) for every step k.
+
+    Steps whose outcome hinges on a distance or speed within float noise of a threshold
+    are re-evaluated with the scalar _is_moving so results match it exactly.
+    """
+    distance = haversine_np(lat[:-1], lon[:-1], lat[1:], lon[1:]) * 0.000621371
+    time_in_hours = (ts[1:] - ts[:-1]) / 60.0 / 60.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = distance / time_in_hours
+    moving = (time_in_hours != 0.0) & (
+        (time_in_hours < (10.0 / 60.0))
+        | ((distance >= MOVEMENT_MIN_DIST_MILES) & (speed >= MINIMUM_SPEED_MPH))
+    )
+    borderline = (time_in_hours >= (10.0 / 60.0)) & (
+        (np.abs(distance - MOVEMENT_MIN_DIST_MILES) <= _FLOAT_SLACK * MOVEMENT_MIN_DIST_MILES)
+        | (np.abs(speed - MINIMUM_SPEED_MPH) <= _FLOAT_SLACK * MINIMUM_SPEED_MPH)
+    )
+    for k in np.nonzero(borderline)[0]:
+        moving[k] = _is_moving(locations[k], locations[k + 1])
+    return moving
+
+
+def _first_travel_end(
+    i: int,
+    kmin: int,
+    hi: int,
+    ts: np.ndarray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    locations: List[Location],
+) -> Optional[int]:
+    """
+    Returns the first k in [kmin, hi) with _is_travel(locations[i], locations[k]), or None.
+    """
+    distance = haversine_np(lat[i], lon[i], lat[kmin:hi], lon[kmin:hi]) * 0.000621371
+    seconds = ts[kmin:hi] - ts[i]
+    possible = (
+        (seconds > 0)
+        & (distance >= MILES_THRESHOLD * (1 - _FLOAT_SLACK))
+        & (distance * 3600.0 >= MINIMUM_SPEED_MPH * (1 - _FLOAT_SLACK) * seconds)
+    )
+    for offset in np.nonzero(possible)[0]:
+        k = kmin + int(offset)
+        if _is_travel(locations[i], locations[k]):
+            return k
+    return None
+
+
+def _expand_travel(start: int, end: int, locations: List[Location]) -> int:
     """
-    Given a start index in locations, finds the corresponding end index that defines a travel episode.
-    Returns a Travel object or None if no valid travel episode is found.
+    Extends a travel episode until two consecutive locations indicate we are no longer traveling.
     """
-    start = locations[start_location]
-    for i, end in enumerate(locations[start_location + 1:], start=start_location + 1):
+    for j in range(end + 1, len(locations)):
+        next_location = locations[j]
+        if not _is_moving(locations[end], next_location) or not _is_travel(locations[start], next_location):
+            break
+        end = j
+    return end
 
-        if _is_travel(start, end):
-            # Expand until two consecutive locations indicate we are no longer traveling
-            for j in range(i + 1, len(locations)):
-                next_location = locations[j]
-                if not _is_moving(end, next_location) or not _is_travel(start, next_location):
-                    return (start, end)
-                end = next_location
 
-            return (start, end)
-    return None
+def _scan_buffer(locations: List[Location], final: bool) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    Finds travel episodes in a buffer of sorted locations, starting at its first element.
+
+    Only start candidates whose MAX_WINDOW_SECONDS window lies entirely inside the buffer
+    are examined unless final is set. Returns the (start, end) index pairs found and the
+    index of the first location that still has to be examined as a start.
+    """
+    n = len(locations)
+    ts = np.fromiter((loc["timestamp_from"] for loc in locations), dtype=np.int64, count=n)
+    lat = np.fromiter((loc["lat"] for loc in locations), dtype=np.float64, count=n)
+    lon = np.fromiter((loc["lon"] for loc in locations), dtype=np.float64, count=n)
+
+    moving = _moving_steps(ts, lat, lon, locations)
+    # Straight-line distance never exceeds the path length, so a start whose path within
+    # the window stays below MILES_THRESHOLD cannot begin a travel episode.
+    path = np.concatenate([[0.0], np.cumsum(haversine_np(lat[:-1], lon[:-1], lat[1:], lon[1:]) * 0.000621371)])
+    kmin = np.searchsorted(path, path[:-1] + MILES_THRESHOLD * (1 - _FLOAT_SLACK) - _FLOAT_SLACK, side="left")
+    # _is_travel rejects pairs more than MAX_WINDOW_SECONDS apart
+    hi = np.searchsorted(ts, ts[:-1] + MAX_WINDOW_SECONDS, side="right")
+
+    limit = n - 1 if final else int(np.searchsorted(hi, n - 1, side="right"))
+    candidates = np.nonzero(moving[:limit] & (kmin[:limit] < hi[:limit]))[0]
+
+    episodes = []
+    pos = 0
+    for i in candidates:
+        i = int(i)
+        if i < pos:
+            continue
+        k = _first_travel_end(i, int(kmin[i]), int(hi[i]), ts, lat, lon, locations)
+        if k is None:
+            continue
+        end = _expand_travel(i, k, locations)
+        episodes.append((i, end))
+        pos = end + 1
+    return episodes, max(pos, limit)
 
 
-def _find_first_travel_locations(locations: List[Location]) -> Optional[Tuple[Location, Location]]:
+def iter_travel_locations(locations: Iterable[Location]) -> Iterator[Tuple[Location, Location]]:
     """
-    Finds the first instance of Travel in the sorted array of Locations, where:
+    Yields (start, end) location pairs of travel episodes from locations sorted by timestamp_from.
 
-    - the "start" is the last Location interval within MOVEMENT_MIN_DIST_MILES of the start point
-    - the "end" is the first Location interval within MOVEMENT_MIN_DIST_MILES of the end point
-    - the timestamp_from of start and end are within MAX_WINDOW_SECONDS
+    Equivalent to repeatedly taking the first travel episode and resuming after its end,
+    but single-pass: per-step distances, path lengths and window bounds are computed with
+    NumPy, every start is only compared with points inside its MAX_WINDOW_SECONDS window,
+    and only a window's worth of points (plus one block) is buffered, so locations may be
+    a lazy iterator over an arbitrarily long range.
     """
+    buffer: List[Location] = []
+    for location in locations:
+        buffer.append(location)
+        if len(buffer) >= 2 * DETECTOR_BLOCK_POINTS and (
+            buffer[-1]["timestamp_from"] - buffer[DETECTOR_BLOCK_POINTS]["timestamp_from"] > MAX_WINDOW_SECONDS
+        ):
+            episodes, consumed = _scan_buffer(buffer, final=False)
+            for start, end in episodes:
+                yield buffer[start], buffer[end]
+            buffer = buffer[consumed:]
+    if len(buffer) >= 2:
+        episodes, _ = _scan_buffer(buffer, final=True)
+        for start, end in episodes:
+            yield buffer[start], buffer[end]
+
+
+def _find_all_travel_locations(locations: Iterable[Location]) -> List[Tuple[Location, Location]]:
+    return list(iter_travel_locations(locations))
+
+
+def _shard_locations(person: str, start_ts: int, end_ts: int, shard: Shard) -> Iterator[Location]:
+    """
+    Yields the shard's locations (those starting inside it; the first shard also gets
+    those overlapping start_ts) followed by a MAX_WINDOW_SECONDS margin, which is all an
+    episode starting inside the shard can reach.
+    """
+    return DB.iter_locations_in_range(
+        person,
+        start_ts,
+        min(end_ts, shard.to_ts + MAX_WINDOW_SECONDS + 1),
+        starts_from=None if shard.first else shard.from_ts,
+    )
 
-    for i, location in enumerate(locations):
-        if i + 1 >= len(locations):
+
+def _travel_shard(person: str, start_ts: int, end_ts: int, shard: Shard) -> List[Tuple[Location, Location]]:
+    """
+    Returns the episodes starting inside the shard when scanning from its first location.
+    The margin is only read as far as the last of them reaches.
+    """
+    segments = []
+    for start, end in iter_travel_locations(_shard_locations(person, start_ts, end_ts, shard)):
+        if start["timestamp_from"] >= shard.to_ts:
             break
-        next_location = locations[i + 1]      
-        if not _is_moving(location, next_location):
-            continue
-        travel = _find_travel_locations(i, locations)
-        if travel:
-            return travel
-    return None
+        segments.append((start, end))
+    return segments
+
+
+def _resume_shard(
+    person: str,
+    start_ts: int,
+    end_ts: int,
+    shard: Shard,
+    after: Location,
+    segments: List[Tuple[Location, Location]],
+) -> List[Tuple[Location, Location]]:
+    """
+    Returns the shard's episodes when the scan resumes after the location that ended the
+    previous episode, reusing the shard's own episodes (segments) once the two scans agree.
 
-def _find_all_travel_locations(locations: List[Location]) -> List[Tuple[Location, Location]]:
-    travel_segments = []
-    
-    segment = _find_first_travel_locations(locations)
-    while segment:
-        travel_segments.append(segment)
-        segment = _find_first_travel_locations(locations[locations.index(segment[1]) + 1:])
-    return travel_segments
+    Whether a location starts an episode, and where that episode ends, does not depend on
+    where the scan started. So once the resumed scan is past an episode end e, it finds the
+    same episodes as the shard's scan if the shard's last episode starting at or before e
+    also ended at or before e.
+    """
+    if after["timestamp_from"] >= shard.to_ts:
+        return []
+    locations = list(_shard_locations(person, start_ts, end_ts, shard))
+    position: Dict[tuple, int] = {tuple(loc.values()): i for i, loc in enumerate(locations)}
+    bounds = [(position[tuple(s.values())], position[tuple(e.values())]) for s, e in segments]
+
+    def agreeing(end: int) -> Optional[int]:
+        j = 0
+        while j < len(bounds) and bounds[j][0] <= end:
+            j += 1
+        return j if j == 0 or bounds[j - 1][1] <= end else None
+
+    end = position[tuple(after.values())]
+    j = agreeing(end)
+    if j is not None:
+        return segments[j:]
+    resumed = []
+    for start, stop in iter_travel_locations(locations[end + 1 :]):
+        if start["timestamp_from"] >= shard.to_ts:
+            break
+        resumed.append((start, stop))
+        j = agreeing(position[tuple(stop.values())])
+        if j is not None:
+            return resumed + segments[j:]
+    return resumed
+
+
+def _find_travel_sharded(
+    person: str, start_ts: int, end_ts: int, jobs: Optional[int], shard_months: int
+) -> List[Tuple[Location, Location]]:
+    """
+    Like _find_all_travel_locations over get_locations_in_range(person, start_ts, end_ts),
+    with the shards scanned by worker processes.
+
+    Each shard is scanned from its first location. A shard's episodes are kept as they are
+    when the previous episode ended before its first episode starts; otherwise (an episode
+    crossing the shard edge) the shard is rescanned from where that episode ended until the
+    rescan agrees with the shard's own episodes.
+    """
+    shards = month_shards(start_ts, end_ts, shard_months)
+    parts = map_shards(partial(_travel_shard, person, start_ts, end_ts), shards, jobs)
+    segments: List[Tuple[Location, Location]] = []
+    for shard, part in zip(shards, parts):
+        after = segments[-1][1] if segments else None
+        if (
+            after is None
+            or after["timestamp_from"] < shard.from_ts
+            or not part
+            or part[0][0]["timestamp_from"] > after["timestamp_from"]
+        ):
+            segments.extend(part)
+        else:
+            segments.extend(_resume_shard(person, start_ts, end_ts, shard, after, part))
+    return segments
 
 class Travel(NamedTuple):
     start_point: Point
@@ -133,19 +327,32 @@ class Travel(NamedTuple):
     start_place: PlaceInfo
     end_place: PlaceInfo
 
-def _map_to_travel(start: Location, end: Location) -> Travel:
+def _map_to_travel(start: Location, end: Location, start_place: PlaceInfo, end_place: PlaceInfo) -> Travel:
     return Travel(
         start_point = Point(start["lat"], start["lon"]),
         end_point = Point(end["lat"], end["lon"]),
         start_ts = start["timestamp_from"],
         end_ts = end["timestamp_from"],
-        start_place = GEOCODER.get_place_info(start["lat"], start["lon"]),
-        end_place = GEOCODER.get_place_info(end["lat"], end["lon"])
+        start_place = start_place,
+        end_place = end_place
     )
 
-def detect_travel(person: str, start_date: str = None, end_date: str = None) -> List[Travel]:
+def detect_travel(
+    person: str,
+    start_date: str = None,
+    end_date: str = None,
+    jobs: int = 1,
+    shard_months: int = SHARD_MONTHS,
+) -> List[Travel]:
     """
     Detects travel episodes for a given person within the specified date range.
+
+    With jobs > 1 (None for every CPU) the range is split into shard_months shards scanned
+    by worker processes; the episodes are the same as with one process.
+
+    The episodes are cached (see analysis.result_cache) until the person's data in the
+    range changes. Their end points are geocoded on every call (mostly from the geocode
+    cache), so a failed lookup is retried as the geocode cache's negative_ttl allows.
     """
     # Default dates: start of current year to today
     today = date.today()
@@ -156,8 +363,58 @@ def detect_travel(person: str, start_date: str = None, end_date: str = None) ->
         end_date = today.strftime("%Y-%m-%d")
     start_ts = _date_to_ts(start_date)
     end_ts = _date_to_ts(end_date) + 86400
-
-    locations = DB.get_locations_in_range(person, start_ts, end_ts)
-
-    travel_segments = _find_all_travel_locations(locations)
-    return [_map_to_travel(start, end) for start, end in travel_segments]
\ No newline at end of file
+    travel_segments = RESULTS.get_or_compute(
+        DB,
+        "travel.travel_segments",
+        (person, start_date, end_date),
+        (
+            MILES_THRESHOLD,
+            MAX_WINDOW_SECONDS,
+            MOVEMENT_MIN_DIST_MILES,
+            MINIMUM_SPEED_MPH,
+        ),
+        [Dependency(person, start_ts, end_ts)],
+        lambda: _travel_segments(person, start_ts, end_ts, jobs, shard_months),
+    )
+    # Geocode every start and end point in one batch: index 2n is a start, 2n + 1 an end
+    with profiling.stage("travel.geocode") as stage:
+        places = dict(
+            GEOCODER.get_place_info_many(
+                (loc["lat"], loc["lon"]) for segment in travel_segments for loc in segment
+            )
+        )
+        stage.rows = len(places)
+    return [
+        _map_to_travel(start, end, places[2 * n], places[2 * n + 1])
+        for n, (start, end) in enumerate(travel_segments)
+    ]
+
+
+def _travel_segments(
+    person: str, start_ts: int, end_ts: int, jobs: int, shard_months: int
+) -> List[Tuple[Location, Location]]:
+    # travel.detect reports the points scanned, and the travel.segments counter the episodes
+    if jobs == 1:
+        scanned = 0
+
+        def counted(locations: Iterable[Location]) -> Iterator[Location]:
+            nonlocal scanned
+            for location in locations:
+                scanned += 1
+                yield location
+
+        # Streamed, so only the detector's window of locations is ever in memory
+        locations = DB.iter_locations_in_range(person, start_ts, end_ts)
+        with profiling.stage("travel.detect") as stage:
+            if profiling.is_enabled():
+                locations = counted(locations)
+            travel_segments = _find_all_travel_locations(locations)
+            stage.rows = scanned
+    else:
+        with profiling.stage("travel.detect") as stage:
+            travel_segments = _find_travel_sharded(person, start_ts, end_ts, jobs, shard_months)
+            # The workers' own stats are not collected; count the points of the range instead
+            if profiling.is_enabled():
+                stage.rows = DB.count_locations_in_range(person, start_ts, end_ts)
+    profiling.count("travel.segments", len(travel_segments))
+    return travel_segments
\ No newline at end of file
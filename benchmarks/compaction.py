@@ -0,0 +1,142 @@
+"""
+Compaction ratio and accuracy check.
+
+Copies a locations database, compacts the copy with compact.compact, and compares the
+analyses on both against the tolerance stated in compact/compact.py:
+- cluster_locations_by_time per person and year: total hours, and the share of hours that
+  moved to another cell;
+- travel episodes per person: unmatched episodes and the largest start/end time shift;
+- seconds together per day for every pair: the largest change in minutes.
+
+Exits with status 1 if a travel episode has no counterpart or total hours change.
+
+Usage:
+    uv run -m benchmarks.compaction [db_path] [--tolerance METERS]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+from analysis import percent_time_together, places, travel
+from analysis.result_cache import RESULTS
+from compact.compact import TOLERANCE_M, run_compaction
+from db.db import DB_PATH, LocationDB
+
+
+def _use_db(db: LocationDB):
+    for module in (places, travel, percent_time_together):
+        module.DB = db
+
+
+def _data_range(db: LocationDB) -> Tuple[date, date]:
+    with db._connect() as conn:
+        low, high = conn.execute("SELECT MIN(timestamp_from), MAX(timestamp_from) FROM locations").fetchone()
+    return date.fromtimestamp(low), date.fromtimestamp(high)
+
+
+def _cells(person: str, years: List[int]) -> Dict[Tuple[int, float, float], float]:
+    return {
+        (year, point.lat, point.lon): hours
+        for year in years
+        for point, hours in places.cluster_locations_by_time(person, str(year))
+    }
+
+
+def _episodes(person: str, start: date, end: date) -> List[Tuple[int, int]]:
+    start_ts = travel._date_to_ts(start.isoformat())
+    end_ts = travel._date_to_ts(end.isoformat()) + 86400
+    locations = travel.DB.get_locations_in_range(person, start_ts, end_ts)
+    return [(s["timestamp_from"], e["timestamp_from"]) for s, e in travel.iter_travel_locations(locations)]
+
+
+def _together(pair: Tuple[str, str], start: date, end: date) -> Dict[str, int]:
+    per_day = percent_time_together.seconds_together_per_day(start.isoformat(), end.isoformat(), *pair)
+    return {day: summary.seconds_together for day, summary in per_day.items()}
+
+
+def measure(db: LocationDB, persons: List[str], start: date, end: date) -> dict:
+    _use_db(db)
+    years = list(range(start.year, end.year + 1))
+    return {
+        "cells": {p: _cells(p, years) for p in persons},
+        "episodes": {p: _episodes(p, start, end) for p in persons},
+        "together": {pair: _together(pair, start, end) for pair in combinations(persons, 2)},
+    }
+
+
+def _match_episodes(old: List[Tuple[int, int]], new: List[Tuple[int, int]]) -> Tuple[int, int]:
+    """
+    Returns the episodes without an overlapping counterpart and the largest start or end
+    shift between matched episodes, in seconds.
+    """
+    unmatched = 0
+    shift = 0
+    remaining = list(new)
+    for start, end in old:
+        match = next((e for e in remaining if e[0] <= end and start <= e[1]), None)
+        if match is None:
+            unmatched += 1
+            continue
+        remaining.remove(match)
+        shift = max(shift, abs(match[0] - start), abs(match[1] - end))
+    return unmatched + len(remaining), shift
+
+
+def compare(before: dict, after: dict) -> bool:
+    ok = True
+    print(f"{'person':<12} {'hours':>12} {'hours after':>12} {'moved cells':>12} {'episodes':>9} {'unmatched':>9} {'max shift':>10}")
+    for person, cells in before["cells"].items():
+        cells_after = after["cells"][person]
+        total, total_after = sum(cells.values()), sum(cells_after.values())
+        moved = sum(abs(cells.get(k, 0.0) - cells_after.get(k, 0.0)) for k in set(cells) | set(cells_after)) / 2
+        unmatched, shift = _match_episodes(before["episodes"][person], after["episodes"][person])
+        print(
+            f"{person:<12} {total:>12.2f} {total_after:>12.2f} {100 * moved / total if total else 0:>11.2f}% "
+            f"{len(before['episodes'][person]):>9} {unmatched:>9} {shift:>9}s"
+        )
+        ok = ok and abs(total - total_after) < 1e-6 and unmatched == 0
+    for pair, days in before["together"].items():
+        days_after = after["together"][pair]
+        changes = [abs(days[d] - days_after.get(d, 0)) for d in days]
+        total = sum(days.values())
+        print(
+            f"{'/'.join(pair):<25} together {total / 3600:>10.1f} h, "
+            f"max daily change {max(changes, default=0) / 60:.1f} min, "
+            f"total change {abs(total - sum(days_after.values())) / 60:.1f} min"
+        )
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure compaction ratio and accuracy on a copy of a database.")
+    parser.add_argument("db_path", nargs="?", default=DB_PATH)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE_M)
+    args = parser.parse_args()
+
+    travel.GEOCODER.offline = True
+    RESULTS.enabled = False
+    original = LocationDB(args.db_path)
+    persons = original.get_persons()
+    start, end = _data_range(original)
+    before = measure(original, persons, start, end)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        copy_path = os.path.join(workdir, "locations.db")
+        with original._connect() as conn:
+            # Folds the WAL into the copy
+            conn.execute("VACUUM INTO ?", (copy_path,))
+        original.close()
+        started = time.perf_counter()
+        run_compaction(tolerance_m=args.tolerance, db_path=copy_path)
+        print(f"Compacted the copy in {time.perf_counter() - started:.2f}s")
+        compacted = LocationDB(copy_path)
+        after = measure(compacted, persons, start, end)
+        compacted.close()
+
+    sys.exit(0 if compare(before, after) else 1)
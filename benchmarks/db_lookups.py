@@ -0,0 +1,97 @@
+"""
+Micro-benchmark for LocationDB.get_location_at point lookups.
+
+Compares opening a fresh connection per call (how LocationDB used to work) with the
+persistent, pragma-tuned connection it holds now.
+
+Usage:
+    uv run -m benchmarks.db_lookups [db_path] [lookups]
+
+Without db_path, a temporary database with synthetic rows is created.
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+from db.db import Location, LocationDB
+
+SYNTHETIC_ROWS = 200_000
+DEFAULT_LOOKUPS = 20_000
+
+
+class _ConnectPerCallDB(LocationDB):
+    """
+    LocationDB as it was before connections were kept: a new default connection per call.
+    """
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+
+def _create_synthetic_db(db_path: str, rows: int):
+    db = LocationDB(db_path)
+    db.create_schema()
+    start = 1_700_000_000
+    db.insert_locations_bulk(
+        [
+            Location(
+                person="bench",
+                device="phone",
+                timestamp_from=start + 30 * i,
+                timestamp_to=start + 30 * (i + 1),
+                lat=42.0 + (i % 1000) * 1e-4,
+                lon=-71.0 - (i % 1000) * 1e-4,
+                accuracy=10.0,
+                battery=80.0,
+            )
+            for i in range(rows)
+        ]
+    )
+    db.close()
+
+
+def _sample_lookups(db_path: str, count: int) -> List[Tuple[str, int]]:
+    with LocationDB(db_path) as db:
+        cur = db._connect().execute(
+            "SELECT person, MIN(timestamp_from), MAX(timestamp_to) FROM locations GROUP BY person"
+        )
+        ranges = cur.fetchall()
+    rng = random.Random(0)
+    lookups = []
+    for _ in range(count):
+        person, lo, hi = rng.choice(ranges)
+        lookups.append((person, rng.randrange(lo, hi)))
+    return lookups
+
+
+def _lookups_per_second(db: LocationDB, lookups: List[Tuple[str, int]]) -> float:
+    start = time.perf_counter()
+    for person, ts in lookups:
+        db.get_location_at(person, ts)
+    return len(lookups) / (time.perf_counter() - start)
+
+
+def run(db_path: str, count: int):
+    lookups = _sample_lookups(db_path, count)
+    before = _lookups_per_second(_ConnectPerCallDB(db_path, pragmas={}), lookups)
+    with LocationDB(db_path) as db:
+        after = _lookups_per_second(db, lookups)
+    print(f"get_location_at over {count} random lookups in {db_path}")
+    print(f"  connection per call:   {before:>10.0f} lookups/s")
+    print(f"  persistent connection: {after:>10.0f} lookups/s ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_LOOKUPS
+    if len(sys.argv) > 1:
+        run(sys.argv[1], count)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            _create_synthetic_db(path, SYNTHETIC_ROWS)
+            run(path, count)
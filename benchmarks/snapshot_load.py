@@ -0,0 +1,78 @@
+"""
+Load time of a person's whole timeline: from the locations table, and from a snapshot.
+
+Copies a locations database, writes snapshots for the copy with db.snapshot, then per
+person times get_location_array_in_range over all of their data with a fresh LocationDB
+(and no snapshot mapped yet), once with snapshots=False and once with snapshots. "scan"
+adds a pass over lat/lon, which is when a mapped snapshot actually reads its pages. Both
+read from the OS page cache after the first repetition.
+
+Usage:
+    uv run -m benchmarks.snapshot_load [db_path] [--repeat N]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, Tuple
+
+from db import snapshot
+from db.db import DB_PATH, OPEN_END_TS, LocationDB
+from db.location_array import LocationArray
+
+
+def _best_of(repeat: int, load: Callable[[], LocationArray]) -> Tuple[float, float, int]:
+    """
+    Returns the fastest load and load plus scan (seconds) of repeat runs, and the rows.
+    """
+    best_load = best_scan = float("inf")
+    rows = 0
+    for _ in range(repeat):
+        snapshot._OPEN.clear()
+        started = time.perf_counter()
+        array = load()
+        loaded = time.perf_counter() - started
+        float(array.lat.sum() + array.lon.sum())
+        best_load = min(best_load, loaded)
+        best_scan = min(best_scan, time.perf_counter() - started)
+        rows = len(array)
+    return best_load, best_scan, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare loading timelines from SQLite and from snapshots.")
+    parser.add_argument("db_path", nargs="?", default=DB_PATH)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    original = LocationDB(args.db_path)
+    with tempfile.TemporaryDirectory() as workdir:
+        copy_path = os.path.join(workdir, "locations.db")
+        with original._connect() as conn:
+            # Folds the WAL into the copy
+            conn.execute("VACUUM INTO ?", (copy_path,))
+        original.close()
+        with LocationDB(copy_path) as db:
+            started = time.perf_counter()
+            persons = [result.person for result in snapshot.refresh_snapshots(db, create=True)]
+            print(f"Wrote snapshots in {time.perf_counter() - started:.2f}s")
+
+        print(f"{'Person':<15} {'Rows':>9} {'SQL load':>10} {'Snap load':>10} {'SQL scan':>10} {'Snap scan':>10} {'Speedup':>8}")
+        for person in persons:
+            results = []
+            for use_snapshots in (False, True):
+                def load() -> LocationArray:
+                    with LocationDB(copy_path, snapshots=use_snapshots) as db:
+                        return db.get_location_array_in_range(person, -OPEN_END_TS, OPEN_END_TS)
+
+                results.append(_best_of(args.repeat, load))
+            (sql_load, sql_scan, rows), (snap_load, snap_scan, _) = results
+            print(
+                f"{person:<15} {rows:>9} {sql_load * 1000:>8.1f}ms {snap_load * 1000:>8.1f}ms "
+                f"{sql_scan * 1000:>8.1f}ms {snap_scan * 1000:>8.1f}ms {sql_scan / snap_scan:>7.0f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
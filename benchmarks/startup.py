@@ -0,0 +1,82 @@
+"""
+Cold-start cost of each CLI subcommand.
+
+Runs `python -m cli.cli <command> --help` in fresh interpreters, which imports everything the
+command needs to build its parser but does no work, and reports the median wall time above a
+bare `python -c pass`. With --importtime the slowest imports of each command (from
+`python -X importtime`) are listed too.
+
+Usage:
+    uv run -m benchmarks.startup [--runs 10] [--importtime] [--top 5] [command ...]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+from cli.cli import COMMANDS
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RUNS = 10
+
+
+def _time_run(argv: List[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(argv, cwd=PROJECT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def median_seconds(argv: List[str], runs: int) -> float:
+    # One untimed run so the .pyc files exist and every timed run starts the same way
+    _time_run(argv)
+    return statistics.median(_time_run(argv) for _ in range(runs))
+
+
+def slowest_imports(command: str, top: int) -> List[Tuple[str, float]]:
+    """
+    Returns the top-level packages with the largest cumulative import time, in milliseconds.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "cli.cli", command, "--help"],
+        cwd=PROJECT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    totals = {}
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package", nesting shown by indentation
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if name.startswith("  "):
+            continue
+        name = name.strip()
+        totals[name] = totals.get(name, 0) + int(cumulative) / 1000
+    return sorted(totals.items(), key=lambda item: -item[1])[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold-start time of each CLI subcommand.")
+    parser.add_argument("commands", nargs="*", help=f"default: all of {', '.join(COMMANDS)}")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--importtime", action="store_true", help="list each command's slowest imports")
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+    commands = args.commands or list(COMMANDS)
+    unknown = [c for c in commands if c not in COMMANDS]
+    if unknown:
+        parser.error(f"unknown command: {', '.join(unknown)}")
+
+    baseline = median_seconds([sys.executable, "-c", "pass"], args.runs)
+    print(f"{'command':<10} {'median ms':>10} {'over python':>12}")
+    print(f"{'(python)':<10} {baseline * 1000:>10.1f} {'':>12}")
+    seconds = median_seconds([sys.executable, "-m", "cli.cli", "--help"], args.runs)
+    print(f"{'(--help)':<10} {seconds * 1000:>10.1f} {(seconds - baseline) * 1000:>12.1f}")
+    for command in commands:
+        seconds = median_seconds([sys.executable, "-m", "cli.cli", command, "--help"], args.runs)
+        print(f"{command:<10} {seconds * 1000:>10.1f} {(seconds - baseline) * 1000:>12.1f}")
+        if args.importtime:
+            for name, ms in slowest_imports(command, args.top):
+                print(f"    {name:<30} {ms:>8.1f} ms")
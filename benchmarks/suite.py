@@ -0,0 +1,295 @@
+"""
+Benchmark suite for the import and analysis hot paths on synthetic data.
+
+For each size a synthetic data set is generated with benchmarks.synthetic (and reused on
+later runs), then every benchmark runs in a fresh subprocess inside that data set's
+directory, so module-level state, caches and peak RSS are measured per benchmark. Wall time,
+peak RSS and result sizes are written to a JSON file, and --compare prints the change
+against an earlier results file.
+
+Usage:
+    uv run -m benchmarks.suite [--sizes 10k,1m] [--only NAME,...] [--workdir DIR]
+                               [--output FILE] [--compare OLD.json]
+
+Sizes are 10k, 1m and 10m points; 10m takes a few minutes to generate and import.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from benchmarks import synthetic
+
+MANIFEST = "manifest.json"
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Size(NamedTuple):
+    points: int
+    people: int
+    days: int
+
+
+SIZES: Dict[str, Size] = {
+    "10k": Size(10_000, 2, 14),
+    "1m": Size(1_000_000, 2, 730),
+    "10m": Size(10_000_000, 4, 1826),
+}
+DEFAULT_SIZES = "10k,1m"
+# In run order: run_import builds the database the others read
+BENCHMARKS = (
+    "run_import",
+    "get_locations_in_range",
+    "distance_apart_per_minute",
+    "percent_minutes_spent_together",
+    "cluster_locations_by_time",
+    "cluster_stays_by_time",
+    "detect_travel",
+    "detect_travel_sharded",
+)
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _prepare(name: str, manifest: dict) -> Callable[[], object]:
+    """
+    Imports what a benchmark needs and returns the call to time.
+    """
+    person_a, person_b = manifest["people"][:2]
+    start_date, end_date = manifest["start_date"], manifest["end_date"]
+    start_ts = int(time.mktime(time.strptime(start_date, "%Y-%m-%d")))
+    end_ts = int(time.mktime(time.strptime(end_date, "%Y-%m-%d"))) + 86400
+    if name == "run_import":
+        import importlib
+
+        run_import = importlib.import_module("import.import").run_import
+        return lambda: run_import()
+    if name == "get_locations_in_range":
+        from db.db import LocationDB
+
+        db = LocationDB()
+        return lambda: db.get_locations_in_range(person_a, start_ts, end_ts)
+    if name == "distance_apart_per_minute":
+        from analysis.distance_apart import distance_apart_per_minute
+
+        return lambda: distance_apart_per_minute(person_a, person_b, start_ts, end_ts)
+    if name == "percent_minutes_spent_together":
+        # Compares its fixed PERSON_A/PERSON_B pair, the synthetic data's first two people
+        from analysis.percent_time_together import percent_minutes_spent_together
+
+        return lambda: percent_minutes_spent_together(start_date, end_date)
+    if name == "cluster_locations_by_time":
+        from analysis.places import cluster_locations_by_time
+
+        return lambda: cluster_locations_by_time(person_a, start_date[:4])
+    if name == "cluster_stays_by_time":
+        from analysis.places import cluster_stays_by_time
+
+        return lambda: cluster_stays_by_time(person_a, start_date[:4])
+    if name == "detect_travel":
+        from analysis import travel
+
+        # Never hit the geocoding API from a benchmark
+        travel.GEOCODER.offline = True
+        return lambda: travel.detect_travel(person_a, start_date, end_date)
+    if name == "detect_travel_sharded":
+        from analysis import travel
+
+        travel.GEOCODER.offline = True
+        # Monthly shards on every CPU
+        return lambda: travel.detect_travel(person_a, start_date, end_date, jobs=None)
+    raise ValueError(f"unknown benchmark {name!r}")
+
+
+def _run_child(name: str, result_path: str):
+    """
+    Runs one benchmark in this process (cwd is the data set directory) and writes its
+    measurements to result_path.
+    """
+    with open(MANIFEST) as f:
+        manifest = json.load(f)
+    # Time the analyses themselves, not cached results from an earlier run
+    from analysis.result_cache import RESULTS
+
+    RESULTS.enabled = False
+    call = _prepare(name, manifest)
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    result = call()
+    seconds = time.perf_counter() - start
+    with open(result_path, "w") as f:
+        json.dump(
+            {
+                "seconds": round(seconds, 4),
+                "peak_rss_mb": round(_peak_rss_mb(), 1),
+                "rss_before_mb": round(rss_before, 1),
+                "result_len": len(result) if hasattr(result, "__len__") else None,
+            },
+            f,
+        )
+
+
+def _dataset(workdir: str, size_name: str) -> str:
+    """
+    Returns the directory of a size's data set, generating it unless an identical one exists.
+    """
+    size = SIZES[size_name]
+    path = os.path.join(workdir, size_name)
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if (
+            manifest.get("generator_version") == synthetic.GENERATOR_VERSION
+            and manifest.get("requested_points") == size.points
+            and len(manifest.get("people", ())) == size.people
+            and manifest.get("days") == size.days
+        ):
+            return path
+    print(f"[{size_name}] generating {size.points} points...", flush=True)
+    start = time.perf_counter()
+    manifest = synthetic.generate(path, size.points, size.people, size.days)
+    print(f"[{size_name}] {manifest['points']} points in {time.perf_counter() - start:.1f}s", flush=True)
+    # A database built from an older data set is stale
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(os.path.join(path, "locations.db" + suffix)):
+            os.remove(os.path.join(path, "locations.db" + suffix))
+    return path
+
+
+def _run_benchmark(name: str, cwd: str) -> dict:
+    fd, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        env = dict(os.environ)
+        # The data set directory is the cwd, so the project has to come from PYTHONPATH
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [PROJECT_DIR, env.get("PYTHONPATH")]))
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.suite", "--child", name, result_path],
+            cwd=cwd,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        wall = time.perf_counter() - start
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"}
+        with open(result_path) as f:
+            result = json.load(f)
+        result["process_seconds"] = round(wall, 4)
+        return result
+    finally:
+        os.remove(result_path)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=PROJECT_DIR, capture_output=True, text=True,
+        ).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: List[str], only: List[str], workdir: str) -> dict:
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": {},
+    }
+    for size_name in sizes:
+        path = _dataset(workdir, size_name)
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        results = {"points": manifest["points"], "people": len(manifest["people"]), "days": manifest["days"]}
+        if "run_import" not in only and not os.path.exists(os.path.join(path, "locations.db")):
+            print(f"[{size_name}] building the database (untimed)...", flush=True)
+            _run_benchmark("run_import", path)
+        for name in BENCHMARKS:
+            if name not in only:
+                continue
+            result = _run_benchmark(name, path)
+            results[name] = result
+            if "error" in result:
+                print(f"[{size_name}] {name:<32} ERROR {result['error']}", flush=True)
+            else:
+                print(
+                    f"[{size_name}] {name:<32} {result['seconds']:>9.3f}s "
+                    f"peak RSS {result['peak_rss_mb']:>8.1f} MB",
+                    flush=True,
+                )
+        report["results"][size_name] = results
+    return report
+
+
+def compare(old: dict, new: dict):
+    print(f"{'size':<5} {'benchmark':<32} {'old s':>9} {'new s':>9} {'ratio':>7} {'old MB':>8} {'new MB':>8}")
+    for size_name, results in new["results"].items():
+        old_results = old.get("results", {}).get(size_name, {})
+        for name in BENCHMARKS:
+            a, b = old_results.get(name), results.get(name)
+            if not a or not b or "error" in a or "error" in b:
+                continue
+            ratio = b["seconds"] / a["seconds"] if a["seconds"] else float("inf")
+            print(
+                f"{size_name:<5} {name:<32} {a['seconds']:>9.3f} {b['seconds']:>9.3f} "
+                f"{ratio:>6.2f}x {a['peak_rss_mb']:>8.1f} {b['peak_rss_mb']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        _run_child(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description="Benchmark the import and analyses on synthetic data.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"comma-separated of {', '.join(SIZES)}")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="comma-separated benchmarks to run")
+    parser.add_argument(
+        "--workdir",
+        default=os.path.join(tempfile.gettempdir(), "owntracks-bench"),
+        help="where data sets are generated and kept between runs",
+    )
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    only = [s.strip() for s in args.only.split(",") if s.strip()]
+    for value, known, what in ((sizes, SIZES, "size"), (only, BENCHMARKS, "benchmark")):
+        unknown = [v for v in value if v not in known]
+        if unknown:
+            parser.error(f"unknown {what}: {', '.join(unknown)}")
+    report = run(sizes, only, os.path.abspath(args.workdir))
+    output = args.output or os.path.join("benchmarks", "results", f"{report['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
@@ -0,0 +1,316 @@
+"""
+Deterministic generator of realistic OwnTracks exports for benchmarks.
+
+Each person follows a daily schedule built from a seed: nights at a shared home, weekday
+commutes to their own workplace, evening and weekend errands (often together, since the
+household shares one schedule for those), and occasional multi-day trips far away. Each
+device samples that schedule at OwnTracks-like cadences (sparse while stationary, dense
+while moving) with GPS jitter, occasional spikes, phone-off gaps, duplicate tsts (same and
+conflicting coordinates) and zeroed coordinates.
+
+Files are written one per person, device and year as owntracks-json/<year>/<person>-<device>.json
+in the export shape the importer reads, streaming so memory stays flat at any size, plus a
+manifest.json describing the data set.
+
+Usage:
+    uv run -m benchmarks.synthetic <out_dir> [--points N] [--people N] [--days N] [--seed N]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import time
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# Bump when the output for a given seed changes, so cached data sets are regenerated
+GENERATOR_VERSION = 1
+START_DATE = date(2023, 1, 1)
+# The first two are the pair analysis.percent_time_together compares
+DEFAULT_PEOPLE = ("jackie", "zach")
+# Points per person per day at density 1.0, measured; used to pick the density for a target
+NATURAL_POINTS_PER_DAY = 457
+HOME = (42.3601, -71.0589)
+METERS_PER_DEGREE_LAT = 111320.0
+
+# Seconds between points while stationary and while moving, with weights
+_STAY_INTERVALS = ((30, 60, 120, 300, 900), (1, 3, 3, 2, 1))
+_MOVE_INTERVALS = ((5, 10, 30, 60), (1, 3, 3, 1))
+_ACCURACIES = ((5, 10, 16, 32, 65), (3, 4, 2, 1, 0.5))
+# Per-point probabilities
+_P_GAP = 0.0008
+_P_DUPLICATE = 0.001
+_P_CONFLICT = 0.0003
+_P_ZERO = 0.0002
+_P_SPIKE = 0.0005
+# Second devices sample this many times less often than the phone
+_SECOND_DEVICE_SPARSITY = 4
+
+
+class Segment(NamedTuple):
+    """
+    A stay (from == to) or a straight move between two points.
+    """
+
+    start: int
+    end: int
+    from_lat: float
+    from_lon: float
+    to_lat: float
+    to_lon: float
+
+
+def _offset(rng: random.Random, origin: Tuple[float, float], min_km: float, max_km: float) -> Tuple[float, float]:
+    distance = rng.uniform(min_km, max_km) * 1000
+    bearing = rng.uniform(0, 2 * math.pi)
+    lat = origin[0] + distance * math.cos(bearing) / METERS_PER_DEGREE_LAT
+    lon = origin[1] + distance * math.sin(bearing) / (METERS_PER_DEGREE_LAT * math.cos(math.radians(origin[0])))
+    return lat, lon
+
+
+def _distance_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    dlat = (a[0] - b[0]) * METERS_PER_DEGREE_LAT
+    dlon = (a[1] - b[1]) * METERS_PER_DEGREE_LAT * math.cos(math.radians(a[0]))
+    return math.hypot(dlat, dlon) / 1000
+
+
+class _Household:
+    """
+    Places and the shared (errand and trip) schedule of everyone living at HOME.
+    """
+
+    def __init__(self, seed: int):
+        rng = random.Random(f"household-{seed}")
+        self.seed = seed
+        self.errands = [_offset(rng, HOME, 0.5, 6) for _ in range(12)]
+        self.destinations = [_offset(rng, HOME, 80, 600) for _ in range(6)]
+
+    def day_rng(self, day_index: int) -> random.Random:
+        return random.Random(f"household-{self.seed}-{day_index}")
+
+
+def person_segments(household: _Household, person_index: int, days: int) -> Iterator[Segment]:
+    """
+    Yields one person's schedule as consecutive segments covering `days` local days.
+    """
+    rng = random.Random(f"person-{household.seed}-{person_index}")
+    work = _offset(rng, HOME, 5, 25)
+    here = HOME
+    t = int(time.mktime(START_DATE.timetuple()))
+    end_ts = int(time.mktime((START_DATE + timedelta(days=days)).timetuple()))
+    trip_days_left = 0
+    destination = HOME
+
+    def go(to: Tuple[float, float], kmh: float) -> Iterator[Segment]:
+        nonlocal here, t
+        seconds = max(60, int(_distance_km(here, to) / kmh * 3600))
+        yield Segment(t, t + seconds, here[0], here[1], to[0], to[1])
+        here = to
+        t += seconds
+
+    def stay_until(until: int) -> Iterator[Segment]:
+        nonlocal t
+        if until > t:
+            yield Segment(t, until, here[0], here[1], here[0], here[1])
+            t = until
+
+    for day_index in range(days):
+        day = START_DATE + timedelta(days=day_index)
+        midnight = int(time.mktime(day.timetuple()))
+        shared = household.day_rng(day_index)
+        if trip_days_left == 0 and shared.random() < 1 / 45:
+            # Household trip: everyone drives out the same morning
+            trip_days_left = shared.randint(2, 6)
+            destination = shared.choice(household.destinations)
+        if trip_days_left > 0:
+            trip_days_left -= 1
+            yield from stay_until(midnight + 9 * 3600 + shared.randint(0, 3600))
+            if here != destination:
+                yield from go(destination, shared.uniform(70, 100))
+            elif trip_days_left == 0:
+                yield from go(HOME, shared.uniform(70, 100))
+            else:
+                yield from go(_offset(shared, destination, 0.5, 5), 30)
+                yield from stay_until(t + shared.randint(3600, 4 * 3600))
+                yield from go(destination, 30)
+        elif day.weekday() < 5 and rng.random() > 0.08:
+            yield from stay_until(midnight + 7 * 3600 + rng.randint(0, 7200))
+            yield from go(work, rng.uniform(35, 80))
+            yield from stay_until(midnight + 16 * 3600 + rng.randint(0, 7200))
+            if rng.random() < 0.3:
+                yield from go(rng.choice(household.errands), 40)
+                yield from stay_until(t + rng.randint(900, 3600))
+            yield from go(HOME, rng.uniform(35, 80))
+        else:
+            # Weekend or day off: errands, mostly with the household
+            errands = sorted(shared.randint(9 * 3600, 19 * 3600) for _ in range(shared.randint(0, 3)))
+            for at in errands:
+                if at < t - midnight:
+                    continue
+                together = shared.random() < 0.7
+                pick = shared if together else rng
+                yield from stay_until(midnight + at)
+                yield from go(pick.choice(household.errands), 35)
+                yield from stay_until(t + pick.randint(1200, 3 * 3600))
+                yield from go(HOME, 35)
+        if t >= end_ts:
+            break
+    yield from stay_until(end_ts)
+
+
+def sample_device(
+    segments: Iterator[Segment], seed: str, density: float, sparsity: int = 1
+) -> Iterator[Tuple[int, str]]:
+    """
+    Samples a schedule like an OwnTracks device, yielding (tst, entry as a JSON object
+    string) in timestamp order; duplicates repeat the previous tst.
+    """
+    rng = random.Random(seed)
+    stay_values, stay_weights = _STAY_INTERVALS
+    move_values, move_weights = _MOVE_INTERVALS
+    acc_values, acc_weights = _ACCURACIES
+    scale = sparsity / density
+    # Thresholds on one uniform roll per point
+    gap = _P_GAP
+    zero = gap + _P_ZERO
+    duplicate = zero + _P_DUPLICATE
+    conflict = duplicate + _P_CONFLICT
+    spike = 1 - _P_SPIKE
+    t = None
+    batt = 100
+    for segment in segments:
+        if t is None:
+            t = segment.start
+        moving = segment.from_lat != segment.to_lat or segment.from_lon != segment.to_lon
+        values, weights = (move_values, move_weights) if moving else (stay_values, stay_weights)
+        duration = max(1, segment.end - segment.start)
+        while t < segment.end:
+            roll = rng.random()
+            if roll < gap:
+                # Phone off or no signal for a while
+                t += rng.randint(3600, 8 * 3600)
+                continue
+            f = (t - segment.start) / duration
+            lat = segment.from_lat + (segment.to_lat - segment.from_lat) * f
+            lon = segment.from_lon + (segment.to_lon - segment.from_lon) * f
+            acc = rng.choices(acc_values, acc_weights)[0]
+            lat += rng.gauss(0, acc / 2) / METERS_PER_DEGREE_LAT
+            lon += rng.gauss(0, acc / 2) / METERS_PER_DEGREE_LAT
+            if roll > spike:
+                acc = rng.randint(300, 2000)
+                lat += rng.uniform(-0.02, 0.02)
+            batt = 100 if batt <= 15 else batt - (rng.random() < 0.05)
+            vel = int(rng.uniform(20, 100)) if moving else 0
+            if roll < zero:
+                yield t, f'{{"_type":"location","tst":{t},"lat":0,"lon":0,"acc":{acc},"batt":{batt},"vel":0}}'
+            else:
+                entry = f'{{"_type":"location","tst":{t},"lat":{lat:.7f},"lon":{lon:.7f},"acc":{acc},"batt":{batt},"vel":{vel}}}'
+                yield t, entry
+                if roll < duplicate:
+                    yield t, entry
+                elif roll < conflict:
+                    yield t, f'{{"_type":"location","tst":{t},"lat":{lat + 0.001:.7f},"lon":{lon:.7f},"acc":{acc},"batt":{batt},"vel":{vel}}}'
+            t += max(1, int(rng.choices(values, weights)[0] * scale * rng.uniform(0.8, 1.2)))
+
+
+def _write_device(out_dir: str, person: str, device: str, entries: Iterator[Tuple[int, str]]) -> int:
+    """
+    Writes entries to one file per local year, returning the number of entries.
+    """
+    count = 0
+    f = None
+    year_end = None
+    try:
+        for tst, entry in entries:
+            if year_end is None or tst >= year_end:
+                if f is not None:
+                    f.write("]}}")
+                    f.close()
+                year = time.localtime(tst).tm_year
+                year_end = int(time.mktime(date(year + 1, 1, 1).timetuple()))
+                os.makedirs(os.path.join(out_dir, str(year)), exist_ok=True)
+                f = open(os.path.join(out_dir, str(year), f"{person}-{device}.json"), "w")
+                f.write(f'{{{json.dumps(person)}:{{{json.dumps(device)}:[')
+                first = True
+            if not first:
+                f.write(",")
+            f.write(entry)
+            first = False
+            count += 1
+    finally:
+        if f is not None:
+            f.write("]}}")
+            f.close()
+    return count
+
+
+def generate(
+    out_dir: str,
+    points: int,
+    people: int = len(DEFAULT_PEOPLE),
+    days: Optional[int] = None,
+    seed: int = 0,
+) -> dict:
+    """
+    Writes a synthetic data set of about `points` entries for `people` people into
+    out_dir/owntracks-json and returns its manifest (also saved as out_dir/manifest.json).
+
+    Without days, the span follows from the natural cadence; with days, the sampling
+    density is scaled so the points fit in that many days.
+    """
+    names = list(DEFAULT_PEOPLE[:people]) + [f"person{i + 1}" for i in range(len(DEFAULT_PEOPLE), people)]
+    # Phones of everyone plus the first person's second device, in phone equivalents
+    phones = people + 1 / _SECOND_DEVICE_SPARSITY
+    if days is None:
+        days = max(1, math.ceil(points / (phones * NATURAL_POINTS_PER_DAY)))
+    density = points / (phones * days * NATURAL_POINTS_PER_DAY)
+    household = _Household(seed)
+    json_dir = os.path.join(out_dir, "owntracks-json")
+    counts: Dict[str, Dict[str, int]] = {}
+    for index, person in enumerate(names):
+        devices: List[Tuple[str, int]] = [("phone", 1)]
+        if index == 0:
+            # One person also carries a sparse second device
+            devices.append(("watch", _SECOND_DEVICE_SPARSITY))
+        counts[person] = {}
+        for device, sparsity in devices:
+            entries = sample_device(
+                person_segments(household, index, days),
+                f"device-{seed}-{person}-{device}",
+                density,
+                sparsity,
+            )
+            counts[person][device] = _write_device(json_dir, person, device, entries)
+    manifest = {
+        "generator_version": GENERATOR_VERSION,
+        "seed": seed,
+        "people": names,
+        "days": days,
+        "start_date": START_DATE.strftime("%Y-%m-%d"),
+        "end_date": (START_DATE + timedelta(days=days - 1)).strftime("%Y-%m-%d"),
+        "requested_points": points,
+        "points": sum(sum(c.values()) for c in counts.values()),
+        "counts": counts,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic OwnTracks exports.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--points", type=int, default=100_000)
+    parser.add_argument("--people", type=int, default=len(DEFAULT_PEOPLE))
+    parser.add_argument("--days", type=int, help="span in days (default: follows from --points)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    manifest = generate(args.out_dir, args.points, args.people, args.days, args.seed)
+    print(
+        f"Wrote {manifest['points']} points for {len(manifest['people'])} people over "
+        f"{manifest['days']} days ({manifest['start_date']}..{manifest['end_date']}) "
+        f"to {args.out_dir} in {time.perf_counter() - start:.1f}s"
+    )
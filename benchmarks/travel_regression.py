@@ -0,0 +1,147 @@
+"""
+Regression fixture for travel detection.
+
+Runs the original quadratic detector (kept here verbatim as the reference) and the
+single-pass iter_travel_locations over deterministic synthetic traces, and optionally a
+person from locations.db, and fails if their episodes differ. Also prints timings.
+tests/test_travel.py runs the same comparison with small detector blocks and over
+month shards.
+
+Usage:
+    uv run -m benchmarks.travel_regression [person start_date end_date]
+"""
+
+import random
+import sys
+import time
+from typing import List, Optional, Tuple
+
+from analysis.travel import (
+    _date_to_ts,
+    _is_moving,
+    _is_travel,
+    iter_travel_locations,
+)
+from db.db import Location, LocationDB
+
+# (seed, days) for the synthetic traces
+SYNTHETIC_CASES = [(1, 3), (2, 14), (3, 45)]
+
+
+def _legacy_find_travel_locations(start_location: int, locations: List[Location]) -> Optional[Tuple[Location, Location]]:
+    start = locations[start_location]
+    for i, end in enumerate(locations[start_location + 1:], start=start_location + 1):
+
+        if _is_travel(start, end):
+            # Expand until two consecutive locations indicate we are no longer traveling
+            for j in range(i + 1, len(locations)):
+                next_location = locations[j]
+                if not _is_moving(end, next_location) or not _is_travel(start, next_location):
+                    return (start, end)
+                end = next_location
+
+            return (start, end)
+    return None
+
+
+def _legacy_find_first_travel_locations(locations: List[Location]) -> Optional[Tuple[Location, Location]]:
+    for i, location in enumerate(locations):
+        if i + 1 >= len(locations):
+            break
+        next_location = locations[i + 1]
+        if not _is_moving(location, next_location):
+            continue
+        travel = _legacy_find_travel_locations(i, locations)
+        if travel:
+            return travel
+    return None
+
+
+def legacy_find_all_travel_locations(locations: List[Location]) -> List[Tuple[Location, Location]]:
+    """
+    The detector as it was before iter_travel_locations, used as the reference.
+    """
+    travel_segments = []
+
+    segment = _legacy_find_first_travel_locations(locations)
+    while segment:
+        travel_segments.append(segment)
+        segment = _legacy_find_first_travel_locations(locations[locations.index(segment[1]) + 1:])
+    return travel_segments
+
+
+def synthetic_trace(seed: int, days: int) -> List[Location]:
+    """
+    A deterministic trace of stays with GPS jitter, short errands and occasional
+    long drives, with irregular ping intervals and gaps.
+    """
+    rng = random.Random(seed)
+    home = (42.36, -71.06)
+    lat, lon = home
+    ts = 1_700_000_000
+    end_ts = ts + days * 86400
+    locations = []
+    while ts < end_ts:
+        roll = rng.random()
+        if roll < 0.004:
+            # Drive 5-150 miles at 20-70 mph, pinging every 30-120 seconds
+            miles = rng.uniform(5, 150)
+            mph = rng.uniform(20, 70)
+            bearing = (rng.uniform(-1, 1), rng.uniform(-1, 1))
+            norm = max(abs(bearing[0]) + abs(bearing[1]), 1e-9)
+            steps = max(2, int(miles / mph * 3600 / 60))
+            for _ in range(steps):
+                ts += rng.randint(30, 120)
+                lat += bearing[0] / norm * miles / 69.0 / steps
+                lon += bearing[1] / norm * miles / 52.0 / steps
+                locations.append((ts, lat, lon))
+        elif roll < 0.01:
+            lat, lon = home
+        elif roll < 0.012:
+            # Gap without data
+            ts += rng.randint(3600, 6 * 3600)
+        ts += rng.choice([10, 30, 60, 300, 900])
+        locations.append((ts, lat + rng.gauss(0, 0.0002), lon + rng.gauss(0, 0.0002)))
+    return [
+        Location(
+            person="synthetic",
+            device="phone",
+            timestamp_from=t,
+            timestamp_to=locations[i + 1][0] if i + 1 < len(locations) else t,
+            lat=la,
+            lon=lo,
+            accuracy=10.0,
+            battery=None,
+        )
+        for i, (t, la, lo) in enumerate(locations)
+    ]
+
+
+def compare(name: str, locations: List[Location]) -> bool:
+    start = time.perf_counter()
+    legacy = legacy_find_all_travel_locations(locations)
+    legacy_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    # Feed a generator to exercise the streaming path
+    current = list(iter_travel_locations(loc for loc in locations))
+    current_seconds = time.perf_counter() - start
+    same = legacy == current
+    print(
+        f"{name:<30} points={len(locations):>8} episodes={len(current):>5} "
+        f"legacy={legacy_seconds:8.2f}s new={current_seconds:8.3f}s {'OK' if same else 'MISMATCH'}"
+    )
+    if not same:
+        print(f"  legacy episodes: {len(legacy)}, new episodes: {len(current)}")
+    return same
+
+
+if __name__ == "__main__":
+    ok = True
+    for seed, days in SYNTHETIC_CASES:
+        ok &= compare(f"synthetic seed={seed} days={days}", synthetic_trace(seed, days))
+    if len(sys.argv) > 3:
+        person, start_date, end_date = sys.argv[1:4]
+        with LocationDB() as db:
+            locations = db.get_locations_in_range(person, _date_to_ts(start_date), _date_to_ts(end_date) + 86400)
+        ok &= compare(f"{person} {start_date}..{end_date}", locations)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,75 @@
+"""
+cli.py
+
+Single entry point for the analyses:
+
+    uv run -m cli.cli <command> [args...]
+
+    import     import Owntracks JSON into SQLite (import/import.py)
+    places     top places by time spent (scripts/places.py)
+    together   minutes spent together per day (scripts/percent_time_together.py)
+    matrix     time together for every pair of people (scripts/together_matrix.py)
+    travel     detect travel episodes (scripts/travel.py)
+    graph      plot the distance apart for a day (graphs/distance_apart.py)
+    rollup     rebuild or check the dwell_daily rollup (scripts/rollup.py)
+    compact    merge stays and drop spikes in the locations table (compact/compact.py)
+    snapshot   refresh or check the memory-mapped per-person snapshots (db/snapshot.py)
+
+Only the chosen command's module is imported, and only once its arguments are needed, so
+`--help` and the other commands never pay for matplotlib, the geocoder or the database.
+"""
+
+import argparse
+import importlib
+import sys
+from typing import Dict, List, Optional, Tuple
+
+PROG = "owntracks-analysis"
+
+# Command name -> (module exposing add_arguments(parser) and main(args), help)
+COMMANDS: Dict[str, Tuple[str, str]] = {
+    "import": ("import.import", "import Owntracks JSON into SQLite"),
+    "places": ("scripts.places", "top places by time spent"),
+    "together": ("scripts.percent_time_together", "minutes spent together per day"),
+    "matrix": ("scripts.together_matrix", "time together for every pair of people"),
+    "travel": ("scripts.travel", "detect travel episodes"),
+    "graph": ("graphs.distance_apart", "plot the distance apart per minute for a day"),
+    "rollup": ("scripts.rollup", "rebuild or check the dwell_daily rollup"),
+    "compact": ("compact.compact", "merge stays and drop spikes in the locations table"),
+    "snapshot": ("db.snapshot", "refresh or check the memory-mapped per-person snapshots"),
+}
+
+
+def _selected_command(argv: List[str]) -> Optional[str]:
+    for arg in argv:
+        if not arg.startswith("-"):
+            return arg if arg in COMMANDS else None
+    return None
+
+
+def build_parser(argv: List[str]) -> argparse.ArgumentParser:
+    """
+    Returns the parser with every command listed, but with arguments only for the command
+    named in argv; that command's module is the only one imported.
+    """
+    parser = argparse.ArgumentParser(prog=PROG, description="Owntracks location history analysis.")
+    subparsers = parser.add_subparsers(dest="subcommand", metavar="command", required=True)
+    selected = _selected_command(argv)
+    for name, (module_name, help) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help, description=help)
+        if name == selected:
+            module = importlib.import_module(module_name)
+            module.add_arguments(subparser)
+            subparser.set_defaults(main=module.main)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser(argv).parse_args(argv)
+    status = args.main(args)
+    return status if isinstance(status, int) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+compact.py
+
+Compaction of the locations table: fewer rows, same answers within a stated tolerance.
+
+Every reader treats a row's location as constant over [timestamp_from, timestamp_to), so
+dropping a row hands its time to the previous row of the same device, and the error a
+reader sees is the distance between the two points. Per person/device, in timestamp order:
+
+1. Spikes are dropped: a fix reached and left at more than SPIKE_SPEED_MPS while its
+   neighbours are consistent with each other.
+2. Runs of contiguous rows within the radius of the run's first row are merged into that
+   row. The radius is tolerance_m, widened to the dropped fix's reported accuracy (at most
+   ACCURACY_RADIUS_CAP_M). This merges stays down to a few rows and simplifies moving
+   segments whose fixes are denser than the tolerance; it is the Douglas-Peucker idea of
+   keeping only points that deviate from what is already kept by more than the
+   tolerance, measured against the step function the analyses read instead of a line.
+3. A merged row spans at most MAX_MERGED_SECONDS, so consecutive rows of a stay stay
+   under the travel detector's 10 minute "still moving" step.
+
+Tolerance, for everything outside spikes:
+- every second is still covered by the same device, and is reported at most
+  max(tolerance_m, ACCURACY_RADIUS_CAP_M) from the fix that covered it before;
+- cluster_locations_by_time keeps each person's total time; hours only move between
+  cells for fixes within that distance of a cell edge;
+- time together only changes while two people are within twice that distance of the
+  together threshold;
+- detect_travel finds the same trips, matched one to one by overlapping time. Their start
+  and end times are not preserved: the detector starts an episode at the earliest fix
+  from which the average speed clears MINIMUM_SPEED_MPH, so with fewer fixes in the stay
+  before a departure the start (and with it the end) can move by up to about an hour.
+benchmarks.compaction measures all three on a copy of a database.
+
+Usage:
+    uv run -m compact.compact [person] [--tolerance METERS] [--dry-run] [--profile]
+"""
+
+import argparse
+import math
+import time
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from db.db import DB_PATH, EARTH_RADIUS_M, LocationDB, has_snapshots
+from profiling import profiling
+
+# Distance (m) within which consecutive fixes are merged
+TOLERANCE_M = 25.0
+# A fix's reported accuracy widens the radius up to this (m)
+ACCURACY_RADIUS_CAP_M = 100.0
+# Longest interval a merged row may cover; below the travel detector's 10 minutes
+MAX_MERGED_SECONDS = 9 * 60
+# Faster than anything a household member does on the ground or in a plane (m/s)
+SPIKE_SPEED_MPS = 100.0
+
+
+class Interval(NamedTuple):
+    id: int
+    timestamp_from: int
+    timestamp_to: int
+    lat: float
+    lon: float
+    accuracy: Optional[float]
+
+
+class CompactionResult(NamedTuple):
+    rows_before: int
+    rows_after: int
+    spikes: int
+    merged: int
+
+    @property
+    def ratio(self) -> float:
+        """
+        Rows before per row after.
+        """
+        return self.rows_before / self.rows_after if self.rows_after else 1.0
+
+    def __add__(self, other: "CompactionResult") -> "CompactionResult":
+        return CompactionResult(*(a + b for a, b in zip(self, other)))
+
+
+def _distance_m(a: Interval, b: Interval) -> float:
+    phi1 = math.radians(a.lat)
+    phi2 = math.radians(b.lat)
+    dphi = phi2 - phi1
+    dlambda = math.radians(b.lon - a.lon)
+    h = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(h, 1.0)))
+
+
+def _speed_mps(a: Interval, b: Interval) -> float:
+    seconds = b.timestamp_from - a.timestamp_from
+    return _distance_m(a, b) / seconds if seconds > 0 else math.inf
+
+
+def drop_spikes(rows: List[Interval], max_speed: float = SPIKE_SPEED_MPS) -> Tuple[List[Interval], List[int]]:
+    """
+    Returns the rows without spikes, and the ids of the spikes. The row before a spike
+    takes over its time if the two were contiguous.
+    """
+    kept: List[Interval] = []
+    dropped: List[int] = []
+    for i, row in enumerate(rows):
+        if kept and i + 1 < len(rows):
+            previous, following = kept[-1], rows[i + 1]
+            if (
+                _speed_mps(previous, row) > max_speed
+                and _speed_mps(row, following) > max_speed
+                and _speed_mps(previous, following) <= max_speed
+            ):
+                if previous.timestamp_to == row.timestamp_from:
+                    kept[-1] = previous._replace(timestamp_to=row.timestamp_to)
+                dropped.append(row.id)
+                continue
+        kept.append(row)
+    return kept, dropped
+
+
+def merge_runs(
+    rows: List[Interval],
+    tolerance_m: float = TOLERANCE_M,
+    max_seconds: int = MAX_MERGED_SECONDS,
+) -> Tuple[List[Interval], List[int]]:
+    """
+    Returns the rows with each run of contiguous nearby rows merged into its first row
+    (see the module docstring), and the ids of the rows merged away.
+    """
+    kept: List[Interval] = []
+    dropped: List[int] = []
+    for row in rows:
+        if kept:
+            anchor = kept[-1]
+            radius = max(tolerance_m, min(row.accuracy or 0.0, ACCURACY_RADIUS_CAP_M))
+            if (
+                anchor.timestamp_to == row.timestamp_from
+                # Open rows wait for the next import to be closed
+                and row.timestamp_to > row.timestamp_from
+                and row.timestamp_to - anchor.timestamp_from <= max_seconds
+                and _distance_m(anchor, row) <= radius
+            ):
+                kept[-1] = anchor._replace(timestamp_to=row.timestamp_to)
+                dropped.append(row.id)
+                continue
+        kept.append(row)
+    return kept, dropped
+
+
+def compact_intervals(
+    rows: Iterable[tuple], tolerance_m: float = TOLERANCE_M
+) -> Tuple[List[Interval], List[int], int]:
+    """
+    Compacts one device's rows (in timestamp order). Returns the rows that remain, with
+    their new timestamp_to, the ids to delete, and how many of those were spikes.
+    """
+    rows = [Interval(*row) for row in rows]
+    without_spikes, spikes = drop_spikes(rows)
+    kept, merged = merge_runs(without_spikes, tolerance_m)
+    return kept, spikes + merged, len(spikes)
+
+
+def compact_device(
+    db: LocationDB,
+    person: str,
+    device: str,
+    from_ts: Optional[int] = None,
+    tolerance_m: float = TOLERANCE_M,
+    dry_run: bool = False,
+) -> CompactionResult:
+    """
+    Compacts a person/device's rows from the last row before from_ts (all rows if None).
+    """
+    rows = db.get_device_intervals(person, device, from_ts)
+    original_ends = {row[0]: row[2] for row in rows}
+    kept, deleted, spikes = compact_intervals(rows, tolerance_m)
+    if not dry_run and deleted:
+        new_ends = [(row.timestamp_to, row.id) for row in kept if row.timestamp_to != original_ends[row.id]]
+        db.rewrite_intervals(deleted, new_ends)
+        db.bump_data_versions(person, device, rows[0][1], rows[-1][1])
+    return CompactionResult(len(rows), len(kept), spikes, len(deleted) - spikes)
+
+
+def run_compaction(
+    person: Optional[str] = None,
+    tolerance_m: float = TOLERANCE_M,
+    dry_run: bool = False,
+    db_path: str = DB_PATH,
+) -> CompactionResult:
+    """
+    Compacts every device (of one person, or everyone) and refreshes the dwell rollup and
+    any snapshots.
+    """
+    start = time.perf_counter()
+    db = LocationDB(db_path)
+    total = CompactionResult(0, 0, 0, 0)
+    persons = set()
+    with profiling.stage("compact.devices") as stage:
+        for device_person, device in db.get_devices():
+            if person is not None and device_person != person:
+                continue
+            result = compact_device(db, device_person, device, tolerance_m=tolerance_m, dry_run=dry_run)
+            total += result
+            persons.add(device_person)
+            print(
+                f"{device_person}/{device}: {result.rows_before} -> {result.rows_after} rows "
+                f"({result.ratio:.2f}x, {result.spikes} spikes)"
+            )
+        stage.rows = total.rows_before
+    if not dry_run and total.rows_after != total.rows_before:
+        with profiling.stage("compact.rollup"):
+            for p in sorted(persons):
+                db.refresh_dwell_rollup(p)
+        if has_snapshots(db_path):
+            from db.snapshot import refresh_snapshots
+
+            refresh_snapshots(db, sorted(persons))
+    db.close()
+    print(
+        f"Compaction{' (dry run)' if dry_run else ''}: {total.rows_before} -> {total.rows_after} rows, "
+        f"ratio {total.ratio:.2f}x, spikes={total.spikes}, merged={total.merged}, "
+        f"tolerance={tolerance_m:g} m, {time.perf_counter() - start:.2f}s"
+    )
+    return total
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("person", nargs="?", help="only this person (default: everyone)")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE_M,
+        help=f"merge radius in meters (default: {TOLERANCE_M:g}), widened by fix accuracy up to {ACCURACY_RADIUS_CAP_M:g}",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="report the ratio without changing the database")
+    profiling.add_profile_arguments(parser)
+
+
+def main(args: argparse.Namespace):
+    with profiling.profile_session(args):
+        run_compaction(args.person, args.tolerance, args.dry_run)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge stays, simplify tracks and drop spikes in locations.db.")
+    add_arguments(parser)
+    main(parser.parse_args())
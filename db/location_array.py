@@ -0,0 +1,181 @@
+"""
+location_array.py
+
+Columnar (struct-of-arrays) container for location intervals, backed by NumPy.
+"""
+
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# Row layout produced by the LocationDB array queries
+ROW_DTYPE = np.dtype(
+    [
+        ("person", object),
+        ("device", object),
+        ("timestamp_from", np.int64),
+        ("timestamp_to", np.int64),
+        ("lat", np.float64),
+        ("lon", np.float64),
+        ("accuracy", np.float32),
+        ("battery", np.float32),
+    ]
+)
+# Row layout of LocationDB.get_steps_in_range: an interval and the device's next fix
+STEP_DTYPE = np.dtype(
+    [
+        ("seconds", np.int64),
+        ("lat", np.float64),
+        ("lon", np.float64),
+        ("next_lat", np.float64),
+        ("next_lon", np.float64),
+    ]
+)
+
+
+def _factorize(values: np.ndarray) -> Tuple[np.ndarray, Tuple[str, ...]]:
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int32), ()
+    categories, codes = np.unique(values, return_inverse=True)
+    return codes.astype(np.int32), tuple(categories.tolist())
+
+
+class LocationArray:
+    """
+    Location intervals stored as one array per column, sorted by timestamp_from.
+
+    Timestamps are int64 epoch seconds, lat/lon float64, accuracy and battery float32
+    (NaN where unknown). Person and device are categorical: small integer codes into the
+    persons/devices tuples. Indexing with a slice returns views; indexing with an int
+    returns a Location dict.
+    """
+
+    __slots__ = (
+        "timestamp_from",
+        "timestamp_to",
+        "lat",
+        "lon",
+        "accuracy",
+        "battery",
+        "person_codes",
+        "persons",
+        "device_codes",
+        "devices",
+        "_timestamp_to_max",
+    )
+
+    def __init__(
+        self,
+        timestamp_from: np.ndarray,
+        timestamp_to: np.ndarray,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        accuracy: np.ndarray,
+        battery: np.ndarray,
+        person_codes: np.ndarray,
+        persons: Sequence[str],
+        device_codes: np.ndarray,
+        devices: Sequence[str],
+    ):
+        self.timestamp_from = timestamp_from
+        self.timestamp_to = timestamp_to
+        self.lat = lat
+        self.lon = lon
+        self.accuracy = accuracy
+        self.battery = battery
+        self.person_codes = person_codes
+        self.persons = tuple(persons)
+        self.device_codes = device_codes
+        self.devices = tuple(devices)
+        self._timestamp_to_max: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> "LocationArray":
+        """
+        Builds an array from (person, device, timestamp_from, timestamp_to, lat, lon,
+        accuracy, battery) rows, e.g. a sqlite3 cursor, sorted by timestamp_from.
+        No per-row objects are created beyond what the cursor yields.
+        """
+        records = np.fromiter(rows, dtype=ROW_DTYPE)
+        person_codes, persons = _factorize(records["person"])
+        device_codes, devices = _factorize(records["device"].astype(str))
+        return cls(
+            timestamp_from=np.ascontiguousarray(records["timestamp_from"]),
+            timestamp_to=np.ascontiguousarray(records["timestamp_to"]),
+            lat=np.ascontiguousarray(records["lat"]),
+            lon=np.ascontiguousarray(records["lon"]),
+            accuracy=np.ascontiguousarray(records["accuracy"]),
+            battery=np.ascontiguousarray(records["battery"]),
+            person_codes=person_codes,
+            persons=persons,
+            device_codes=device_codes,
+            devices=devices,
+        )
+
+    def __len__(self) -> int:
+        return len(self.timestamp_from)
+
+    def __repr__(self):
+        return f"LocationArray(rows={len(self)}, persons={self.persons}, devices={self.devices})"
+
+    def __getitem__(self, index: Union[int, slice, np.ndarray]):
+        if isinstance(index, (int, np.integer)):
+            return self.location(int(index))
+        return LocationArray(
+            timestamp_from=self.timestamp_from[index],
+            timestamp_to=self.timestamp_to[index],
+            lat=self.lat[index],
+            lon=self.lon[index],
+            accuracy=self.accuracy[index],
+            battery=self.battery[index],
+            person_codes=self.person_codes[index],
+            persons=self.persons,
+            device_codes=self.device_codes[index],
+            devices=self.devices,
+        )
+
+    @property
+    def person(self) -> np.ndarray:
+        return np.asarray(self.persons, dtype=object)[self.person_codes]
+
+    @property
+    def device(self) -> np.ndarray:
+        return np.asarray(self.devices, dtype=object)[self.device_codes]
+
+    def location(self, i: int) -> dict:
+        """
+        Returns row i as a Location dict (NaN accuracy/battery become None).
+        """
+        accuracy = float(self.accuracy[i])
+        battery = float(self.battery[i])
+        return {
+            "person": self.persons[self.person_codes[i]],
+            "device": self.devices[self.device_codes[i]],
+            "timestamp_from": int(self.timestamp_from[i]),
+            "timestamp_to": int(self.timestamp_to[i]),
+            "lat": float(self.lat[i]),
+            "lon": float(self.lon[i]),
+            "accuracy": None if np.isnan(accuracy) else accuracy,
+            "battery": None if np.isnan(battery) else battery,
+        }
+
+    def to_locations(self) -> List[dict]:
+        return [self.location(i) for i in range(len(self))]
+
+    def slice_time(self, from_ts: int, to_ts: int) -> "LocationArray":
+        """
+        Returns the intervals overlapping [from_ts, to_ts), like LocationDB.get_locations_in_range.
+
+        Both bounds are found by binary search, so the result is a view. If intervals
+        overlap (several devices), rows inside the window that end before from_ts are
+        filtered out, which copies.
+        """
+        hi = int(np.searchsorted(self.timestamp_from, to_ts, side="left"))
+        if self._timestamp_to_max is None:
+            self._timestamp_to_max = np.maximum.accumulate(self.timestamp_to)
+        lo = int(np.searchsorted(self._timestamp_to_max, from_ts, side="right"))
+        window = self[lo:max(lo, hi)]
+        ended = window.timestamp_to <= from_ts
+        if ended.any():
+            return window[~ended]
+        return window
@@ -0,0 +1,315 @@
+"""
+snapshot.py
+
+Per-person columnar snapshots of the locations table, memory-mapped for zero-copy loads.
+
+A snapshot file holds one person's intervals in timestamp_from order, one contiguous
+little-endian column each (timestamps int64, lat/lon float64 so nothing is rounded,
+accuracy/battery float32, device codes int32), after a small JSON header. The time index
+is timestamp_from itself (sorted) and the running maximum of timestamp_to, which
+LocationArray.slice_time binary-searches, so a range is a view into the mapped file.
+
+The database stays the source of truth. The header records the person's data versions
+(LocationDB.get_data_versions) at the time of writing, and LocationDB only answers a range
+from the snapshot while the versions of the months it overlaps are unchanged. Snapshots
+exist once their directory does (refresh_snapshots(create=True), `import --snapshots`);
+from then on run_import and compaction refresh them, rewriting each file from the first
+month whose version changed.
+
+Usage:
+    uv run -m db.snapshot refresh [person] [--profile]
+    uv run -m db.snapshot check [person] [--profile]
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from db.db import LocationDB, snapshot_dir
+from db.location_array import LocationArray
+from profiling import profiling
+
+MAGIC = b"OTSNAP\x00\x00"
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_SUFFIX = ".snap"
+# Columns start at multiples of this, so every column is aligned for NumPy (and for SIMD)
+ALIGNMENT = 64
+# Column name -> on-disk dtype, in file order
+COLUMNS: Tuple[Tuple[str, np.dtype], ...] = (
+    ("timestamp_from", np.dtype("<i8")),
+    ("timestamp_to", np.dtype("<i8")),
+    ("timestamp_to_max", np.dtype("<i8")),
+    ("lat", np.dtype("<f8")),
+    ("lon", np.dtype("<f8")),
+    ("accuracy", np.dtype("<f4")),
+    ("battery", np.dtype("<f4")),
+    ("device_codes", np.dtype("<i4")),
+)
+
+
+class Snapshot(NamedTuple):
+    person: str
+    # (month, version) at the time of writing, sorted by month
+    versions: List[Tuple[str, int]]
+    array: LocationArray
+
+
+class RefreshResult(NamedTuple):
+    person: str
+    # Rows read from the database (the rest were kept from the previous file)
+    rows_read: int
+    rows: int
+
+
+def snapshot_path(db_path: str, person: str) -> str:
+    return os.path.join(snapshot_dir(db_path), quote(person, safe="") + SNAPSHOT_SUFFIX)
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _layout(rows: int) -> Tuple[Dict[str, int], int]:
+    """
+    Returns each column's offset from the start of the data, and the data's size.
+    """
+    offsets = {}
+    size = 0
+    for name, dtype in COLUMNS:
+        offsets[name] = size
+        size = _aligned(size + rows * dtype.itemsize)
+    return offsets, size
+
+
+# path -> ((inode, mtime, size), snapshot), so each process maps a file once
+_OPEN: Dict[str, Tuple[Tuple[int, int, int], Snapshot]] = {}
+
+
+def open_snapshot(path: str) -> Optional[Snapshot]:
+    """
+    Maps a snapshot file, or returns None if there is none. The arrays are read-only views
+    of the mapping; nothing is read until they are used.
+
+    Raises ValueError if the file is not a snapshot of this format.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _OPEN.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a snapshot")
+    (header_size,) = struct.unpack_from("<I", mapped, len(MAGIC))
+    header_start = len(MAGIC) + 4
+    header = json.loads(mapped[header_start : header_start + header_size])
+    if header["format"] != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path} has snapshot format {header['format']}, expected {SNAPSHOT_FORMAT}")
+    rows = header["rows"]
+    data_start = _aligned(header_start + header_size)
+    offsets, _ = _layout(rows)
+    columns = {
+        name: np.frombuffer(mapped, dtype=dtype, count=rows, offset=data_start + offsets[name])
+        for name, dtype in COLUMNS
+    }
+    timestamp_to_max = columns.pop("timestamp_to_max")
+    array = LocationArray(
+        **columns,
+        person_codes=np.broadcast_to(np.int32(0), (rows,)),
+        persons=(header["person"],),
+        devices=header["devices"],
+    )
+    array._timestamp_to_max = timestamp_to_max
+    snapshot = Snapshot(header["person"], [tuple(v) for v in header["versions"]], array)
+    _OPEN[path] = (key, snapshot)
+    return snapshot
+
+
+def _month_start(month: str) -> int:
+    return int(time.mktime(time.strptime(month, "%Y-%m")))
+
+
+def _write_snapshot(
+    path: str,
+    person: str,
+    versions: List[Tuple[str, int]],
+    devices: List[str],
+    parts: List[Dict[str, np.ndarray]],
+):
+    """
+    Writes the concatenation of parts (column name -> array) as a snapshot, through a
+    temporary file so readers only ever map a complete one.
+    """
+    rows = sum(len(part["timestamp_from"]) for part in parts)
+    offsets, _ = _layout(rows)
+    header = json.dumps(
+        {
+            "format": SNAPSHOT_FORMAT,
+            "person": person,
+            "rows": rows,
+            "devices": devices,
+            "versions": versions,
+            "columns": {name: [dtype.str, offsets[name]] for name, dtype in COLUMNS},
+        }
+    ).encode()
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        data_start = _aligned(f.tell())
+        for name, dtype in COLUMNS:
+            f.write(b"\0" * (data_start + offsets[name] - f.tell()))
+            for part in parts:
+                f.write(np.ascontiguousarray(part[name], dtype=dtype).data)
+    os.replace(temp_path, path)
+
+
+def refresh_snapshot(db: LocationDB, person: str) -> RefreshResult:
+    """
+    Brings a person's snapshot up to date with the database. Rows before the first local
+    month whose data version changed are copied from the previous file; the rest are read
+    from the database.
+    """
+    path = snapshot_path(db.db_path, person)
+    # Versions first: if rows change while the file is written, it looks stale, not fresh
+    versions = db.get_data_versions(person)
+    if versions is None:
+        raise ValueError("the database has no data_versions table; re-run the import")
+    try:
+        previous = open_snapshot(path)
+    except ValueError:
+        previous = None
+    if previous is not None and previous.versions == versions:
+        return RefreshResult(person, 0, len(previous.array))
+
+    kept = None
+    read_from = None
+    if previous is not None:
+        old = dict(previous.versions)
+        new = dict(versions)
+        changed = min(month for month in old.keys() | new.keys() if old.get(month) != new.get(month))
+        read_from = _month_start(changed)
+        keep = int(np.searchsorted(previous.array.timestamp_from, read_from, side="left"))
+        if keep:
+            kept = previous.array[:keep]
+    read = db.get_location_array(person, starts_from=read_from if kept is not None else None)
+
+    devices = sorted(set(read.devices) | set(kept.devices if kept is not None else ()))
+    parts = []
+    running_max = np.iinfo(np.int64).min
+    for part in (kept, read):
+        if part is None or len(part) == 0:
+            continue
+        codes = np.array([devices.index(d) for d in part.devices], dtype=np.int32)
+        if part is kept:
+            timestamp_to_max = previous.array._timestamp_to_max[: len(kept)]
+        else:
+            timestamp_to_max = np.maximum(np.maximum.accumulate(part.timestamp_to), running_max)
+        running_max = int(timestamp_to_max[-1])
+        parts.append(
+            {
+                "timestamp_from": part.timestamp_from,
+                "timestamp_to": part.timestamp_to,
+                "timestamp_to_max": timestamp_to_max,
+                "lat": part.lat,
+                "lon": part.lon,
+                "accuracy": part.accuracy,
+                "battery": part.battery,
+                "device_codes": part.device_codes
+                if np.array_equal(codes, np.arange(len(codes)))
+                else codes[part.device_codes],
+            }
+        )
+    _write_snapshot(path, person, versions, devices, parts)
+    return RefreshResult(person, len(read), len(read) + (len(kept) if kept is not None else 0))
+
+
+def refresh_snapshots(
+    db: LocationDB, persons: Optional[List[str]] = None, create: bool = False
+) -> List[RefreshResult]:
+    """
+    Refreshes the snapshots of the given persons (everyone by default, in which case the
+    snapshots of persons no longer in the database are removed). Does nothing unless the
+    snapshot directory exists or create is True.
+    """
+    directory = snapshot_dir(db.db_path)
+    if not os.path.isdir(directory):
+        if not create:
+            return []
+        os.makedirs(directory)
+    everyone = db.get_persons()
+    if persons is None:
+        persons = everyone
+        for name in os.listdir(directory):
+            if name.endswith(SNAPSHOT_SUFFIX) and unquote(name[: -len(SNAPSHOT_SUFFIX)]) not in everyone:
+                os.remove(os.path.join(directory, name))
+    with profiling.stage("snapshot.refresh") as stage:
+        results = [refresh_snapshot(db, person) for person in persons]
+        stage.rows = sum(result.rows_read for result in results)
+    return results
+
+
+def check_snapshots(db: LocationDB, persons: Optional[List[str]] = None) -> List[str]:
+    """
+    Returns the persons whose snapshot is missing, stale or differs from the database.
+    """
+    bad = []
+    for person in persons or db.get_persons():
+        snapshot = open_snapshot(snapshot_path(db.db_path, person))
+        if snapshot is None or snapshot.versions != db.get_data_versions(person):
+            bad.append(person)
+            continue
+        expected = db.get_location_array(person)
+        actual = snapshot.array
+        # Rows starting at the same second may come in any order
+        order_expected = np.lexsort((expected.device, expected.timestamp_from))
+        order_actual = np.lexsort((actual.device, actual.timestamp_from))
+        for name in ("timestamp_from", "timestamp_to", "lat", "lon", "accuracy", "battery", "device"):
+            a = getattr(expected, name)[order_expected]
+            b = getattr(actual, name)[order_actual]
+            if not np.array_equal(a, b, equal_nan=a.dtype.kind == "f"):
+                bad.append(person)
+                break
+    return bad
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("command", choices=("refresh", "check"))
+    parser.add_argument("person", nargs="?")
+    profiling.add_profile_arguments(parser)
+
+
+def main(args: argparse.Namespace) -> int:
+    persons = [args.person] if args.person else None
+    with profiling.profile_session(args), LocationDB() as db:
+        if args.command == "refresh":
+            db.create_schema()
+            start = time.perf_counter()
+            for result in refresh_snapshots(db, persons, create=True):
+                print(f"{result.person}: {result.rows} rows ({result.rows_read} read from the database)")
+            print(f"Refreshed snapshots in {snapshot_dir(db.db_path)} in {time.perf_counter() - start:.2f}s")
+            return 0
+        bad = check_snapshots(db, persons)
+        for person in bad:
+            print(f"{person}: snapshot missing, stale or different from the database")
+        print(f"{len(bad)} bad snapshots")
+        return 0 if not bad else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the memory-mapped per-person snapshots.")
+    add_arguments(parser)
+    sys.exit(main(parser.parse_args()))
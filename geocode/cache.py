@@ -0,0 +1,154 @@
+"""
+cache.py
+
+SQLite key-value store for reverse geocoding responses, keyed by rounded lat/lon and zoom.
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import time
+from typing import Iterator, Optional, Tuple
+
+CACHE_DB = "geocode_cache.db"
+# The JSON file the cache used to live in; migrated once into CACHE_DB
+LEGACY_CACHE_FILE = "geocode_cache.json"
+# Zoom the legacy JSON entries were requested with
+LEGACY_ZOOM = 14
+# Pending writes are committed in batches of this size (and at exit)
+COMMIT_EVERY = 25
+
+
+class GeocodeCache:
+    """
+    Geocoding responses stored in an SQLite table with point lookups.
+
+    The database is opened on first use, so creating a GeocodeCache is free. Writes are
+    committed every COMMIT_EVERY puts, on flush()/close(), and at interpreter exit.
+    Entries older than ttl seconds are treated as missing; negative results ("Unknown")
+    can be given a shorter negative_ttl so they are retried. Both default to never.
+    """
+
+    def __init__(
+        self,
+        db_path: str = CACHE_DB,
+        legacy_json: Optional[str] = LEGACY_CACHE_FILE,
+        ttl: Optional[int] = None,
+        negative_ttl: Optional[int] = None,
+        commit_every: int = COMMIT_EVERY,
+    ):
+        self.db_path = db_path
+        self.legacy_json = legacy_json
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.commit_every = commit_every
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS geocode_cache (
+                    lat REAL NOT NULL,
+                    lon REAL NOT NULL,
+                    zoom INTEGER NOT NULL,
+                    response TEXT NOT NULL,
+                    negative INTEGER NOT NULL,
+                    fetched_at INTEGER NOT NULL,
+                    PRIMARY KEY (lat, lon, zoom)
+                ) WITHOUT ROWID
+            """)
+            conn.commit()
+            self._conn = conn
+            self._migrate_legacy_json()
+            atexit.register(self.close)
+        return self._conn
+
+    def _migrate_legacy_json(self):
+        """
+        Copies entries from the old JSON cache file into an empty table, once.
+        """
+        if not self.legacy_json or not os.path.exists(self.legacy_json):
+            return
+        conn = self._conn
+        if conn.execute("SELECT 1 FROM geocode_cache LIMIT 1").fetchone():
+            return
+        with open(self.legacy_json, "r") as f:
+            legacy = json.load(f)
+        fetched_at = int(os.path.getmtime(self.legacy_json))
+        rows = []
+        for key, response in legacy.items():
+            lat, lon = (float(part) for part in key.split(","))
+            rows.append(
+                (lat, lon, LEGACY_ZOOM, json.dumps(response), _is_negative(response), fetched_at)
+            )
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO geocode_cache (lat, lon, zoom, response, negative, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        conn.commit()
+        print(f"Migrated {len(rows)} geocode cache entries from {self.legacy_json} to {self.db_path}")
+
+    def get(self, lat: float, lon: float, zoom: int) -> Optional[dict]:
+        """
+        Returns the cached response for a rounded point, or None if missing or expired.
+        """
+        row = self._connect().execute(
+            "SELECT response, negative, fetched_at FROM geocode_cache WHERE lat = ? AND lon = ? AND zoom = ?",
+            (lat, lon, zoom),
+        ).fetchone()
+        if row is None:
+            return None
+        response, negative, fetched_at = row
+        ttl = self.negative_ttl if negative and self.negative_ttl is not None else self.ttl
+        if ttl is not None and time.time() - fetched_at > ttl:
+            return None
+        return json.loads(response)
+
+    def iter_known(self, zoom: int) -> Iterator[Tuple[float, float, dict]]:
+        """
+        Yields (lat, lon, response) for every unexpired, non-negative entry at zoom.
+        """
+        cur = self._connect().execute(
+            "SELECT lat, lon, response, fetched_at FROM geocode_cache WHERE zoom = ? AND negative = 0",
+            (zoom,),
+        )
+        now = time.time()
+        for lat, lon, response, fetched_at in cur:
+            if self.ttl is not None and now - fetched_at > self.ttl:
+                continue
+            yield lat, lon, json.loads(response)
+
+    def put(self, lat: float, lon: float, zoom: int, response: dict):
+        self._connect().execute(
+            """
+            INSERT OR REPLACE INTO geocode_cache (lat, lon, zoom, response, negative, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (lat, lon, zoom, json.dumps(response), _is_negative(response), int(time.time())),
+        )
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        if self._conn is not None and self._pending:
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self):
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+            atexit.unregister(self.close)
+
+
+def _is_negative(response: dict) -> int:
+    return int(response.get("display_name") == "Unknown" and "address" not in response)
@@ -1,12 +1,24 @@
-from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
-import requests
-import json
-import os
+import threading
 import time
 
-CACHE_FILE = "geocode_cache.json"
+from geocode.cache import CACHE_DB, GeocodeCache
+from geocode.offline import PlaceIndex, read_gazetteer
+from profiling import profiling
+
+if TYPE_CHECKING:
+    import requests
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/reverse"
 USER_AGENT = "owntracks-analysis-script"
+ZOOM = 14
+# Nominatim's usage policy allows at most one request per second
+REQUESTS_PER_SECOND = 1.0
+WORKERS = 2
+# Default radius for nearest-known-place answers when running offline
+OFFLINE_RADIUS_M = 2000.0
 
 
 class PlaceInfo(NamedTuple):
@@ -17,72 +29,228 @@ class PlaceInfo(NamedTuple):
     country: str
 
 
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+            profiling.record("geocode.rate_limit_sleep", wait)
+
+
 class Geocoder:
-    def __init__(self, cache_file: str = CACHE_FILE):
-        self.cache_file = cache_file
-        self.cache = self._load_cache()
+    def __init__(
+        self,
+        cache_file: str = CACHE_DB,
+        negative_ttl: Optional[int] = None,
+        url: str = NOMINATIM_URL,
+        requests_per_second: float = REQUESTS_PER_SECOND,
+        workers: int = WORKERS,
+        offline: bool = False,
+        nearest_radius_m: Optional[float] = None,
+        gazetteer: Optional[str] = None,
+    ):
+        """
+        cache_file: SQLite cache database (an existing geocode_cache.json is migrated into it)
+        negative_ttl: seconds after which "Unknown" results are retried; never by default
+        url: reverse geocoding endpoint (Nominatim-compatible), e.g. a local stand-in server
+        requests_per_second: shared rate limit across all requests made by this geocoder
+        workers: concurrent requests used by get_place_info_many
+        offline: never use the network; misses are answered from the nearest known place
+        nearest_radius_m: on a cache miss, answer with the nearest cached or gazetteer place
+            within this radius before going to the network (OFFLINE_RADIUS_M when offline)
+        gazetteer: optional CSV of extra known places (see geocode.offline.read_gazetteer)
+        """
+        self.cache = GeocodeCache(cache_file, negative_ttl=negative_ttl)
+        self.url = url
+        self.workers = workers
+        self.offline = offline
+        self.nearest_radius_m = nearest_radius_m
+        self.gazetteers: List[str] = [gazetteer] if gazetteer else []
+        self._limiter = TokenBucket(requests_per_second)
+        self._session: Optional["requests.Session"] = None
+        self._session_lock = threading.Lock()
+        self._index: Optional[PlaceIndex] = None
 
-    def _load_cache(self):
-        if os.path.exists(self.cache_file):
-            with open(self.cache_file, "r") as f:
-                return json.load(f)
-        return {}
+    def load_gazetteer(self, path: str):
+        self.gazetteers.append(path)
+        if self._index is not None:
+            self._index.add_all(read_gazetteer(path))
 
-    def _save_cache(self):
-        with open(self.cache_file, "w") as f:
-            json.dump(self.cache, f)
+    def _nearest_radius(self) -> Optional[float]:
+        if self.nearest_radius_m is not None:
+            return self.nearest_radius_m
+        return OFFLINE_RADIUS_M if self.offline else None
 
-    def reverse_geocode(self, lat: float, lon: float, round_digits = 2) -> dict:
-        # Approximate to avoid too many overly-precise requests.
-        # 2 digits rounds to the nearest ~1.1km
-        lat = round(lat, round_digits)
-        lon = round(lon, round_digits)
+    def _nearest_known(self, lat: float, lon: float) -> Optional[dict]:
+        """
+        Returns the nearest known place within the configured radius, if any. The index
+        is built on first use from every cached response plus the gazetteers.
+        """
+        radius = self._nearest_radius()
+        if radius is None:
+            return None
+        if self._index is None:
+            self._index = PlaceIndex()
+            self._index.add_all(self.cache.iter_known(ZOOM))
+            for path in self.gazetteers:
+                self._index.add_all(read_gazetteer(path))
+        found = self._index.nearest(lat, lon, radius)
+        return found[1] if found else None
+
+    def _remember(self, lat: float, lon: float, data: dict):
+        self.cache.put(lat, lon, ZOOM, data)
+        if self._index is not None and data.get("address"):
+            self._index.add(lat, lon, data)
+
+    def _get_session(self) -> "requests.Session":
+        # One pooled keep-alive session, created on first network request; requests is
+        # only imported then, so cached and offline runs never load it. Worker threads
+        # may race here, so creation is locked and the session is published fully mounted.
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    import requests.adapters
+
+                    session = requests.Session()
+                    session.headers["User-Agent"] = USER_AGENT
+                    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(self.workers, 1))
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
 
-        key = f"{lat:.5f},{lon:.5f}"
-        if key in self.cache:
-            return self.cache[key]
-        url = "https://nominatim.openstreetmap.org/reverse"
+    def _fetch(self, lat: float, lon: float) -> dict:
+        """
+        Requests one rounded point from the endpoint, waiting for the rate limiter.
+        Does not touch the cache, so it is safe to call from worker threads.
+        """
         params = {
             "lat": lat,
             "lon": lon,
             "format": "jsonv2",
-            "zoom": 14,
+            "zoom": ZOOM,
             "addressdetails": 1,
         }
-        headers = {"User-Agent": USER_AGENT}
+        self._limiter.acquire()  # Be polite to the API
         try:
             print(f"Geocoding ({lat}, {lon})")
-            resp = requests.get(url, params=params, headers=headers)
+            with profiling.stage("geocode.request"):
+                resp = self._get_session().get(self.url, params=params, timeout=30)
             if resp.status_code == 200:
-                data = resp.json()
-                self.cache[key] = data
-                self._save_cache()
-                time.sleep(1)  # Be polite to the API
-                return data
+                return resp.json()
         except Exception as e:
             print(f"Error geocoding {lat},{lon}: {e}")
-        self.cache[key] = {"display_name": "Unknown"}
-        self._save_cache()
+        profiling.count("geocode.fetch_errors")
         return {"display_name": "Unknown"}
 
+    def reverse_geocode(self, lat: float, lon: float, round_digits = 2) -> dict:
+        # Approximate to avoid too many overly-precise requests.
+        # 2 digits rounds to the nearest ~1.1km
+        lat = round(lat, round_digits)
+        lon = round(lon, round_digits)
+
+        cached = self.cache.get(lat, lon, ZOOM)
+        if cached is not None:
+            profiling.count("geocode.cache_hits")
+            return cached
+        nearest = self._nearest_known(lat, lon)
+        if nearest is not None:
+            profiling.count("geocode.nearest_hits")
+            return nearest
+        profiling.count("geocode.misses")
+        if self.offline:
+            return {"display_name": "Unknown"}
+        data = self._fetch(lat, lon)
+        self._remember(lat, lon, data)
+        return data
+
+    def get_place_info_many(
+        self, points: Iterable[Tuple[float, float]], round_digits: int = 2
+    ) -> Iterator[Tuple[int, "PlaceInfo"]]:
+        """
+        Geocodes many (lat, lon) points, yielding (index, PlaceInfo) as results arrive.
+
+        Points are rounded like reverse_geocode and deduplicated, cache hits (and nearest
+        known places, if enabled) are yielded first, and misses are fetched concurrently by
+        `workers` threads sharing the rate limiter and a keep-alive session. Results come
+        back in arrival order, not input order.
+        """
+        indices_by_key: Dict[Tuple[float, float], List[int]] = {}
+        for i, (lat, lon) in enumerate(points):
+            key = (round(lat, round_digits), round(lon, round_digits))
+            indices_by_key.setdefault(key, []).append(i)
+
+        misses = []
+        for key, indices in indices_by_key.items():
+            cached = self.cache.get(key[0], key[1], ZOOM)
+            if cached is not None:
+                profiling.count("geocode.cache_hits")
+            else:
+                cached = self._nearest_known(key[0], key[1])
+                profiling.count("geocode.nearest_hits" if cached is not None else "geocode.misses")
+            if cached is None and self.offline:
+                cached = {"display_name": "Unknown"}
+            if cached is None:
+                misses.append(key)
+                continue
+            place = _place_info(cached)
+            for i in indices:
+                yield i, place
+        if not misses:
+            return
+
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            futures = {pool.submit(self._fetch, lat, lon): (lat, lon) for lat, lon in misses}
+            for future in as_completed(futures):
+                lat, lon = futures[future]
+                data = future.result()
+                # Cache writes stay on this thread, which owns the cache connection
+                self._remember(lat, lon, data)
+                place = _place_info(data)
+                for i in indices_by_key[(lat, lon)]:
+                    yield i, place
+        self.cache.flush()
+
     def get_place_info(self, lat: float, lon: float) -> "PlaceInfo":
-        resp = self.reverse_geocode(lat, lon)
-        address = resp.get("address", {})
-        city = (
-            address.get("city")
-            or address.get("town")
-            or address.get("village")
-            or address.get("hamlet")
-            or address.get("suburb")
-            or address.get("quarter")
-            or address.get("neighbourhood")
-            or address.get("county")
-            or "Unknown"
-        )
-        return PlaceInfo(
-            name=resp.get("name", "Unknown"),
-            display_name=resp.get("display_name", "Unknown"),
-            city=city,
-            state=address.get("state", "Unknown"),
-            country=address.get("country", "Unknown"),
-        )
+        return _place_info(self.reverse_geocode(lat, lon))
+
+
+def _place_info(resp: dict) -> PlaceInfo:
+    address = resp.get("address", {})
+    city = (
+        address.get("city")
+        or address.get("town")
+        or address.get("village")
+        or address.get("hamlet")
+        or address.get("suburb")
+        or address.get("quarter")
+        or address.get("neighbourhood")
+        or address.get("county")
+        or "Unknown"
+    )
+    return PlaceInfo(
+        name=resp.get("name", "Unknown"),
+        display_name=resp.get("display_name", "Unknown"),
+        city=city,
+        state=address.get("state", "Unknown"),
+        country=address.get("country", "Unknown"),
+    )
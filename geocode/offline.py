@@ -0,0 +1,91 @@
+"""
+offline.py
+
+In-memory spatial index of known places for offline, nearest-neighbor reverse geocoding.
+"""
+
+import csv
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Grid cell size in degrees (~1.1 km of latitude)
+CELL_DEGREES = 0.01
+METERS_PER_DEGREE_LAT = 111320.0
+EARTH_RADIUS_M = 6371000
+
+
+def _haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return EARTH_RADIUS_M * 2 * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class PlaceIndex:
+    """
+    Grid-hash index over (lat, lon) -> geocoding response.
+
+    Points are bucketed into CELL_DEGREES cells; a nearest lookup only visits the cells
+    that can hold a point within the radius, so it runs in microseconds regardless of
+    how many places are indexed.
+    """
+
+    def __init__(self, cell_degrees: float = CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._cells: Dict[Tuple[int, int], List[Tuple[float, float, dict]]] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees))
+
+    def add(self, lat: float, lon: float, response: dict):
+        self._cells.setdefault(self._cell(lat, lon), []).append((lat, lon, response))
+        self._size += 1
+
+    def add_all(self, places: Iterable[Tuple[float, float, dict]]):
+        for lat, lon, response in places:
+            self.add(lat, lon, response)
+
+    def nearest(self, lat: float, lon: float, radius_m: float) -> Optional[Tuple[float, dict]]:
+        """
+        Returns (distance_m, response) of the closest indexed place within radius_m, or None.
+        """
+        lat_cells = math.ceil(radius_m / METERS_PER_DEGREE_LAT / self.cell_degrees)
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        lon_cells = math.ceil(radius_m / (METERS_PER_DEGREE_LAT * cos_lat) / self.cell_degrees)
+        cell_lat, cell_lon = self._cell(lat, lon)
+        best = None
+        for i in range(cell_lat - lat_cells, cell_lat + lat_cells + 1):
+            for j in range(cell_lon - lon_cells, cell_lon + lon_cells + 1):
+                for place_lat, place_lon, response in self._cells.get((i, j), ()):
+                    distance = _haversine(lat, lon, place_lat, place_lon)
+                    if distance <= radius_m and (best is None or distance < best[0]):
+                        best = (distance, response)
+        return best
+
+
+def read_gazetteer(path: str) -> Iterable[Tuple[float, float, dict]]:
+    """
+    Reads a CSV gazetteer with a header row containing lat, lon, name and optionally
+    display_name, city, state and country. Each row becomes a Nominatim-shaped response.
+    """
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            name = row.get("name") or "Unknown"
+            address = {
+                key: row[key] for key in ("city", "state", "country") if row.get(key)
+            }
+            yield (
+                float(row["lat"]),
+                float(row["lon"]),
+                {
+                    "name": name,
+                    "display_name": row.get("display_name") or name,
+                    "address": address,
+                },
+            )
@@ -1,12 +1,11 @@
-import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 from analysis.distance_apart import distance_apart_per_minute
+from analysis.result_cache import add_cache_arguments, configure_cache
+from profiling import profiling
 
 
 import time
 
-import matplotlib.ticker as ticker
-
 
 def minute_to_hhmm(x, pos):
     h = int(x) // 60
@@ -19,6 +18,10 @@ def plot_distance_apart_for_day(person_a: str, person_b: str, day: str):
     Plots the per-minute distance apart for two people on a given day, adjusted for system local timezone.
     day: string in YYYY-MM-DD format
     """
+    # matplotlib takes longer to import than computing a day, so only load it to plot
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as ticker
+
     # Convert local date to local midnight timestamp
     dt_local = datetime.strptime(day, "%Y-%m-%d")
     start_ts = int(time.mktime(dt_local.timetuple()))
@@ -40,12 +43,24 @@ def plot_distance_apart_for_day(person_a: str, person_b: str, day: str):
     plt.show()
 
 
+def add_arguments(parser):
+    parser.add_argument("day", help="YYYY-MM-DD")
+    parser.add_argument("person_a", nargs="?", default="jackie")
+    parser.add_argument("person_b", nargs="?", default="zach")
+    add_cache_arguments(parser)
+    profiling.add_profile_arguments(parser)
+
+
+def main(args):
+    configure_cache(args)
+    with profiling.profile_session(args):
+        plot_distance_apart_for_day(args.person_a, args.person_b, args.day)
+
+
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) < 2:
-        print("Usage: uv run -m graphs.distance_apart <day YYYY-MM-DD> [person_a] [person_b]")
-        sys.exit(1)
-    day = sys.argv[1]
-    person_a = sys.argv[2] if len(sys.argv) > 2 else "jackie"
-    person_b = sys.argv[3] if len(sys.argv) > 3 else "zach"
-    plot_distance_apart_for_day(person_a, person_b, day)
+    # Usage: uv run -m graphs.distance_apart <day YYYY-MM-DD> [person_a] [person_b] [--no-cache] [--profile]
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Plot the distance apart per minute for a day.")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -1,120 +1,500 @@
+import argparse
 import os
 import glob
+import hashlib
+import itertools
 import json
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from db.db import LocationDB, DB_PATH, Location
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from db.db import IMPORT_PRAGMAS, LocationDB, DB_PATH, ImportedFile, has_snapshots
+from profiling import profiling
 
 JSON_DIR = "owntracks-json"
 
 
-def run_import():
-    # Remove existing database if present
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
+def _file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_needs_import(db: LocationDB, file_path: str) -> bool:
+    """
+    Decide whether a file has to be parsed in incremental mode.
+
+    Unchanged size and mtime is trusted without hashing. Otherwise the content hash decides;
+    a file that was only touched gets its metadata refreshed and is skipped.
+    """
+    previous = db.get_imported_file(file_path)
+    if previous is None:
+        return True
+    stat = os.stat(file_path)
+    if previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+        return False
+    if previous["sha256"] != _file_sha256(file_path):
+        return True
+    db.record_imported_file(
+        ImportedFile(
+            path=file_path,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            sha256=previous["sha256"],
+            rows=previous["rows"],
+            imported_at=previous["imported_at"],
+        )
+    )
+    return False
+
+
+# Rows per staged insert batch; each batch is committed on its own
+BATCH_ROWS = 50_000
+# Characters read from a JSON file at a time by the streaming tokenizer
+READ_CHUNK_CHARS = 1 << 20
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+class _JSONStream:
+    """
+    Minimal incremental JSON tokenizer over a text file.
+
+    Containers are walked one key or element at a time with object_keys/array_items, and
+    leaf values (such as a single Owntracks entry) are decoded with raw_decode, so only a
+    small window of the file is held in memory.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        data = self.f.read(READ_CHUNK_CHARS)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos :] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def consume(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"expected {char!r} but found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number ending exactly at the buffer edge may continue in the next read
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def object_keys(self) -> Iterator[str]:
+        """
+        Yields each key of the object at the current position. The caller must consume
+        the key's value before asking for the next key.
+        """
+        self.consume("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.consume(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.consume("}")
+            return
+
+    def array_items(self) -> Iterator[None]:
+        """
+        Yields once per element of the array at the current position. The caller must
+        consume the element before asking for the next one.
+        """
+        self.consume("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield None
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.consume("]")
+            return
+
+
+def _iter_json_entries(file_path: str) -> Iterator[Tuple[str, str, dict]]:
+    """
+    Streams (person, device, entry) from an export shaped {person: {device: [entry, ...]}}.
+    """
+    with open(file_path, "r") as f:
+        stream = _JSONStream(f)
+        if stream.peek() != "{":
+            raise ValueError("top-level value is not an object")
+        # Each top-level key is a person
+        for person in stream.object_keys():
+            if stream.peek() != "{":
+                stream.value()
+                continue
+            for device in stream.object_keys():
+                if stream.peek() != "[":
+                    stream.value()
+                    continue
+                for _ in stream.array_items():
+                    entry = stream.value()
+                    if isinstance(entry, dict):
+                        yield person, device, entry
+
+
+def _iter_file_rows(file_path: str, counts: Counter) -> Iterator[tuple]:
+    """
+    Validates a streamed export into location row tuples of
+    (person, device, timestamp_from, timestamp_to, lat, lon, accuracy, battery).
+
+    Each device's entries are sorted by tst (only one device's entries are held at a time),
+    so an entry's interval ends at the next entry of the same device and the newest entry
+    stays open (timestamp_to == timestamp_from). Intervals across files are repaired
+    afterwards by LocationDB.stitch_intervals.
+    """
+    for (person, device), group in itertools.groupby(
+        _iter_json_entries(file_path), key=lambda item: item[:2]
+    ):
+        entries = sorted((entry for _, _, entry in group), key=lambda e: e.get("tst", 0))
+        for i, entry in enumerate(entries):
+            if i + 1 < len(entries):
+                timestamp_to = entries[i + 1].get("tst")
+            else:
+                timestamp_to = entry.get("tst")
+            row = _validate_entry(person, device, entry, timestamp_to, counts)
+            if row is not None:
+                yield row
+
+
+def _validate_entry(
+    person: str, device: str, entry: dict, timestamp_to: int, counts: Counter
+) -> Optional[tuple]:
+    timestamp = entry.get("tst")
+    lat = entry.get("lat")
+    lon = entry.get("lon")
+
+    counts["total_entries"] += 1
+
+    # Skip malformed/invalid coordinates: missing or zero lat/lon
+    if lat is None or lon is None:
+        counts["skipped_missing"] += 1
+        return None
+    try:
+        lat = float(lat)
+        lon = float(lon)
+    except Exception:
+        # if lat/lon cannot be cast to float, skip
+        counts["skipped_invalid"] += 1
+        return None
+    # treat exact zero as invalid GPS coordinate in this dataset
+    if lat == 0.0 or lon == 0.0:
+        counts["skipped_zero"] += 1
+        return None
+
+    return (
+        person,
+        device,
+        timestamp,
+        timestamp_to,
+        lat,
+        lon,
+        _optional_number(entry.get("acc")),
+        _optional_number(entry.get("batt")),
+    )
+
+
+def _optional_number(value) -> Optional[float]:
+    """
+    Returns value if it is a number, else None, so a malformed optional field (a string,
+    an object) cannot fail the insert of the whole batch it is in.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+class ParsedFile(NamedTuple):
+    file_path: str
+    rows: List[tuple]
+    counts: Counter
+    error: Optional[str]
+
+
+def _parse_file(file_path: str) -> ParsedFile:
+    """
+    Parse and validate one whole export into compact row tuples.
+
+    Runs in worker processes when importing with several jobs, so it only returns plain data.
+    Deduplication happens afterwards when the rows are inserted.
+    """
+    counts = Counter()
+    try:
+        rows = list(_iter_file_rows(file_path, counts))
+    except (OSError, ValueError) as e:
+        return ParsedFile(file_path, [], counts, str(e))
+    return ParsedFile(file_path, rows, counts, None)
+
+
+def _iter_parsed_files(json_files: List[str], jobs: int) -> Iterator[ParsedFile]:
+    """
+    Yields whole parsed files in input order from a pool of jobs worker processes.
+    """
+    with ProcessPoolExecutor(max_workers=min(jobs, len(json_files))) as pool:
+        yield from pool.map(_parse_file, json_files)
+
+
+def run_import(incremental: bool = False, jobs: int = 1, compact: bool = False, snapshots: bool = False):
+    """
+    Import every JSON file under JSON_DIR into the locations database.
+
+    By default the database is rebuilt from scratch. With incremental=True the existing
+    database is kept, files already recorded in imported_files with the same content are
+    skipped, and new rows are appended (rows already present are ignored).
+
+    With one job, files are streamed entry by entry and inserted in batches of BATCH_ROWS,
+    so peak memory does not depend on the size of the input. jobs > 1 parses and validates
+    whole files in that many worker processes (memory then grows with the files in flight)
+    and inserts their rows in the same batches.
+
+    Duplicates (same person, device and tst) are dropped by the unique index; the first
+    row seen wins.
+
+    With compact=True the new rows (and the row before them) are compacted with
+    compact.compact after stitching, before the rollup is refreshed.
+
+    Per-person snapshots (db.snapshot) are refreshed last if they exist; snapshots=True
+    creates them.
+    """
+    timings: Dict[str, float] = {}
+    stage_start = time.perf_counter()
+
+    if not incremental:
+        # Remove existing database (and its WAL files) if present
+        for path in (DB_PATH, f"{DB_PATH}-wal", f"{DB_PATH}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
 
     # Recreate the database schema
-    db = LocationDB()
-    db.create_schema()
+    db = LocationDB(pragmas=IMPORT_PRAGMAS)
+    # A rebuild loads into an empty table, so the per-cell index is built after the insert
+    db.create_schema(bulk_load=not incremental)
 
-    json_files = glob.glob(os.path.join(JSON_DIR, "**", "*.json"), recursive=True)
+    json_files = sorted(
+        glob.glob(os.path.join(JSON_DIR, "**", "*.json"), recursive=True)
+    )
+    if incremental:
+        all_files = json_files
+        json_files = [p for p in all_files if _file_needs_import(db, p)]
+        print(
+            f"Incremental import: {len(json_files)} new or changed of {len(all_files)} files"
+        )
+    timings["discover"] = time.perf_counter() - stage_start
 
-    bulk_locations = []
     # Counters for logging
-    total_entries = 0
-    skipped_missing = 0
-    skipped_zero = 0
-    skipped_invalid = 0
-    skipped_dup_same = 0
-    skipped_dup_conflict = 0
-    # track last seen (person, device, timestamp) -> (lat, lon) to dedupe across files
-    last_seen = {}
-    for file_path in json_files:
-        with open(file_path, "r") as f:
+    counts = Counter()
+    # earliest timestamp staged per (person, device), where timestamp_to needs stitching
+    stitch_from = {}
+    # latest timestamp staged per (person, device)
+    staged_to = {}
+    # rows contributed by each file, recorded in imported_files after the insert
+    file_rows = {}
+    parse_seconds = 0.0
+
+    def track(file_path: str, rows: Iterable[tuple]) -> Iterator[tuple]:
+        file_rows[file_path] = 0
+        for row in rows:
+            device_key = (row[0], row[1])
+            if device_key not in stitch_from or row[2] < stitch_from[device_key]:
+                stitch_from[device_key] = row[2]
+            if device_key not in staged_to or row[2] > staged_to[device_key]:
+                staged_to[device_key] = row[2]
+            file_rows[file_path] += 1
+            yield row
+
+    def file_rows_serial() -> Iterator[tuple]:
+        for file_path in json_files:
+            file_counts = Counter()
             try:
-                data = json.load(f)
-            except Exception as e:
+                yield from track(file_path, _iter_file_rows(file_path, file_counts))
+            except (OSError, ValueError) as e:
+                # Rows from batches already committed for this file stay in the database
                 print(f"Error reading {file_path}: {e}")
+                del file_rows[file_path]
+            counts.update(file_counts)
+
+    def file_rows_parallel() -> Iterator[tuple]:
+        for parsed in _iter_parsed_files(json_files, jobs):
+            if parsed.error is not None:
+                print(f"Error reading {parsed.file_path}: {parsed.error}")
                 continue
+            counts.update(parsed.counts)
+            yield from track(parsed.file_path, parsed.rows)
+
+    def batches() -> Iterator[List[tuple]]:
+        nonlocal parse_seconds
+        if jobs > 1 and len(json_files) > 1:
+            rows = file_rows_parallel()
+        else:
+            rows = file_rows_serial()
+        while True:
+            batch_start = time.perf_counter()
+            batch = list(itertools.islice(rows, BATCH_ROWS))
+            parse_seconds += time.perf_counter() - batch_start
+            if not batch:
+                return
+            yield batch
+
+    stage_start = time.perf_counter()
+    # Spatial queries index the new rows in locations_rtree on first use, instead of a
+    # trigger per inserted row
+    db.suspend_spatial_index()
+    inserted, skipped_dup_same, skipped_dup_conflict = db.insert_location_batches(batches())
+    timings["parse"] = parse_seconds
+    timings["insert"] = time.perf_counter() - stage_start - parse_seconds
+
+    if not incremental:
+        stage_start = time.perf_counter()
+        db.create_schema()
+        timings["index"] = time.perf_counter() - stage_start
+
+    # Close intervals across file boundaries and against rows from earlier imports
+    stage_start = time.perf_counter()
+    stitched = 0
+    for (person, device), from_ts in stitch_from.items():
+        stitched += db.stitch_intervals(person, device, from_ts)
+        # Cached analysis results for the months around the new rows are stale now
+        db.bump_data_versions(person, device, from_ts, staged_to[(person, device)])
+    timings["stitch"] = time.perf_counter() - stage_start
+
+    compacted = 0
+    if compact:
+        from compact.compact import compact_device
+
+        stage_start = time.perf_counter()
+        for (person, device), from_ts in stitch_from.items():
+            result = compact_device(db, person, device, from_ts)
+            compacted += result.rows_before - result.rows_after
+        timings["compact"] = time.perf_counter() - stage_start
+
+    # Bring the dwell_daily rollup up to date for the persons that got new rows
+    stage_start = time.perf_counter()
+    if not incremental or not db.has_dwell_rollup():
+        db.refresh_dwell_rollup()
+    else:
+        refresh_from = {}
+        for (person, _), from_ts in stitch_from.items():
+            refresh_from[person] = min(from_ts, refresh_from.get(person, from_ts))
+        for person, from_ts in refresh_from.items():
+            db.refresh_dwell_rollup(person, from_ts)
+    timings["rollup"] = time.perf_counter() - stage_start
+
+    snapshot_rows = 0
+    if snapshots or has_snapshots(db.db_path):
+        from db.snapshot import refresh_snapshots
+
+        stage_start = time.perf_counter()
+        snapshot_rows = sum(result.rows_read for result in refresh_snapshots(db, create=True))
+        timings["snapshots"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    imported_at = int(time.time())
+    for file_path, rows in file_rows.items():
+        stat = os.stat(file_path)
+        db.record_imported_file(
+            ImportedFile(
+                path=file_path,
+                size=stat.st_size,
+                mtime=stat.st_mtime,
+                sha256=_file_sha256(file_path),
+                rows=rows,
+                imported_at=imported_at,
+            )
+        )
+    timings["record"] = time.perf_counter() - stage_start
+
+    db.close()
+
+    stage_rows = {"parse": counts["total_entries"], "insert": inserted, "stitch": stitched, "compact": compacted, "snapshots": snapshot_rows, "record": len(file_rows)}
+    for stage, seconds in timings.items():
+        profiling.record(f"import.{stage}", seconds, stage_rows.get(stage))
 
-            # Each top-level key is a person
-            for person, devices in data.items():
-                if not isinstance(devices, dict):
-                    continue
-                for device, entries in devices.items():
-                    if not isinstance(entries, list):
-                        continue
-
-                    # Sort entries by timestamp
-                    entries_sorted = sorted(entries, key=lambda e: e.get("tst", 0))
-                    for i, entry in enumerate(entries_sorted):
-                        if i + 1 < len(entries_sorted):
-                            timestamp_to = entries_sorted[i + 1].get("tst")
-                        else:
-                            continue  # discard the last entry because we don't know a following timestamp
-
-                        timestamp = entry.get("tst")
-                        lat = entry.get("lat")
-                        lon = entry.get("lon")
-                        accuracy = entry.get("acc")
-                        battery = entry.get("batt")
-
-                        total_entries += 1
-
-                        # Skip malformed/invalid coordinates: missing or zero lat/lon
-                        if lat is None or lon is None:
-                            skipped_missing += 1
-                            continue
-                        try:
-                            # treat exact zero as invalid GPS coordinate in this dataset
-                            if float(lat) == 0.0 or float(lon) == 0.0:
-                                skipped_zero += 1
-                                continue
-                        except Exception:
-                            # if lat/lon cannot be cast to float, skip
-                            skipped_invalid += 1
-                            continue
-
-                        # Deduplicate by (person, device, timestamp)
-                        key = (person, device, timestamp)
-                        if key in last_seen:
-                            prev_lat, prev_lon = last_seen[key]
-                            try:
-                                same_lat = float(prev_lat) == float(lat)
-                                same_lon = float(prev_lon) == float(lon)
-                            except Exception:
-                                same_lat = False
-                                same_lon = False
-                            if same_lat and same_lon:
-                                skipped_dup_same += 1
-                                continue
-                            else:
-                                skipped_dup_conflict += 1
-                                # skip the conflicting later entry
-                                continue
-                        # record first-seen coords for this key
-                        last_seen[key] = (lat, lon)
-
-                        bulk_locations.append(
-                            Location(
-                                person=person,
-                                device=device,
-                                timestamp_from=timestamp,
-                                timestamp_to=timestamp_to,
-                                lat=lat,
-                                lon=lon,
-                                accuracy=accuracy,
-                                battery=battery,
-                            )
-                        )
-
-    # Bulk insert all locations at once
-    if bulk_locations:
-        db.insert_locations_bulk(bulk_locations)
     # Print summary
     print(
-        f"Import summary: total_entries={total_entries}, inserted={len(bulk_locations)}, skipped_missing={skipped_missing}, skipped_zero={skipped_zero}, skipped_invalid={skipped_invalid}, skipped_dup_same={skipped_dup_same}, skipped_dup_conflict={skipped_dup_conflict}"
+        f"Import summary: total_entries={counts['total_entries']}, inserted={inserted}, skipped_missing={counts['skipped_missing']}, skipped_zero={counts['skipped_zero']}, skipped_invalid={counts['skipped_invalid']}, skipped_dup_same={skipped_dup_same}, skipped_dup_conflict={skipped_dup_conflict}, stitched={stitched}"
+        + (f", compacted={compacted}" if compact else "")
     )
+    rows_per_second = inserted / timings["insert"] if timings["insert"] > 0 else 0.0
+    print(
+        f"Import timings (jobs={jobs}): "
+        + ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in timings.items())
+        + f", total={sum(timings.values()):.2f}s, insert_rate={rows_per_second:.0f} rows/s"
+    )
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="keep the existing database and only parse new or changed files",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes used to parse files (default: 1)",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="merge stays and drop spikes in the imported rows (see compact/compact.py)",
+    )
+    parser.add_argument(
+        "--snapshots",
+        action="store_true",
+        help="write memory-mapped per-person snapshots (see db/snapshot.py); kept up to date once they exist",
+    )
+    profiling.add_profile_arguments(parser)
+
+
+def main(args: argparse.Namespace):
+    with profiling.profile_session(args):
+        run_import(incremental=args.incremental, jobs=args.jobs, compact=args.compact, snapshots=args.snapshots)
 
 
 if __name__ == "__main__":
-    run_import()
+    # Usage: uv run -m import.import [--incremental] [--jobs N] [--compact] [--snapshots]
+    parser = argparse.ArgumentParser(description="Import Owntracks JSON into SQLite.")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,372 @@
+"""
+server.py
+
+Live ingestion of OwnTracks HTTP-mode location messages into the locations database.
+
+Phones POST their `_type: location` messages to /pub. Points are validated with the same
+rules as the JSON import, queued, and written by a single writer thread: whatever is queued
+when the writer becomes free goes into one batch (group commit), so a burst of hundreds of
+queued points costs a few transactions instead of one per point. A request is answered once
+its points are committed, so a phone only drops points the database has. After each batch
+the previous interval of every affected person/device is closed and the dwell rollup is
+refreshed.
+
+GET /stats returns ingest counters, queue depth and commit latency as JSON.
+
+Usage:
+    uv run -m ingest.server [--host 127.0.0.1] [--port 8083] [--db locations.db]
+
+The server has no authentication or TLS; expose it through a reverse proxy that does both.
+The person and device come from the X-Limit-U/X-Limit-D headers the OwnTracks apps send,
+the u/d query parameters, the basic-auth user, or the message's topic
+(owntracks/<person>/<device>), in that order, with the message's tid as a last resort for
+the device. A request with a location message but no person or device is rejected with
+400. Malformed optional fields (accuracy, battery) are stored as NULL rather than failing
+the batch the point is committed in.
+"""
+
+import argparse
+import asyncio
+import base64
+import importlib
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from db.db import DB_PATH, LocationDB
+
+# "import" is a keyword, so the importer can only be loaded by name
+_importer = importlib.import_module("import.import")
+
+INGEST_PATH = "/pub"
+STATS_PATH = "/stats"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8083
+# Points waiting for the writer; requests wait for room beyond this
+QUEUE_MAX_POINTS = 100_000
+# Most points written in one transaction
+BATCH_MAX_POINTS = 5_000
+MAX_BODY_BYTES = 1 << 20
+# Commit latencies kept for the percentiles in /stats
+LATENCY_WINDOW = 10_000
+# Seconds between stats lines on stdout (0 disables them)
+STATS_INTERVAL = 60
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(message or _REASONS.get(status, ""))
+        self.status = status
+
+
+class IngestStats:
+    """
+    Counters and a window of recent receive-to-commit latencies.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.max_queue_depth = 0
+        self.started = time.time()
+
+    def snapshot(self, queue_depth: int) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "queue_depth": queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "counts": dict(self.counts),
+            "latency_ms": {
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1] * 1000, 2) if latencies else None,
+            },
+        }
+
+
+class _Pending:
+    """
+    Validated rows from one request, resolved once they are committed.
+    """
+
+    __slots__ = ("rows", "received", "done")
+
+    def __init__(self, rows: List[tuple], received: float, done: asyncio.Future):
+        self.rows = rows
+        self.received = received
+        self.done = done
+
+
+class IngestServer:
+    def __init__(self, db_path: str = DB_PATH):
+        self.db = LocationDB(db_path)
+        self.stats = IngestStats()
+        self.queue: Optional[asyncio.Queue] = None
+        # One thread, so every write goes through the same connection
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-writer")
+        self._queued_points = 0
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self.db.create_schema)
+        self.queue = asyncio.Queue()
+        tasks = [asyncio.create_task(self._write_loop())]
+        if STATS_INTERVAL:
+            tasks.append(asyncio.create_task(self._report_loop()))
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        print(f"Listening on http://{host}:{port}{INGEST_PATH} (database {self.db.db_path})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await loop.run_in_executor(self._writer, self.db.close)
+            self._writer.shutdown()
+
+    # HTTP
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body, keep_alive = request
+                    status, payload = await self._route(method, target, headers, body)
+                except HTTPError as e:
+                    status, payload, keep_alive = e.status, {"error": str(e)}, False
+                except Exception as e:
+                    self.stats.counts["errors"] += 1
+                    status, payload, keep_alive = 500, {"error": str(e)}, False
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        url = urlsplit(target)
+        if url.path == STATS_PATH:
+            if method != "GET":
+                raise HTTPError(405)
+            return 200, self.stats.snapshot(self._queued_points)
+        if url.path != INGEST_PATH:
+            raise HTTPError(404)
+        if method != "POST":
+            raise HTTPError(405)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise HTTPError(400, "body is not JSON")
+        messages = payload if isinstance(payload, list) else [payload]
+        rows = self._validate(messages, headers, parse_qs(url.query))
+        if rows:
+            await self._enqueue(rows)
+        # OwnTracks expects a JSON array (of commands for the phone) in the response
+        return 200, []
+
+    def _validate(self, messages: list, headers: Dict[str, str], query: Dict[str, List[str]]) -> List[tuple]:
+        counts = self.stats.counts
+        rows = []
+        for message in messages:
+            if not isinstance(message, dict) or message.get("_type") != "location":
+                counts["ignored_messages"] += 1
+                continue
+            person, device = _identity(message, headers, query)
+            if not person:
+                raise HTTPError(400, "no person: send X-Limit-U, ?u= or basic auth")
+            if not device:
+                # A NULL device escapes the unique index and is never stitched
+                raise HTTPError(400, "no device: send X-Limit-D, ?d=, a topic or tid")
+            timestamp = message.get("tst")
+            if not isinstance(timestamp, int) or isinstance(timestamp, bool):
+                counts["total_entries"] += 1
+                counts["skipped_invalid"] += 1
+                continue
+            # Each point stays open until the next one for the device arrives
+            row = _importer._validate_entry(person, device, message, timestamp, counts)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    # Writing
+
+    async def _enqueue(self, rows: List[tuple]):
+        while self._queued_points >= QUEUE_MAX_POINTS:
+            # Back-pressure: let the writer catch up before accepting more
+            await asyncio.sleep(0.05)
+        pending = _Pending(rows, time.perf_counter(), asyncio.get_running_loop().create_future())
+        self._queued_points += len(rows)
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self._queued_points)
+        self.queue.put_nowait(pending)
+        await pending.done
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            points = len(batch[0].rows)
+            # Group commit: take everything that queued up while the last batch was written
+            while points < BATCH_MAX_POINTS and not self.queue.empty():
+                pending = self.queue.get_nowait()
+                batch.append(pending)
+                points += len(pending.rows)
+            rows = [row for pending in batch for row in pending.rows]
+            try:
+                counts, stitched = await loop.run_in_executor(self._writer, self._write_batch, rows)
+            except Exception as e:
+                self.stats.counts["failed_batches"] += 1
+                for pending in batch:
+                    if not pending.done.done():
+                        pending.done.set_exception(HTTPError(500, f"write failed: {e}"))
+            else:
+                now = time.perf_counter()
+                self.stats.counts["batches"] += 1
+                self.stats.counts["inserted"] += counts.inserted
+                self.stats.counts["skipped_dup_same"] += counts.duplicate_same
+                self.stats.counts["skipped_dup_conflict"] += counts.duplicate_conflict
+                self.stats.counts["stitched"] += stitched
+                for pending in batch:
+                    self.stats.latencies.append(now - pending.received)
+                    if not pending.done.done():
+                        pending.done.set_result(None)
+            finally:
+                self._queued_points -= points
+
+    def _write_batch(self, rows: List[tuple]) -> Tuple[object, int]:
+        """
+        Runs on the writer thread: inserts a batch, then closes the intervals before it.
+        """
+        counts = self.db.insert_location_batches([rows])
+        device_from: Dict[Tuple[str, str], int] = {}
+        device_to: Dict[Tuple[str, str], int] = {}
+        for person, device, timestamp_from, *_ in rows:
+            key = (person, device)
+            if key not in device_from or timestamp_from < device_from[key]:
+                device_from[key] = timestamp_from
+            device_to[key] = max(timestamp_from, device_to.get(key, timestamp_from))
+        stitched = 0
+        for (person, device), from_ts in device_from.items():
+            stitched += self.db.stitch_intervals(person, device, from_ts)
+            self.db.bump_data_versions(person, device, from_ts, device_to[(person, device)])
+        person_from: Dict[str, int] = {}
+        for (person, _), from_ts in device_from.items():
+            person_from[person] = min(from_ts, person_from.get(person, from_ts))
+        for person, from_ts in person_from.items():
+            self.db.refresh_dwell_rollup(person, from_ts)
+        return counts, stitched
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            snapshot = self.stats.snapshot(self._queued_points)
+            counts = snapshot["counts"]
+            latency = snapshot["latency_ms"]
+            print(
+                f"ingest: inserted={counts.get('inserted', 0)} batches={counts.get('batches', 0)} "
+                f"queue={snapshot['queue_depth']} (max {snapshot['max_queue_depth']}) "
+                f"latency p50={latency['p50']}ms p95={latency['p95']}ms max={latency['max']}ms"
+            )
+
+
+def _identity(message: dict, headers: Dict[str, str], query: Dict[str, List[str]]) -> Tuple[Optional[str], Optional[str]]:
+    person = headers.get("x-limit-u") or (query.get("u") or [None])[0]
+    device = headers.get("x-limit-d") or (query.get("d") or [None])[0]
+    if not person and headers.get("authorization", "").lower().startswith("basic "):
+        try:
+            credentials = base64.b64decode(headers["authorization"][6:]).decode()
+            person = credentials.partition(":")[0] or None
+        except ValueError:
+            pass
+    topic = message.get("topic")
+    if isinstance(topic, str) and topic.count("/") >= 2:
+        _, topic_person, topic_device = topic.split("/")[:3]
+        person = person or topic_person
+        device = device or topic_device
+    tid = message.get("tid")
+    return person, device or (tid if isinstance(tid, str) else None)
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    """
+    Reads one HTTP/1.x request. Returns (method, target, headers, body, keep_alive), or
+    None when the client closed the connection.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers: Dict[str, str] = {}
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = header.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "transfer-encoding" in headers:
+        raise HTTPError(411)
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400, "bad Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413)
+    body = await reader.readexactly(length) if length else b""
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    return method.upper(), target, headers, body, keep_alive
+
+
+def _write_response(writer: asyncio.StreamWriter, status: int, payload, keep_alive: bool):
+    body = json.dumps(payload).encode()
+    writer.write(
+        (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        ).encode()
+        + body
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OwnTracks HTTP ingestion server.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--db", default=DB_PATH, help="path of the locations database")
+    args = parser.parse_args()
+    try:
+        asyncio.run(IngestServer(args.db).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
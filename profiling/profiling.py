@@ -0,0 +1,216 @@
+"""
+profiling.py
+
+Stage timers and counters for the hot paths (database queries, geocoding, import stages,
+analysis phases) and the --profile flag the scripts share.
+
+Instrumentation is off unless enable() is called. While off, stage() hands back a shared
+no-op context manager and record()/count() and functions wrapped with timed() return after
+one flag check, so the hooks can stay in the hot paths.
+"""
+
+import argparse
+import functools
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+_enabled = False
+# Geocoding workers record from their own threads
+_lock = threading.Lock()
+
+
+class StageStats:
+    __slots__ = ("calls", "seconds", "rows")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows: Optional[int] = None
+
+
+_stages: Dict[str, StageStats] = {}
+_counters: Counter = Counter()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def record(stage: str, seconds: float, rows: Optional[int] = None):
+    """
+    Adds one call of a stage that took seconds and produced rows (if meaningful).
+    """
+    if not _enabled:
+        return
+    with _lock:
+        stats = _stages.get(stage)
+        if stats is None:
+            stats = _stages[stage] = StageStats()
+        stats.calls += 1
+        stats.seconds += seconds
+        if rows is not None:
+            stats.rows = (stats.rows or 0) + rows
+
+
+def count(name: str, n: float = 1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] += n
+
+
+class _Stage:
+    __slots__ = ("name", "rows", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows: Optional[int] = None
+
+    def __enter__(self) -> "_Stage":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self._start, self.rows)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    # Assigning rows on a disabled stage is allowed and ignored
+    rows = property(lambda self: None, lambda self, value: None)
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str):
+    """
+    Times a block as one call of the named stage; set .rows on the returned object to
+    report how many rows it handled.
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def timed(name: str, rows: Optional[Callable[[object], int]] = None):
+    """
+    Decorator timing every call of a function as the named stage; rows(result) gives the
+    row count to report.
+    """
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            record(name, time.perf_counter() - start, rows(result) if rows else None)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+def stats() -> dict:
+    with _lock:
+        return {
+            "stages": {
+                name: {"calls": s.calls, "seconds": round(s.seconds, 6), "rows": s.rows}
+                for name, s in _stages.items()
+            },
+            "counters": dict(_counters),
+        }
+
+
+def report() -> str:
+    """
+    Returns the per-stage breakdown as a table, slowest stages first, then the counters.
+    """
+    snapshot = stats()
+    lines = [f"{'stage':<36} {'calls':>7} {'total s':>9} {'avg ms':>9} {'rows':>10} {'rows/s':>10}"]
+    for name, s in sorted(snapshot["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        avg_ms = s["seconds"] / s["calls"] * 1000 if s["calls"] else 0.0
+        rows = "" if s["rows"] is None else str(s["rows"])
+        rate = "" if s["rows"] is None or not s["seconds"] else f"{s['rows'] / s['seconds']:.0f}"
+        lines.append(f"{name:<36} {s['calls']:>7} {s['seconds']:>9.3f} {avg_ms:>9.2f} {rows:>10} {rate:>10}")
+    for name, value in sorted(snapshot["counters"].items()):
+        value = f"{value:.3f}" if isinstance(value, float) else str(value)
+        lines.append(f"{name:<36} {value:>7}")
+    return "\n".join(lines)
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print a per-stage timing breakdown to stderr when done",
+    )
+    parser.add_argument(
+        "--profile-out",
+        metavar="PATH",
+        help="also save the stats: cProfile data for .prof/.pstats paths, otherwise stage JSON",
+    )
+
+
+@contextmanager
+def profile_session(args: argparse.Namespace):
+    """
+    Enables instrumentation around a script's work when --profile or --profile-out was
+    given, then prints the breakdown and writes the requested stats file.
+    """
+    profile_out = getattr(args, "profile_out", None)
+    if not getattr(args, "profile", False) and not profile_out:
+        yield
+        return
+    enable()
+    profiler = None
+    if profile_out and profile_out.endswith((".prof", ".pstats")):
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record("total", time.perf_counter() - start)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_out)
+        elif profile_out:
+            with open(profile_out, "w") as f:
+                json.dump(stats(), f, indent=2)
+        print(report(), file=sys.stderr)
+        if profile_out:
+            print(f"Wrote profile to {profile_out}", file=sys.stderr)
@@ -1,28 +1,41 @@
 """
 Script to run percent_minutes_spent_together analysis.
 Usage:
-    uv run scripts/percent_time_together.py [start_date] [end_date]
+    uv run scripts/percent_time_together.py [start_date] [end_date] [--no-cache] [--profile]
     # Dates in YYYY-MM-DD format
 """
 
-import sys
-from analysis.percent_time_together import percent_minutes_spent_together
+import argparse
+from analysis.percent_time_together import seconds_together_per_day
+from analysis.result_cache import add_cache_arguments, configure_cache
+from profiling import profiling
 
 
 def print_minutes_together(start_date, end_date):
-    minutes_per_day = percent_minutes_spent_together(start_date, end_date)
-    for day, minutes in minutes_per_day.items():
-        pct = 100.0 * minutes / 1440
+    per_day = seconds_together_per_day(start_date, end_date)
+    for day, summary in per_day.items():
+        minutes = summary.seconds_together // 60
+        # DST transition days are 23 or 25 hours long
+        pct = 100.0 * summary.seconds_together / summary.day_seconds
         bars = int(round(pct / 100 * 20))
         bar_str = "|" * bars + " " * (20 - bars)
         print(f"{day}: {minutes:4} minutes ({pct:6.2f}%) [{bar_str}]")
 
 
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("start_date", nargs="?")
+    parser.add_argument("end_date", nargs="?")
+    add_cache_arguments(parser)
+    profiling.add_profile_arguments(parser)
+
+
+def main(args: argparse.Namespace):
+    configure_cache(args)
+    with profiling.profile_session(args):
+        print_minutes_together(args.start_date, args.end_date)
+
+
 if __name__ == "__main__":
-    start_date = None
-    end_date = None
-    if len(sys.argv) > 1:
-        start_date = sys.argv[1]
-    if len(sys.argv) > 2:
-        end_date = sys.argv[2]
-    print_minutes_together(start_date, end_date)
+    parser = argparse.ArgumentParser(description="Minutes spent together per day.")
+    add_arguments(parser)
+    main(parser.parse_args())
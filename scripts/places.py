@@ -1,33 +1,90 @@
 """
 Script to run places clustering analysis.
 Usage:
-    uv run scripts/places.py <person> [year]
+    uv run scripts/places.py <person> [year] [--range START END] [--offline] [--gazetteer PATH] [--jobs N] [--no-cache] [--profile]
+    # --range takes YYYY-MM-DD dates and reads the dwell_daily rollup
+    # --jobs N sums monthly shards of the year in N processes
+    # yearly reports are cached in analysis_cache.db until the year's data changes
 """
 
+import argparse
 from time import localtime
-import sys
-from analysis.places import top_locations
+from analysis.places import GEOCODER, top_locations, top_locations_in_range
+from analysis.result_cache import add_cache_arguments, configure_cache
+from profiling import profiling
 
 
-def print_top_locations(person, year):
-    places = top_locations(person, year)
+def print_top_locations(person, year, date_range=None, jobs=1):
+    if date_range:
+        # Rollup cells have no radius
+        places = [(place_info, hours, "") for place_info, hours in top_locations_in_range(person, *date_range)]
+    else:
+        places = [
+            (place_info, cluster.hours, f"{cluster.radius_m:.0f}")
+            for place_info, cluster in top_locations(person, year, jobs=jobs)
+        ]
     print(
-        f"{'Place Name':<30} {'City':<20} {'State':<15} {'Country':<15} {'Time Spent (hours)':>18}"
+        f"{'Place Name':<30} {'City':<20} {'State':<15} {'Country':<15} {'Radius (m)':>10} {'Time Spent (hours)':>18}"
     )
-    print("-" * 102)
-    for place_info, hours in places:
+    print("-" * 113)
+    for place_info, hours, radius in places:
         name = (place_info.name or "")[:30]
         city = (getattr(place_info, "city", "") or "")[:20]
         state = (getattr(place_info, "state", "") or "")[:15]
         country = (getattr(place_info, "country", "") or "")[:15]
-        print(f"{name:<30} {city:<20} {state:<15} {country:<15} {hours:>18.2f}")
+        print(f"{name:<30} {city:<20} {state:<15} {country:<15} {radius:>10} {hours:>18.2f}")
+
+
+def add_geocoder_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="never call the geocoding API; use the nearest cached or gazetteer place",
+    )
+    parser.add_argument(
+        "--gazetteer",
+        help="CSV of known places (lat, lon, name, city, state, country) for offline lookups",
+    )
+
+
+def configure_geocoder(geocoder, args: argparse.Namespace):
+    geocoder.offline = args.offline
+    if args.gazetteer:
+        geocoder.load_gazetteer(args.gazetteer)
+
+
+def add_jobs_argument(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="worker processes for the monthly shards of the range (default: 1, 0 for all CPUs)",
+    )
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("person")
+    parser.add_argument("year", nargs="?", default=str(localtime().tm_year))
+    parser.add_argument(
+        "--range",
+        nargs=2,
+        metavar=("START", "END"),
+        help="local days YYYY-MM-DD (inclusive) instead of a year, from the rollup table",
+    )
+    add_geocoder_arguments(parser)
+    add_jobs_argument(parser)
+    add_cache_arguments(parser)
+    profiling.add_profile_arguments(parser)
+
+
+def main(args: argparse.Namespace):
+    configure_geocoder(GEOCODER, args)
+    configure_cache(args)
+    with profiling.profile_session(args):
+        print_top_locations(args.person, args.year, args.range, args.jobs or None)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        person = sys.argv[1]
-        year = sys.argv[2] if len(sys.argv) > 2 else str(localtime().tm_year)
-    else:
-        print("Usage: uv run scripts/places.py <person> [year]")
-        sys.exit(1)
-    print_top_locations(person, year)
+    parser = argparse.ArgumentParser(description="Top places by time spent.")
+    add_arguments(parser)
+    main(parser.parse_args())
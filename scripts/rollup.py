@@ -0,0 +1,45 @@
+"""
+Script to maintain the dwell_daily rollup table.
+Usage:
+    uv run -m scripts.rollup rebuild [person] [--profile]
+    uv run -m scripts.rollup check [person] [--profile]
+"""
+
+import argparse
+import sys
+from db.db import LocationDB
+from profiling import profiling
+
+
+def rebuild(person=None):
+    with LocationDB() as db:
+        db.create_schema()
+        db.refresh_dwell_rollup(person)
+    print(f"Rebuilt dwell_daily for {person or 'everyone'}")
+
+
+def check(person=None) -> bool:
+    with LocationDB() as db:
+        mismatches = db.check_dwell_rollup(person)
+    for m in mismatches:
+        print(f"{m.person} {m.day}: rollup={m.rollup_seconds}s raw={m.raw_seconds}s")
+    print(f"{len(mismatches)} mismatched days")
+    return not mismatches
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("command", choices=("rebuild", "check"))
+    parser.add_argument("person", nargs="?")
+    profiling.add_profile_arguments(parser)
+
+
+def main(args: argparse.Namespace) -> int:
+    with profiling.profile_session(args):
+        ok = rebuild(args.person) if args.command == "rebuild" else check(args.person)
+    return 0 if ok is not False else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the dwell_daily rollup table.")
+    add_arguments(parser)
+    sys.exit(main(parser.parse_args()))
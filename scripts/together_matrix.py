@@ -0,0 +1,65 @@
+"""
+Script to print how much time every pair of people spent together.
+Usage:
+    uv run -m scripts.together_matrix [start_date] [end_date] [--people a,b,c] [--jobs N]
+                                      [--csv daily|monthly] [--profile]
+    # Dates in YYYY-MM-DD format; the year to date by default
+    # Without --csv prints an N x N matrix of the percent of jointly known time spent together
+"""
+
+import argparse
+import csv
+import sys
+from analysis.colocation import by_month, default_range, seconds_together_all_pairs, together_matrix
+from profiling import profiling
+
+
+def print_matrix(rows, people):
+    together, known = together_matrix(rows, people)
+    width = max([len(p) for p in people] + [6])
+    print(" " * width + "".join(f" {p:>{width}}" for p in people))
+    for i, person in enumerate(people):
+        cells = []
+        for j in range(len(people)):
+            if i == j or not known[i, j]:
+                cells.append(f" {'-':>{width}}")
+            else:
+                cells.append(f" {100.0 * together[i, j] / known[i, j]:>{width - 1}.1f}%")
+        print(f"{person:<{width}}" + "".join(cells))
+
+
+def write_csv(rows, period):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["person_a", "person_b", period, "seconds_together", "seconds_known"])
+    writer.writerows(rows)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("start_date", nargs="?")
+    parser.add_argument("end_date", nargs="?")
+    parser.add_argument("--people", help="comma-separated people (default: everyone in the database)")
+    parser.add_argument("--jobs", type=int, help="worker processes (default: all CPUs)")
+    parser.add_argument("--csv", choices=("daily", "monthly"), help="write the tidy table as CSV instead")
+    profiling.add_profile_arguments(parser)
+
+
+def main(args: argparse.Namespace):
+    start_date, end_date = default_range()
+    start_date = args.start_date or start_date
+    end_date = args.end_date or end_date
+    people = [p.strip() for p in args.people.split(",") if p.strip()] if args.people else None
+    with profiling.profile_session(args):
+        rows = seconds_together_all_pairs(start_date, end_date, people, jobs=args.jobs)
+        if args.csv == "daily":
+            write_csv(rows, "day")
+        elif args.csv == "monthly":
+            write_csv(by_month(rows), "month")
+        else:
+            names = sorted(set(people) if people else {p for row in rows for p in row[:2]})
+            print_matrix(rows, names)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time together for every pair of people.")
+    add_arguments(parser)
+    main(parser.parse_args())
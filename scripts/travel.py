@@ -1,11 +1,14 @@
 """
 Script to invoke travel episode detection (stub).
 Usage:
-    uv run -m scripts.travel <person> [start_date] [end_date]
+    uv run -m scripts.travel <person> [start_date] [end_date] [--offline] [--gazetteer PATH] [--jobs N] [--no-cache] [--profile]
 """
-import sys
+import argparse
 from analysis.distance_apart import haversine
-from analysis.travel import Travel, detect_travel
+from analysis.result_cache import add_cache_arguments, configure_cache
+from analysis.travel import GEOCODER, Travel, detect_travel
+from scripts.places import add_geocoder_arguments, add_jobs_argument, configure_geocoder
+from profiling import profiling
 from datetime import datetime
 
 
@@ -41,11 +44,11 @@ def _print_travel_line(travel: Travel):
     print(f"{start_date:<12} {start_time:<8} {end_date:<12} {end_time:<8} {start_place:<30} {start_state:<15} {end_place:<30} {end_state:<15} {distance:>8.2f} miles  {duration_hhmm:>6} time {speed:>8.2f} mph")
 
 
-def _print_travels(person, start_date, end_date):
+def print_travels(person, start_date, end_date, jobs=1):
     """
     Prints a table for Travel segments. 
     """
-    travels = detect_travel(person, start_date, end_date)
+    travels = detect_travel(person, start_date, end_date, jobs=jobs)
 
     print(f"Travel segments for {person}:")
     print(f"{'Start Date':<12} {'Time':<8} {'End Date':<12} {'Time':<8} {'Start Place':<46} {'End Place':<46} {'Distance':>14} {'Time':>12} {'Speed':>12}")
@@ -53,11 +56,24 @@ def _print_travels(person, start_date, end_date):
     for segment in travels:
         _print_travel_line(segment)
 
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("person")
+    parser.add_argument("start_date", nargs="?")
+    parser.add_argument("end_date", nargs="?")
+    add_geocoder_arguments(parser)
+    add_jobs_argument(parser)
+    add_cache_arguments(parser)
+    profiling.add_profile_arguments(parser)
+
+
+def main(args: argparse.Namespace):
+    configure_geocoder(GEOCODER, args)
+    configure_cache(args)
+    with profiling.profile_session(args):
+        print_travels(args.person, args.start_date, args.end_date, args.jobs or None)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: uv run -m scripts.travel <person> [start_date] [end_date]")
-        sys.exit(1)
-    person = sys.argv[1]
-    start_date = sys.argv[2] if len(sys.argv) > 2 else None
-    end_date = sys.argv[3] if len(sys.argv) > 3 else None
-    _print_travels(person, start_date, end_date)
+    parser = argparse.ArgumentParser(description="Detect travel episodes.")
+    add_arguments(parser)
+    main(parser.parse_args())
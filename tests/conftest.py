@@ -0,0 +1,14 @@
+import pytest
+
+from db.db import LocationDB
+
+
+@pytest.fixture
+def location_db(tmp_path):
+    """
+    An empty LocationDB with the full schema in a temporary directory.
+    """
+    db = LocationDB(str(tmp_path / "locations.db"))
+    db.create_schema()
+    yield db
+    db.close()
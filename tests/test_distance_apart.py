@@ -0,0 +1,58 @@
+import numpy as np
+
+from analysis.distance_apart import sample_locations
+from db.location_array import LocationArray
+
+
+def _intervals(rows):
+    """
+    LocationArray from (device, timestamp_from, timestamp_to, lat, lon) rows.
+    """
+    rows = sorted(rows, key=lambda row: row[1])
+    devices = sorted({row[0] for row in rows})
+    n = len(rows)
+    return LocationArray(
+        timestamp_from=np.array([row[1] for row in rows], dtype=np.int64),
+        timestamp_to=np.array([row[2] for row in rows], dtype=np.int64),
+        lat=np.array([row[3] for row in rows], dtype=np.float64),
+        lon=np.array([row[4] for row in rows], dtype=np.float64),
+        accuracy=np.full(n, np.nan, dtype=np.float32),
+        battery=np.full(n, np.nan, dtype=np.float32),
+        person_codes=np.zeros(n, dtype=np.int32),
+        persons=("jackie",),
+        device_codes=np.array([devices.index(row[0]) for row in rows], dtype=np.int32),
+        devices=devices,
+    )
+
+
+def test_sample_locations_single_device():
+    intervals = _intervals(
+        [("phone", 100, 200, 1.0, 1.0), ("phone", 200, 300, 2.0, 2.0), ("phone", 400, 400, 3.0, 3.0)]
+    )
+    lat, lon = sample_locations(intervals, np.array([50, 100, 199, 200, 299, 300, 400, 500]))
+    np.testing.assert_array_equal(lat, [np.nan, 1.0, 1.0, 2.0, 2.0, np.nan, np.nan, np.nan])
+    np.testing.assert_array_equal(lon, lat)
+
+
+def test_sample_locations_overlapping_devices():
+    # A watch reports briefly while the phone's long interval is still open
+    intervals = _intervals(
+        [
+            ("phone", 0, 1000, 1.0, 1.0),
+            ("watch", 100, 150, 2.0, 2.0),
+            ("watch", 150, 200, 3.0, 3.0),
+            ("phone", 1000, 1100, 4.0, 4.0),
+        ]
+    )
+    timestamps = np.array([50, 120, 160, 200, 500, 999, 1000, 1100])
+    lat, _ = sample_locations(intervals, timestamps)
+    np.testing.assert_array_equal(lat, [1.0, 2.0, 3.0, 1.0, 1.0, 1.0, 4.0, np.nan])
+    # Same answer as scanning for the latest-starting interval containing each timestamp
+    expected = []
+    for ts in timestamps:
+        containing = [
+            i for i in range(len(intervals)) if intervals.timestamp_from[i] <= ts < intervals.timestamp_to[i]
+        ]
+        latest = max(containing, key=lambda i: intervals.timestamp_from[i], default=None)
+        expected.append(np.nan if latest is None else intervals.lat[latest])
+    np.testing.assert_array_equal(lat, expected)
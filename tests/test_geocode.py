@@ -0,0 +1,22 @@
+import threading
+
+from geocode.geocode import Geocoder
+
+
+def test_worker_threads_share_one_session(tmp_path):
+    geocoder = Geocoder(cache_file=str(tmp_path / "geocode_cache.db"), workers=8)
+    barrier = threading.Barrier(8)
+    sessions = []
+
+    def get_session():
+        barrier.wait()
+        sessions.append(geocoder._get_session())
+
+    threads = [threading.Thread(target=get_session) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(sessions) == 8
+    assert all(session is sessions[0] for session in sessions)
+    assert sessions[0].headers["User-Agent"] == "owntracks-analysis-script"
@@ -0,0 +1,65 @@
+import importlib
+import json
+from collections import Counter
+
+from db.db import LocationDB
+from profiling import profiling
+
+importer = importlib.import_module("import.import")
+
+
+def test_file_rows_sorted_per_device(tmp_path):
+    path = tmp_path / "2024.json"
+    path.write_text(
+        json.dumps(
+            {
+                "jackie": {
+                    "phone": [
+                        {"tst": 300, "lat": 1.0, "lon": 1.0},
+                        {"tst": 100, "lat": 2.0, "lon": 2.0},
+                        {"tst": 200, "lat": 3.0, "lon": 3.0},
+                    ],
+                    "watch": [{"tst": 150, "lat": 4.0, "lon": 4.0}],
+                }
+            }
+        )
+    )
+    counts = Counter()
+    rows = [row[:6] for row in importer._iter_file_rows(str(path), counts)]
+    assert rows == [
+        ("jackie", "phone", 100, 200, 2.0, 2.0),
+        ("jackie", "phone", 200, 300, 3.0, 3.0),
+        # The newest entry stays open, whatever its position in the file
+        ("jackie", "phone", 300, 300, 1.0, 1.0),
+        ("jackie", "watch", 150, 150, 4.0, 4.0),
+    ]
+    assert counts["total_entries"] == 4
+
+
+def test_run_import_with_profiling(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / importer.JSON_DIR).mkdir()
+    (tmp_path / importer.JSON_DIR / "2024.json").write_text(
+        json.dumps(
+            {
+                "jackie": {
+                    "phone": [
+                        {"tst": 1_700_000_000 + 60 * i, "lat": 42.36 + i * 0.001, "lon": -71.06}
+                        for i in range(10)
+                    ]
+                }
+            }
+        )
+    )
+    profiling.reset()
+    profiling.enable()
+    try:
+        importer.run_import()
+        stages = profiling.stats()["stages"]
+    finally:
+        profiling.disable()
+        profiling.reset()
+    assert stages["db.insert_location_batches"]["rows"] == 10
+    assert stages["db.stitch_intervals"]["calls"] == 1
+    with LocationDB() as db:
+        assert len(db.get_locations("jackie")) == 10
@@ -0,0 +1,46 @@
+from analysis import travel
+from analysis.result_cache import ResultCache
+from benchmarks.travel_regression import synthetic_trace
+from geocode.geocode import ZOOM, Geocoder
+from profiling import profiling
+
+
+def test_failed_geocoding_is_not_cached_with_the_result(location_db, tmp_path, monkeypatch):
+    location_db.insert_locations_bulk(synthetic_trace(1, 3))
+    # Nothing listens on the discard port, so every request fails
+    geocoder = Geocoder(
+        cache_file=str(tmp_path / "geocode_cache.db"),
+        url="http://127.0.0.1:9/reverse",
+        requests_per_second=1000.0,
+        negative_ttl=0,
+    )
+    monkeypatch.setattr(travel, "DB", location_db)
+    monkeypatch.setattr(travel, "GEOCODER", geocoder)
+    monkeypatch.setattr(travel, "RESULTS", ResultCache(str(tmp_path / "analysis_cache.db")))
+
+    first = travel.detect_travel("synthetic", "2023-11-14", "2023-11-18")
+    assert first
+    assert all(trip.start_place.display_name == "Unknown" for trip in first)
+
+    # The service answers again
+    for trip in first:
+        for point in (trip.start_point, trip.end_point):
+            geocoder.cache.put(
+                round(point.lat, 2),
+                round(point.lon, 2),
+                ZOOM,
+                {"name": "Boston", "display_name": "Boston, MA", "address": {"city": "Boston"}},
+            )
+    geocoder.cache.flush()
+
+    profiling.reset()
+    profiling.enable()
+    try:
+        second = travel.detect_travel("synthetic", "2023-11-14", "2023-11-18")
+        counters = profiling.stats()["counters"]
+    finally:
+        profiling.disable()
+        profiling.reset()
+    assert counters["results.hits"] == 1
+    assert [(trip.start_ts, trip.end_ts) for trip in second] == [(trip.start_ts, trip.end_ts) for trip in first]
+    assert all(trip.start_place.city == "Boston" and trip.end_place.city == "Boston" for trip in second)
@@ -0,0 +1,114 @@
+"""
+The single-pass travel detector against the original one kept in
+benchmarks.travel_regression, with small detector blocks and over month shards.
+"""
+
+import time
+from datetime import date
+from functools import lru_cache
+from typing import List, Tuple
+
+import pytest
+
+from analysis import sharding, travel
+from benchmarks.travel_regression import legacy_find_all_travel_locations, synthetic_trace
+from db.db import Location
+from profiling import profiling
+
+BLOCK_SIZES = [2, 16, 256, travel.DETECTOR_BLOCK_POINTS]
+
+
+def _month_edge() -> int:
+    # The synthetic traces start in mid-November 2023; shards split at local midnights
+    return int(time.mktime(date(2023, 12, 1).timetuple()))
+
+
+def _shifted(locations: List[Location], seconds: int) -> List[Location]:
+    return [
+        Location(loc, timestamp_from=loc["timestamp_from"] + seconds, timestamp_to=loc["timestamp_to"] + seconds)
+        for loc in locations
+    ]
+
+
+@lru_cache
+def _legacy_case(seed: int, days: int, across_month_edge: bool = False) -> Tuple[List[Location], list]:
+    """
+    Returns a synthetic trace and its episodes from the legacy detector, which is slow, so
+    each is computed once. With across_month_edge the trace is shifted so the midpoint of
+    its longest episode falls on a month edge.
+    """
+    locations = synthetic_trace(seed, days)
+    episodes = legacy_find_all_travel_locations(locations)
+    if across_month_edge:
+        start, end = max(episodes, key=lambda episode: episode[1]["timestamp_from"] - episode[0]["timestamp_from"])
+        locations = _shifted(locations, _month_edge() - (start["timestamp_from"] + end["timestamp_from"]) // 2)
+        episodes = legacy_find_all_travel_locations(locations)
+    return locations, episodes
+
+
+@lru_cache
+def _single_pass_case(seed: int, days: int) -> Tuple[List[Location], list]:
+    """
+    Returns a synthetic trace and its episodes from the single-pass detector.
+    """
+    locations = synthetic_trace(seed, days)
+    return locations, travel._find_all_travel_locations(locations)
+
+
+def _sharded(location_db, monkeypatch, locations: List[Location], shard_months: int):
+    location_db.insert_locations_bulk(locations)
+    monkeypatch.setattr(travel, "DB", location_db)
+    start_ts = locations[0]["timestamp_from"]
+    end_ts = locations[-1]["timestamp_from"] + 1
+    return travel._find_travel_sharded("synthetic", start_ts, end_ts, jobs=1, shard_months=shard_months)
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+@pytest.mark.parametrize("seed,days", [(1, 3), (2, 14)])
+def test_matches_legacy_detector(monkeypatch, block_size, seed, days):
+    monkeypatch.setattr(travel, "DETECTOR_BLOCK_POINTS", block_size)
+    locations, expected = _legacy_case(seed, days)
+    assert expected
+    # A generator, so the streaming path is what gets tested
+    assert list(travel.iter_travel_locations(loc for loc in locations)) == expected
+
+
+@pytest.mark.parametrize("block_size", [16, travel.DETECTOR_BLOCK_POINTS])
+@pytest.mark.parametrize("shard_months", [1, 2])
+def test_sharded_matches_legacy_across_month_edge(location_db, monkeypatch, block_size, shard_months):
+    monkeypatch.setattr(travel, "DETECTOR_BLOCK_POINTS", block_size)
+    locations, expected = _legacy_case(2, 14, across_month_edge=True)
+    assert any(start["timestamp_from"] < _month_edge() <= end["timestamp_from"] for start, end in expected)
+    assert _sharded(location_db, monkeypatch, locations, shard_months) == expected
+
+
+@pytest.mark.parametrize("block_size", [16, travel.DETECTOR_BLOCK_POINTS])
+@pytest.mark.parametrize("shard_months", [1, 2, 3])
+def test_sharded_matches_single_pass(location_db, monkeypatch, block_size, shard_months):
+    monkeypatch.setattr(travel, "DETECTOR_BLOCK_POINTS", block_size)
+    # About four months, so there are several shards of each size
+    locations, expected = _single_pass_case(4, 120)
+    assert len(expected) > 100
+    assert _sharded(location_db, monkeypatch, locations, shard_months) == expected
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_detect_stage_counts_points_scanned(location_db, monkeypatch, jobs):
+    locations, expected = _legacy_case(2, 14, across_month_edge=True)
+    location_db.insert_locations_bulk(locations)
+    monkeypatch.setattr(travel, "DB", location_db)
+    # Worker processes would not see the patched DB; the shards run in this one instead
+    monkeypatch.setattr(travel, "map_shards", lambda func, shards, jobs: sharding.map_shards(func, shards, 1))
+    start_ts = locations[0]["timestamp_from"]
+    end_ts = locations[-1]["timestamp_from"] + 1
+    profiling.reset()
+    profiling.enable()
+    try:
+        segments = travel._travel_segments("synthetic", start_ts, end_ts, jobs, shard_months=1)
+        stats = profiling.stats()
+    finally:
+        profiling.disable()
+        profiling.reset()
+    assert segments == expected
+    assert stats["stages"]["travel.detect"]["rows"] == len(locations)
+    assert stats["counters"]["travel.segments"] == len(expected)